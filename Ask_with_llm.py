@@ -1,15 +1,28 @@
 from functions import *
 import requests
+import httpx
 import time
+from executors import run_blocking
+from llm_client import ollama_client, LLM_MODELS, LLMError
+from llm_scheduler import llm_scheduler
+from context_packer import (get_token_counter, set_token_counter, pack_chunks, pack_history,
+                            format_chunks, section_budget, prompt_usage, QNA_CONTEXT_TOKENS,
+                            QNA_HISTORY_TOKENS, LLM_CONTEXT_WINDOW, LLM_ANSWER_TOKENS)
+from prompt_cache import prompt_state_cache, SessionPromptState, chunk_key, PLAIN_MARKERS, PHI3_MARKERS
+from collections import namedtuple
+from answer_cache import answer_cache, make_key, ANSWER_CACHE_ENABLED
+from metrics import timed
 import subprocess, sys
-from llama_cpp import Llama
 import gc
+CHAT_OPTIONS = {"temperature": 0.3, "top_p": 0.5}
 Model_path="/Users/rahulchoudhary/llama.cpp/models/phi3/Phi-3-mini-128k-instruct.Q4_K_M.gguf"
 # Global variable declaration
 llm_instance = None
 
 def load_llm_silently(ctx_size, model_path=Model_path):
     global llm_instance
+    # Imported here so the Ollama-only server does not need llama_cpp installed
+    from llama_cpp import Llama
     devnull = open(os.devnull, "w")
     old_stderr = sys.stderr
     sys.stderr = devnull
@@ -23,6 +36,8 @@ def load_llm_silently(ctx_size, model_path=Model_path):
             verbose=False,
             use_mlock=True     # Keep model in memory
         )
+        # Budget prompts with this model's own tokenizer
+        set_token_counter(lambda text: len(llm_instance.tokenize(text.encode("utf-8"), add_bos=False)))
         return llm_instance
     finally:
         sys.stderr = old_stderr
@@ -30,22 +45,191 @@ def load_llm_silently(ctx_size, model_path=Model_path):
 
 
 
-def ask_llm(query: str, session_id: str, chat_history: list = None) -> str:
-    prompt = prompt_for_QnA(query, session_id, chat_history)
-    start = time.time()
-    response = requests.post("http://localhost:11434/api/generate", json={
-        "model": "llama3-14b-custom",
-        "prompt": prompt,
-        "stream": False,
-        "temperature": 0.3,
-        "top_p": 0.5
-    })
-    latency = time.time() - start
-    if response.status_code == 200:
-        return response.json()["response"], latency
+# Session prompt layout: fixed instructions first, then one block per turn appended
+# after the previous answer, so the model's cached prefix stays valid from turn to turn.
+QNA_SESSION_INSTRUCTIONS = """
+You are a helpful and concise teaching assistant with conversation memory.
+
+Your job is to answer ONLY using the content given in this conversation and the conversation history. 
+If unsure, say 'Not found in the materials'.
+
+RESPONSE RULES:
+1. First check if this question relates to previous conversation topics
+2. For subject questions (Science/Social Science etc.):
+   - Start with definition/core concept if found
+   - Otherwise give 30-40 word explanation
+3. Include 2-3 key bullet points (50-60 words total)
+4. Keep response under 150 words
+5. Maintain natural conversation flow using history context
+5. NEVER:
+   -Say "Hello" or introduce yourself unless asked
+   - Use general knowledge 
+   - Reference chat history
+   - Say "as mentioned before" or similar phrases
+
+FORMATTING:
+- Use Markdown for clarity
+- Bold important terms
+- Use bullet points for key takeaways
+- Keep paragraphs short
+"""
+
+PHI3_SESSION_INSTRUCTIONS = """
+You are a concise teaching assistant specialized in Social Science and History. 
+Answer using ONLY the provided context - never use general knowledge.
+
+# RESPONSE STRUCTURE
+1. First: Briefly connect to previous topics (1 sentence)
+2. Second: State core concept in bold (max 15 words)
+3. Third: Provide 30-40 word explanation
+4. Fourth: 2-3 bullet points of key insights
+5. Use Markdown formatting
+
+# FORMAT RULES
+- Do NOT use section headers like "Relation" or "Core Concept"
+- Do NOT mention "Key Insights" - just present bullet points
+- Never include ending markers like "---END CONTENT---"
+- Keep total response 120-150 words
+- Maintain natural flow between sections
+"""
+
+QNA_TURN_TEMPLATE = """
+---CONTENT START---
+{content}
+---CONTENT END---
+
+Current Question: {query}
+"""
+
+NO_NEW_CONTENT = "(No new material for this question; use the content given earlier.)"
+
+SessionTurn = namedtuple("SessionTurn", ["state", "prompt", "chunk_keys", "usage"])
+
+
+@timed("prompt_build")
+def _render_session_turn(query, state, chat_history, retrieved, markers, instructions, count_tokens):
+    # Chunks already shown earlier in the conversation are in the model's context
+    new_chunks = [chunk for chunk in retrieved if chunk_key(chunk) not in state.seen_chunks]
+    context = pack_chunks(new_chunks, QNA_CONTEXT_TOKENS, count_tokens)
+    content = format_chunks(context.items) or NO_NEW_CONTENT
+    prompt = markers.user + QNA_TURN_TEMPLATE.format(content=content, query=query) + markers.end + markers.assistant
+
+    history_tokens = 0
+    if not state.turns:
+        history = pack_history(chat_history, QNA_HISTORY_TOKENS, count_tokens)
+        head = instructions
+        if history.items:
+            head += "\n---CONVERSATION HISTORY---\n" + "".join(history.items)
+        prompt = markers.system + head + markers.end + prompt
+        history_tokens = history.tokens
+
+    usage = prompt_usage(prompt, count_tokens, context=context.tokens, history=history_tokens,
+                         question=count_tokens(query))
+    usage["cached_tokens"] = state.n_tokens
+    usage["chunks_used"] = len(context.items)
+    usage["chunks_already_in_context"] = len(retrieved) - len(new_chunks)
+    return SessionTurn(state, prompt, [chunk_key(new_chunks[i]) for i in context.sources], usage)
+
+
+def begin_session_turn(query, session_id, chat_history=None, retrieved=None, backend="ollama",
+                       markers=PLAIN_MARKERS, instructions=QNA_SESSION_INSTRUCTIONS, window=LLM_CONTEXT_WINDOW):
+    """Prompt for the next chat turn, continuing the session's cached model state.
+
+    Only the new turn is sent: chunks not shown earlier in the session and the
+    question. A new session, or one whose conversation would no longer fit the
+    window, starts over from the instructions and the recent history that fits.
+    """
+    if retrieved is None:
+        retrieved = retrieve_top_chunks_hybrid(query, 5, session_id)
+    count_tokens = get_token_counter()
+    state = prompt_state_cache.get(session_id, backend) or SessionPromptState(session_id, backend)
+    turn = _render_session_turn(query, state, chat_history, retrieved, markers, instructions, count_tokens)
+    if state.turns and state.n_tokens + turn.usage["total"] + LLM_ANSWER_TOKENS > window:
+        prompt_state_cache.record_reset()
+        state = SessionPromptState(session_id, backend)
+        turn = _render_session_turn(query, state, chat_history, retrieved, markers, instructions, count_tokens)
+    return turn
+
+
+def ollama_carry_over(turn):
+    """Request fields that continue from the session's Ollama context"""
+    if turn.state.context is None:
+        return {}
+    return {"context": turn.state.context.tolist()}
+
+
+def end_session_turn(turn, result):
+    """Keep the context Ollama returned so the next turn resumes from it"""
+    context = result.get("context")
+    if not context:
+        return
+    turn.state.record_turn(turn.chunk_keys, context=context)
+    prompt_state_cache.put(turn.state)
+
+
+def finish_turn(turn, result, key, answer=None):
+    """Keep the session's new model context and file the answer for reuse (blocking: both hit the session store)"""
+    end_session_turn(turn, result)
+    if key is not None:
+        answer_cache.store(key, result["response"] if answer is None else answer)
+
+
+def retrieve_for_answer(query, session_id, top_k=5, use_cache=True, return_scores=False):
+    """Retrieve chunks for a chat question and look the question up in the answer cache.
+
+    Returns (retrieved, key, cached_answer). `key` is None when the cache is
+    off or bypassed; `cached_answer` is None on a miss.
+    """
+    if not (ANSWER_CACHE_ENABLED and use_cache):
+        if ANSWER_CACHE_ENABLED:
+            answer_cache.record_bypass()
+        return retrieve_top_chunks_hybrid(query, top_k, session_id, return_scores=return_scores), None, None
+    # One encode serves both the FAISS search and the cache key
+    query_embed = encode_query(query)
+    ids, scores, chunks = hybrid_search(query, top_k, session_id, query_embed=query_embed)
+    key = make_key(session_content_hash(session_id), query_embed, ids)
+    if return_scores:
+        retrieved = [(chunks[i], float(score)) for i, score in zip(ids, scores)]
     else:
-        print("Error:", response.status_code, response.text)
+        retrieved = [chunks[i] for i in ids]
+    return retrieved, key, answer_cache.lookup(key)
+
+
+def ask_llm(query: str, session_id: str, chat_history: list = None, use_cache: bool = True) -> str:
+    start = time.time()
+    retrieved, key, cached = retrieve_for_answer(query, session_id, use_cache=use_cache)
+    if cached is not None:
+        return cached, time.time() - start
+    turn = begin_session_turn(query, session_id, chat_history, retrieved)
+    start = time.time()
+    try:
+        result = ollama_client.generate_full(turn.prompt, model=LLM_MODELS["chat"], options=CHAT_OPTIONS,
+                                             session_id=session_id, **ollama_carry_over(turn))
+    except (LLMError, requests.RequestException) as e:
+        print("Error:", e)
         return "Something went wrong!"
+    finish_turn(turn, result, key)
+    latency = time.time() - start
+    return result["response"], latency
+
+
+async def ask_llm_async(query: str, session_id: str, chat_history: list = None, use_cache: bool = True):
+    """Event-loop friendly ask_llm: retrieval runs on the I/O pool, generation over async HTTP"""
+    start = time.time()
+    retrieved, key, cached = await run_blocking(retrieve_for_answer, query, session_id, use_cache=use_cache)
+    if cached is not None:
+        return cached, time.time() - start
+    turn = await run_blocking(begin_session_turn, query, session_id, chat_history, retrieved)
+    start = time.time()
+    try:
+        result = await ollama_client.agenerate_full(turn.prompt, model=LLM_MODELS["chat"], options=CHAT_OPTIONS,
+                                                    session_id=session_id, **ollama_carry_over(turn))
+    except (LLMError, httpx.HTTPError) as e:
+        print("Error:", e)
+        return "Something went wrong!", time.time() - start
+    # Both write to the shared session store
+    await run_blocking(finish_turn, turn, result, key)
+    return result["response"], time.time() - start
 
 
 # Config
@@ -58,36 +242,43 @@ def ask_phi3(query: str, session_id: str) -> str:
     
     try:
         # Use the already loaded llm instance
-        output = llm.create_completion(
-            prompt,
-            max_tokens=150,
-            echo=False  # don't include the prompt in the output
-        )
+        with llm_scheduler.slot("chat", session_id):
+            output = llm.create_completion(
+                prompt,
+                max_tokens=150,
+                echo=False  # don't include the prompt in the output
+            )
         return output["choices"][0]["text"].strip()
     except Exception as e:
         print("Error:", str(e))
         return "Something went wrong!"
 
 # The llm instance is already loaded globally
-def prompt_for_QnA(query: str, session_id: str, chat_history: list = None) -> str:
-    """Generate prompt with context and chat history"""
-    retrieved = retrieve_top_chunks_hybrid(query, 5, session_id)
-    
-    # Format chat history if provided
-    history_context = ""
-    history_context = "\n\n---CONVERSATION HISTORY---\n"
-    for i, msg in enumerate(chat_history):  # Only take last 3 messages
-        speaker = "USER" if msg["role"] == "user" else "ASSISTANT"
-        history_context += f"{speaker}: {msg['content']}\n"
-    
-    prompt = f"""
+@timed("prompt_build")
+def prompt_for_QnA(query: str, session_id: str, chat_history: list = None, retrieved: list = None,
+                   return_usage: bool = False):
+    """Generate prompt with context and chat history (pass `retrieved` to skip retrieval).
+
+    Retrieved chunks and history are packed into token budgets; with
+    return_usage=True the tokens used per prompt section are returned too.
+    """
+    if retrieved is None:
+        retrieved = retrieve_top_chunks_hybrid(query, 5, session_id)
+    count_tokens = get_token_counter()
+
+    # Most recent turns that fit the history budget
+    history = pack_history(chat_history, QNA_HISTORY_TOKENS, count_tokens)
+    history_context = "\n\n---CONVERSATION HISTORY---\n" + "".join(history.items)
+
+    def render(content):
+        return f"""
 You are a helpful and concise teaching assistant with conversation memory.
 
 Your job is to answer ONLY using the context below and the conversation history. 
 If unsure, say 'Not found in the materials'.
 
 ---CONTENT START---
-{retrieved}
+{content}
 ---CONTENT END---
 {history_context}
 
@@ -113,6 +304,15 @@ FORMATTING:
 - Use bullet points for key takeaways
 - Keep paragraphs short
 """
+
+    context = pack_chunks(retrieved, section_budget(QNA_CONTEXT_TOKENS, count_tokens(render(""))), count_tokens)
+    prompt = render(format_chunks(context.items))
+    if return_usage:
+        usage = prompt_usage(prompt, count_tokens, context=context.tokens, history=history.tokens,
+                             question=count_tokens(query))
+        usage["chunks_used"] = len(context.items)
+        usage["chunks_dropped"] = context.dropped
+        return prompt, usage
     return prompt
 
 def prompt_for_QnA1(query):
@@ -190,10 +390,23 @@ session_id = "test_session"
 
 # Then loop or serve API
 def get_llm_answer(user_input, session_id):
-    prompt = prompt_for_QnA2(user_input, session_id)
+    turn = begin_session_turn(user_input, session_id, backend="llama_cpp", markers=PHI3_MARKERS,
+                              instructions=PHI3_SESSION_INSTRUCTIONS, window=llm_instance.n_ctx())
+    state = turn.state
+    prompt = state.transcript + turn.prompt
     start = time.time()
-    response = llm_instance(prompt, stop=["<|user|>", "<|end|>"], temperature=0.3, max_tokens=512)
-    return response["choices"][0]["text"], time.time()-start
+    with llm_scheduler.slot("chat", session_id):
+        if state.llama_state is not None:
+            # Restore this session's KV cache; llama_cpp then evaluates only the tokens after the shared prefix
+            llm_instance.load_state(state.llama_state)
+        response = llm_instance(prompt, stop=["<|user|>", "<|end|>"], temperature=0.3, max_tokens=512)
+        answer = response["choices"][0]["text"]
+        llama_state = llm_instance.save_state()
+        n_tokens = llm_instance.n_tokens
+    state.record_turn(turn.chunk_keys, llama_state=llama_state,
+                      transcript=prompt + answer + PHI3_MARKERS.end, n_tokens=n_tokens)
+    prompt_state_cache.put(state)
+    return answer, time.time()-start
 
 def unload_llm_Phi_3():
     """Release LLM resources and clean up memory"""
@@ -201,6 +414,9 @@ def unload_llm_Phi_3():
     
     if llm_instance is not None:
         print("Unloading LLM and releasing resources...")
+        # KV snapshots belong to this model instance
+        prompt_state_cache.clear()
+        Llama = type(llm_instance)
         
         # 1. Explicitly delete the model instance
         del llm_instance
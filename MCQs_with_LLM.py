@@ -8,6 +8,8 @@ import random
 import logging
 import ast
 import re
+from llm_client import ollama_client, LLM_MODELS, LLMError
+from context_packer import get_token_counter, pack_chunks, format_chunks, section_budget, prompt_usage, MCQ_CONTEXT_TOKENS
 
 # Configure logging
 logging.basicConfig(
@@ -19,11 +21,10 @@ logger = logging.getLogger(__name__)
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 SESSION_DIR = os.path.join(BASE_DIR, "user_session")
 
-def prompt_for_mcq_generation(session_id, session_dir=SESSION_DIR):
-    session_path = os.path.join(session_dir, session_id)
+def prompt_for_mcq_generation(session_id, session_dir=SESSION_DIR, return_usage=False):
+    """MCQ prompt over a random run of consecutive chunks, packed into MCQ_CONTEXT_TOKENS"""
     # Load and data
-    with open(os.path.join(session_path, "chunks.pkl"), "rb") as f:
-        chunks = pickle.load(f)
+    _, chunks, _ = load_session_indices(session_id, session_dir)
 
     # Handle cases with fewer than 20 chunks
     if len(chunks) <= 10:
@@ -34,7 +35,8 @@ def prompt_for_mcq_generation(session_id, session_dir=SESSION_DIR):
         start_index = random.randint(0, max_start)
         selected_chunks = chunks[start_index:start_index + 10]
 
-    return f"""
+    def render(content):
+        return f"""
     You are an expert MCQ generator. Create 5 multiple-choice questions all different from each other from the given context.
 
 ⚠️ Rules:
@@ -47,7 +49,7 @@ def prompt_for_mcq_generation(session_id, session_dir=SESSION_DIR):
 - At the end, list the correct options only (e.g., Q1: A, Q2: D, ...).
 
 📄 Context:
-{selected_chunks[10:80] if len(selected_chunks) > 80 else selected_chunks}
+{content}
 
 📤 Output Format:
 Q1. ...
@@ -64,12 +66,16 @@ Q4: C
 Q5: B
 """
 
-def get_extracted_topics(session_id):
-    session_path = os.path.join(SESSION_DIR, session_id)
-    chunk_path = os.path.join(session_path, "chunks.pkl")
+    count_tokens = get_token_counter()
+    # Consecutive chunks share the splitter's overlap; the packer cuts the repeats
+    context = pack_chunks(selected_chunks, section_budget(MCQ_CONTEXT_TOKENS, count_tokens(render(""))), count_tokens)
+    prompt = render(format_chunks(context.items))
+    if return_usage:
+        return prompt, prompt_usage(prompt, count_tokens, context=context.tokens)
+    return prompt
 
-    with open(chunk_path, "rb") as f:
-        chunks = pickle.load(f)
+def get_extracted_topics(session_id):
+    _, chunks, _ = load_session_indices(session_id)
 
     full_content = "\n\n".join(chunks)[:4000]  # Limit for small models
 
@@ -89,17 +95,12 @@ def get_extracted_topics(session_id):
          {{"role": "user", "content": prompt}}
     ]
 
-    response = requests.post("http://localhost:11434/api/generate", json={
-        "model": "llama3-14b-custom",
-        "prompt": prompt,
-        "stream": False,
-        "temperature": 0.3,
-        "top_p": 0.9
-    })
-    if response.status_code == 200:
-        return response.json()["response"]
-    else:
-        print("Error:", response.status_code, response.text)
+    try:
+        return ollama_client.generate(prompt, model=LLM_MODELS["topics"],
+                                      options={"temperature": 0.3, "top_p": 0.9},
+                                      priority="background", session_id=session_id)
+    except (LLMError, requests.RequestException) as e:
+        print("Error:", e)
         return "Something went wrong!"
 
     return f"""
@@ -175,24 +176,18 @@ You are a JSON formatting machine. Your ONLY output must be pure JSON.
 
 
 def generate_mcqs_text_llm(session_id, session_dir=SESSION_DIR):
-    prompt = prompt_for_mcq_generation(session_id, session_dir)
+    prompt, usage = prompt_for_mcq_generation(session_id, session_dir, return_usage=True)
+    logger.info(f"MCQ prompt tokens for {session_id}: {usage}")
     messages = [
         {"role": "system", "content": "You are an exam MCQ generator for teachers."},
         {"role": "user", "content": prompt}
     ]
-    response = requests.post("http://localhost:11434/api/generate", json={
-        "model": "lama3-14b-custom",
-        "prompt": prompt,
-        "stream": False,
-        "temperature": 0.3,
-        "top_p": 0.9
-
-    })
-
-    if response.status_code == 200:
-        return response.json()["response"]
-    else:
-        print("Error:", response.status_code, response.text)
+    try:
+        return ollama_client.generate(prompt, model=LLM_MODELS["mcq"],
+                                      options={"temperature": 0.3, "top_p": 0.9},
+                                      priority="quiz", session_id=session_id)
+    except (LLMError, requests.RequestException) as e:
+        print("Error:", e)
         return "Something went wrong!"
 
 def create_mcqs_text_file(llm_response, session_id):
@@ -300,10 +295,8 @@ def MCQ_wrokflow(session_id, session_dir=SESSION_DIR):
     return questions, answers, latency, llm_response
 
 def prompt_for_json_mcq_generation(session_id, session_dir=SESSION_DIR):
-    session_path = os.path.join(session_dir, session_id)
     # Load and data
-    with open(os.path.join(session_path, "chunks.pkl"), "rb") as f:
-        chunks = pickle.load(f)
+    _, chunks, _ = load_session_indices(session_id, session_dir)
 
     # Handle cases with fewer than 20 chunks
     if len(chunks) <= 10:
@@ -314,7 +307,8 @@ def prompt_for_json_mcq_generation(session_id, session_dir=SESSION_DIR):
         start_index = random.randint(0, max_start)
         selected_chunks = chunks[start_index:start_index + 10]
 
-    return f"""
+    def render(content):
+        return f"""
 You are an expert MCQ generator. Create 5 multiple-choice questions from the given context.
 
 ⚠️ Rules:
@@ -327,7 +321,7 @@ You are an expert MCQ generator. Create 5 multiple-choice questions from the giv
 - Include the correct answer key with each question
 
 📄 Context:
-{selected_chunks[10:80] if len(selected_chunks) > 80 else selected_chunks}
+{content}
 
 📤 Output Format:
 {{
@@ -0,0 +1,360 @@
+import os
+import json
+import logging
+import numpy as np
+import faiss
+
+# flat | ivf_flat | hnsw | ivf_pq, or auto to pick by chunk count
+FAISS_INDEX_MODE = os.getenv("FAISS_INDEX_MODE", "auto")
+# Build-time recall@k (vs brute force) the search parameters are tuned up to; an index
+# type that cannot reach it is rebuilt as the next more exact one (ivf_pq/ivf_flat -> hnsw -> flat)
+FAISS_TARGET_RECALL = float(os.getenv("FAISS_TARGET_RECALL", "0.95"))
+# float32 | float16 | sq8: how flat / HNSW / IVF-flat indices store vectors (IVF-PQ is always compressed)
+FAISS_VECTOR_STORAGE = os.getenv("FAISS_VECTOR_STORAGE", "float32")
+# >0: project vectors to this many dims with a PCA trained on the session's own chunks
+FAISS_PCA_DIM = int(os.getenv("FAISS_PCA_DIM", "0"))
+# Compact storage (float16 / sq8 / PCA / IVF-PQ codes) may trade recall down to
+# min(this, FAISS_TARGET_RECALL); below that it is rebuilt as float32
+FAISS_MIN_STORAGE_RECALL = float(os.getenv("FAISS_MIN_STORAGE_RECALL", "0.9"))
+
+AUTO_FLAT_MAX = 5_000       # below this, brute force is already fast
+AUTO_HNSW_MAX = 100_000     # below this, HNSW; above, IVF-PQ to also cut memory
+RECALL_K = 10
+RECALL_QUERIES = 200
+
+PCA_MIN_TRAIN_FACTOR = 4   # PCA needs at least pca_dim * 4 training vectors, else it is skipped
+RETRAIN_GROWTH = 2.0       # appended-to indices with trained parts are rebuilt after doubling
+
+INDEX_MODES = ("flat", "ivf_flat", "hnsw", "ivf_pq")
+# Next more exact index type, for indices that miss the recall target
+FALLBACK_MODES = {"ivf_pq": "hnsw", "ivf_flat": "hnsw", "hnsw": "flat"}
+VECTOR_STORAGES = {
+    "float32": None,
+    "float16": faiss.ScalarQuantizer.QT_fp16,
+    "sq8": faiss.ScalarQuantizer.QT_8bit,
+}
+
+logger = logging.getLogger(__name__)
+
+
+def choose_index_mode(n_vectors, mode=FAISS_INDEX_MODE):
+    if mode != "auto":
+        if mode not in INDEX_MODES:
+            raise ValueError(f"Unknown FAISS index mode: {mode}")
+        return mode
+    if n_vectors < AUTO_FLAT_MAX:
+        return "flat"
+    if n_vectors < AUTO_HNSW_MAX:
+        return "hnsw"
+    return "ivf_pq"
+
+
+def _nlist_for(n_vectors):
+    # ~4*sqrt(n) lists, but keep >= 39 training points per centroid
+    return int(max(1, min(4 * np.sqrt(n_vectors), n_vectors // 39)))
+
+
+def _pq_subquantizers(dim):
+    # Most sub-quantizers (bytes per code) that split dim into sub-vectors of >= 4 dims
+    for m in (64, 48, 32, 24, 16, 12, 8, 4, 2, 1):
+        if dim % m == 0 and dim // m >= 4:
+            return m
+    return 1
+
+
+def default_params(mode, n_vectors, dim, storage=FAISS_VECTOR_STORAGE, pca_dim=FAISS_PCA_DIM):
+    if storage not in VECTOR_STORAGES:
+        raise ValueError(f"Unknown vector storage: {storage}")
+    params = {"mode": mode, "dim": int(dim), "ntotal": int(n_vectors), "storage": storage, "pca_dim": 0}
+    if 0 < pca_dim < dim and n_vectors >= pca_dim * PCA_MIN_TRAIN_FACTOR:
+        params["pca_dim"] = int(pca_dim)
+    if mode in ("ivf_flat", "ivf_pq"):
+        nlist = _nlist_for(n_vectors)
+        params.update(nlist=nlist, nprobe=max(1, nlist // 16))
+    if mode == "ivf_pq":
+        params.update(pq_m=_pq_subquantizers(params["pca_dim"] or dim), pq_nbits=8 if n_vectors >= 256 * 39 else 4)
+        params["storage"] = "float32"   # PQ codes replace the vectors; nothing to compress further
+    if mode == "hnsw":
+        params.update(hnsw_m=32, ef_construction=80, ef_search=64)
+    return params
+
+
+def _new_ann_index(params, dim):
+    mode, qtype = params["mode"], VECTOR_STORAGES[params.get("storage", "float32")]
+    if mode == "flat":
+        if qtype is None:
+            return faiss.IndexFlatL2(dim)
+        return faiss.IndexScalarQuantizer(dim, qtype, faiss.METRIC_L2)
+    if mode == "hnsw":
+        if qtype is None:
+            index = faiss.IndexHNSWFlat(dim, params["hnsw_m"])
+        else:
+            index = faiss.IndexHNSWSQ(dim, qtype, params["hnsw_m"])
+        index.hnsw.efConstruction = params["ef_construction"]
+        return index
+    quantizer = faiss.IndexFlatL2(dim)
+    if mode == "ivf_flat":
+        if qtype is None:
+            return faiss.IndexIVFFlat(quantizer, dim, params["nlist"], faiss.METRIC_L2)
+        return faiss.IndexIVFScalarQuantizer(quantizer, dim, params["nlist"], qtype, faiss.METRIC_L2)
+    return faiss.IndexIVFPQ(quantizer, dim, params["nlist"], params["pq_m"], params["pq_nbits"])
+
+
+def _new_index(params):
+    pca_dim = params.get("pca_dim", 0)
+    if not pca_dim:
+        return _new_ann_index(params, params["dim"])
+    # Queries go through the same projection inside faiss, so callers still pass full vectors
+    return faiss.IndexPreTransform(faiss.PCAMatrix(params["dim"], pca_dim), _new_ann_index(params, pca_dim))
+
+
+def _inner_index(index):
+    """The ANN index under an optional PCA transform"""
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexPreTransform):
+        index = faiss.downcast_index(index.index)
+    return index
+
+
+def code_bytes(index):
+    """Bytes stored per vector, excluding HNSW links and IVF ids"""
+    index = _inner_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        index = faiss.downcast_index(index.storage)
+    return getattr(index, "code_size", index.d * 4)
+
+
+def apply_search_params(index, params):
+    """Restore query-time knobs (nprobe / efSearch), which faiss does not always persist"""
+    if params is None:
+        return index
+    if "nprobe" in params:
+        faiss.extract_index_ivf(index).nprobe = params["nprobe"]
+    if "ef_search" in params:
+        _inner_index(index).hnsw.efSearch = params["ef_search"]
+    return index
+
+
+def split_holdout(n_vectors, n_queries=RECALL_QUERIES, seed=0):
+    """Boolean mask of vectors kept out of quantizer / PCA training and used as recall queries"""
+    mask = np.zeros(n_vectors, dtype=bool)
+    n_holdout = min(n_queries, n_vectors // 5)
+    if n_holdout:
+        mask[np.random.default_rng(seed).choice(n_vectors, size=n_holdout, replace=False)] = True
+    return mask
+
+
+def measure_recall(index, embeddings, k=RECALL_K, n_queries=RECALL_QUERIES, seed=0,
+                   queries=None, query_ids=None):
+    """recall@k of `index` against exact float32 L2 search over `embeddings`.
+
+    `queries` are vectors outside the index. `query_ids` are positions of
+    indexed vectors to query with, leaving each one's own hit out of both
+    result lists, since a vector always finds itself. With neither, a
+    sample of the corpus is used that way.
+    """
+    n = len(embeddings)
+    if n == 0:
+        return 1.0
+    if queries is None:
+        if query_ids is None:
+            rng = np.random.default_rng(seed)
+            query_ids = rng.choice(n, size=min(n_queries, n), replace=False)
+        queries = embeddings[query_ids]
+    if query_ids is not None:
+        if n == 1:
+            return 1.0
+        k = min(k, n - 1)
+        search_k = k + 1
+    else:
+        k = search_k = min(k, n)
+
+    exact = faiss.IndexFlatL2(embeddings.shape[1])
+    exact.add(embeddings)
+    _, truth = exact.search(queries, search_k)
+    _, found = index.search(queries, search_k)
+    if query_ids is not None:
+        truth = [t[t != i][:k] for t, i in zip(truth, query_ids)]
+        found = [f[f != i][:k] for f, i in zip(found, query_ids)]
+    hits = sum(len(np.intersect1d(t, f)) for t, f in zip(truth, found))
+    return hits / (len(truth) * k)
+
+
+def _tune_search_params(index, embeddings, params, target_recall, query_ids=None):
+    """Raise nprobe / efSearch until build-time recall reaches the target (or the knob maxes out)"""
+    while True:
+        recall = measure_recall(index, embeddings, query_ids=query_ids)
+        params["recall_at_k"] = round(recall, 4)
+        if recall >= target_recall:
+            return params
+        if "nprobe" in params and params["nprobe"] < params["nlist"]:
+            params["nprobe"] = min(params["nlist"], params["nprobe"] * 2)
+        elif "ef_search" in params and params["ef_search"] < 1024:
+            params["ef_search"] *= 2
+        else:
+            logger.warning(
+                f"{params['mode']} index reached recall@{RECALL_K}={recall:.3f}, "
+                f"below target {target_recall}; search knobs already at maximum"
+            )
+            return params
+        apply_search_params(index, params)
+
+
+def _compressed(params):
+    return params["storage"] != "float32" or bool(params["pca_dim"]) or params["mode"] == "ivf_pq"
+
+
+def build_faiss_index(embeddings, mode=FAISS_INDEX_MODE, target_recall=FAISS_TARGET_RECALL, **overrides):
+    """Build a FAISS index for `embeddings`; returns (index, params).
+
+    `params` records the index type, build parameters, tuned search knobs
+    and the measured recall@k, and is meant to be saved next to the index.
+    An index that misses the recall target with its knobs at maximum is
+    rebuilt with float32 storage, then as the next FALLBACK_MODES type;
+    `params["fallback_from"]` keeps the type that was asked for.
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    n, dim = embeddings.shape
+    params = default_params(choose_index_mode(n, mode), n, dim)
+    params.update(overrides)
+    index = _build(embeddings, params, target_recall)
+
+    while True:
+        floor = min(target_recall, FAISS_MIN_STORAGE_RECALL) if _compressed(params) else target_recall
+        recall = params["recall_at_k"]
+        if recall >= floor:
+            return index, params
+        if params["storage"] != "float32" or params["pca_dim"]:
+            logger.warning(
+                f"{params['storage']} storage (pca_dim={params['pca_dim']}) reached recall@{RECALL_K}="
+                f"{recall:.3f}, below {floor}; storing float32 instead"
+            )
+            params.update(storage="float32", pca_dim=0)
+        elif params["mode"] in FALLBACK_MODES:
+            fallback = FALLBACK_MODES[params["mode"]]
+            logger.warning(
+                f"{params['mode']} index reached recall@{RECALL_K}={recall:.3f}, below {floor} "
+                f"with its search knobs at maximum; building {fallback} instead"
+            )
+            requested = params.get("fallback_from", params["mode"])
+            params = default_params(fallback, n, dim, storage="float32", pca_dim=0)
+            params["fallback_from"] = requested
+        else:
+            return index, params   # flat float32 is exact
+        index = _build(embeddings, params, target_recall)
+
+
+def _build(embeddings, params, target_recall):
+    index = _new_index(params)
+    # Recall is measured by querying with a held-out sample, each leaving its own hit out,
+    # and trained parts (quantizer / PCA / SQ ranges) never see that sample
+    holdout = split_holdout(len(embeddings))
+    query_ids = np.flatnonzero(holdout) if holdout.any() else None
+    params.pop("trained_ntotal", None)
+    if not index.is_trained:
+        index.train(np.ascontiguousarray(embeddings[~holdout]))
+        params["trained_ntotal"] = len(embeddings)
+    index.add(embeddings)
+    apply_search_params(index, params)
+    params["bytes_per_vector"] = int(code_bytes(index))
+
+    if params["mode"] == "flat":
+        # No search knobs to tune; only compact storage loses recall
+        compact = params["storage"] != "float32" or params["pca_dim"]
+        recall = measure_recall(index, embeddings, query_ids=query_ids) if compact else 1.0
+        params["recall_at_k"] = round(recall, 4)
+    else:
+        _tune_search_params(index, embeddings, params, target_recall, query_ids=query_ids)
+    return index
+
+
+def needs_rebuild(params, n_vectors, mode=FAISS_INDEX_MODE):
+    """Whether growing an index to n_vectors should rebuild it rather than add to it.
+
+    True when the auto mode would now pick another index type, or when IVF
+    centroids / SQ ranges / PCA were trained on less than 1/RETRAIN_GROWTH of
+    the vectors.
+    """
+    if choose_index_mode(n_vectors, mode) != params.get("fallback_from", params["mode"]):
+        return True
+    trained = params.get("trained_ntotal")
+    return bool(trained) and n_vectors > trained * RETRAIN_GROWTH
+
+
+def add_to_index(index, params, embeddings):
+    """Append vectors in place; their ids continue from the current ntotal"""
+    index.add(np.ascontiguousarray(embeddings, dtype=np.float32))
+    params["ntotal"] = int(index.ntotal)
+
+
+def reconstruct_vectors(index, params):
+    """The indexed vectors in id order, for rebuilding without re-encoding.
+
+    None when the stored codes are too lossy to rebuild from (IVF-PQ, PCA,
+    sq8, which also clips vectors outside its trained range); float16
+    decodes to within its rounding.
+    """
+    if params.get("pca_dim") or params["mode"] == "ivf_pq" or params.get("storage") == "sq8":
+        return None
+    if params["mode"] == "ivf_flat":
+        faiss.extract_index_ivf(index).make_direct_map()
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def remove_from_index(index, params, ids):
+    """Remove vectors by position, shifting later ones down as deleting from the chunk list does.
+
+    Only flat indices can; IVF keeps explicit ids and HNSW cannot delete, so
+    for those this returns False and the caller rebuilds.
+    """
+    if not isinstance(_inner_index(index), faiss.IndexFlatCodes):
+        return False
+    index.remove_ids(faiss.IDSelectorBatch(np.asarray(ids, dtype=np.int64)))
+    params["ntotal"] = int(index.ntotal)
+    return True
+
+
+def compare_storage(embeddings, queries=None, mode="flat", pca_dims=(0, 128, 64)):
+    """Bytes per vector and recall@k vs exact float32 search for every storage / PCA combination.
+
+    Without `queries`, a held-out sample of `embeddings` is used as queries
+    and left out of every index and every training set.
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    if queries is None:
+        holdout = split_holdout(len(embeddings))
+        if holdout.any():
+            queries, embeddings = embeddings[holdout], np.ascontiguousarray(embeddings[~holdout])
+    if queries is not None:
+        queries = np.ascontiguousarray(queries, dtype=np.float32)
+    rows = []
+    for pca_dim in pca_dims:
+        for storage in VECTOR_STORAGES:
+            params = default_params(choose_index_mode(len(embeddings), mode), *embeddings.shape,
+                                    storage=storage, pca_dim=pca_dim)
+            if params["pca_dim"] != pca_dim:
+                continue
+            index = _new_index(params)
+            if not index.is_trained:
+                index.train(embeddings)
+            index.add(embeddings)
+            apply_search_params(index, params)
+            rows.append({
+                "storage": storage,
+                "pca_dim": pca_dim,
+                "bytes_per_vector": int(code_bytes(index)),
+                "recall_at_k": round(measure_recall(index, embeddings, queries=queries), 4),
+            })
+    return rows
+
+
+def save_index_params(path, params):
+    with open(path, "w") as f:
+        json.dump(params, f, indent=2)
+
+
+def load_index_params(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
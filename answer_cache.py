@@ -0,0 +1,178 @@
+import os
+import time
+import base64
+import threading
+from collections import OrderedDict, namedtuple
+import numpy as np
+from session_store import session_store
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "1") == "1"
+# Cosine similarity between query embeddings above which two questions count as the same
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.92"))
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "5000"))
+# Answers per material kept in the shared session store (newest first out of the local LRU)
+ANSWER_CACHE_SHARED_PER_CONTENT = int(os.getenv("ANSWER_CACHE_SHARED_PER_CONTENT", "64"))
+ANSWER_NAMESPACE = "answers"
+
+# What an answer is filed under: the material, the question, and the chunks it was grounded on
+AnswerKey = namedtuple("AnswerKey", ["content_hash", "embedding", "chunk_ids"])
+
+
+def make_key(content_hash, query_embed, chunk_ids):
+    embedding = np.asarray(query_embed, dtype=np.float32).reshape(-1)
+    norm = np.linalg.norm(embedding)
+    if norm:
+        embedding = embedding / norm
+    return AnswerKey(content_hash, embedding, frozenset(int(i) for i in chunk_ids))
+
+
+class AnswerCache:
+    """Answers to earlier questions, reused for near-identical questions on the same material.
+
+    A lookup hits when an unexpired entry for the same content hash has a
+    query embedding within `threshold` cosine similarity and was answered from
+    the same retrieved chunk ids. Entries expire after `ttl_seconds`; beyond
+    `max_entries` the least recently used go first.
+
+    With a `store`, answers are also written to the shared session store (the
+    last `shared_per_content` per content hash), and a local miss is looked up
+    there, so an answer generated by one worker is reused by the others.
+    """
+
+    def __init__(self, threshold=ANSWER_CACHE_THRESHOLD, ttl_seconds=ANSWER_CACHE_TTL_SECONDS,
+                 max_entries=ANSWER_CACHE_MAX_ENTRIES, store=None, shared_per_content=ANSWER_CACHE_SHARED_PER_CONTENT):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.shared_store = store
+        self.shared_per_content = shared_per_content
+        self._entries = OrderedDict()    # entry id -> (key, answer, created_at)
+        self._by_content = {}            # content hash -> set of entry ids
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _matches(self, key, entry_key, best_similarity):
+        if entry_key.chunk_ids != key.chunk_ids:
+            return None
+        similarity = float(np.dot(entry_key.embedding, key.embedding))
+        return similarity if similarity >= best_similarity else None
+
+    def lookup(self, key):
+        now = time.time()
+        with self._lock:
+            best_id, best_similarity = None, self.threshold
+            for entry_id in list(self._by_content.get(key.content_hash, ())):
+                entry_key, _, created_at = self._entries[entry_id]
+                if now - created_at > self.ttl_seconds:
+                    self._drop(entry_id)
+                    self.expirations += 1
+                    continue
+                similarity = self._matches(key, entry_key, best_similarity)
+                if similarity is not None:
+                    best_id, best_similarity = entry_id, similarity
+            if best_id is not None:
+                self._entries.move_to_end(best_id)
+                self.hits += 1
+                return self._entries[best_id][1]
+        answer = self._lookup_shared(key, now)
+        with self._lock:
+            if answer is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return answer
+
+    def _lookup_shared(self, key, now):
+        """Best match among the answers other workers stored for this material; cached locally when found"""
+        if self.shared_store is None:
+            return None
+        best, best_similarity = None, self.threshold
+        for record in self.shared_store.get(ANSWER_NAMESPACE, key.content_hash) or []:
+            if now - record["created_at"] > self.ttl_seconds:
+                continue
+            entry_key = AnswerKey(key.content_hash,
+                                  np.frombuffer(base64.b64decode(record["embedding"]), dtype=np.float32),
+                                  frozenset(record["chunk_ids"]))
+            similarity = self._matches(key, entry_key, best_similarity)
+            if similarity is not None:
+                best, best_similarity = (entry_key, record["answer"], record["created_at"]), similarity
+        if best is None:
+            return None
+        with self._lock:
+            self._insert(*best)
+        return best[1]
+
+    def _insert(self, key, answer, created_at):
+        entry_id = self._next_id
+        self._next_id += 1
+        self._entries[entry_id] = (key, answer, created_at)
+        self._by_content.setdefault(key.content_hash, set()).add(entry_id)
+        while len(self._entries) > self.max_entries:
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+
+    def store(self, key, answer):
+        now = time.time()
+        with self._lock:
+            self._insert(key, answer, now)
+        if self.shared_store is not None:
+            # Read-modify-write without a cross-process lock: two workers storing
+            # for the same material at once may lose one answer, which only costs a miss
+            records = [record for record in self.shared_store.get(ANSWER_NAMESPACE, key.content_hash) or []
+                       if now - record["created_at"] <= self.ttl_seconds]
+            records.append({
+                "embedding": base64.b64encode(np.asarray(key.embedding, dtype=np.float32).tobytes()).decode("ascii"),
+                "chunk_ids": sorted(key.chunk_ids),
+                "answer": answer,
+                "created_at": now,
+            })
+            self.shared_store.put(ANSWER_NAMESPACE, key.content_hash, records[-self.shared_per_content:],
+                           ttl=self.ttl_seconds)
+
+    def record_bypass(self):
+        with self._lock:
+            self.bypassed += 1
+
+    def invalidate(self, content_hash):
+        if self.shared_store is not None:
+            self.shared_store.delete(ANSWER_NAMESPACE, content_hash)
+        with self._lock:
+            for entry_id in list(self._by_content.get(content_hash, ())):
+                self._drop(entry_id)
+
+    def clear(self):
+        """Drop the answers held in this process (shared ones stay in the store until they expire)"""
+        with self._lock:
+            self._entries.clear()
+            self._by_content.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "documents": len(self._by_content),
+                "hits": self.hits,
+                "misses": self.misses,
+                "bypassed": self.bypassed,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def _drop(self, entry_id):
+        key, _, _ = self._entries.pop(entry_id)
+        ids = self._by_content.get(key.content_hash)
+        if ids is not None:
+            ids.discard(entry_id)
+            if not ids:
+                del self._by_content[key.content_hash]
+
+
+answer_cache = AnswerCache(store=session_store)
@@ -0,0 +1,131 @@
+"""Compare the torch and int8 ONNX embedding backends on the same chunks.
+
+Each backend runs in its own subprocess so peak RSS is not shared:
+
+    python benchmark_embeddings.py --pdf path/to/pdfs
+    python benchmark_embeddings.py --chunks 2000      # synthetic text
+
+Reports load time, chunks/sec, peak RSS, and how well ONNX vectors match the
+torch ones (cosine per chunk, recall@10 against a FAISS index of torch vectors).
+Exits with status 1 if a backend fails or any chunk's cosine is below
+ONNX_MIN_COSINE, so it can gate a model export in CI.
+"""
+import os
+import sys
+import json
+import time
+import resource
+import argparse
+import subprocess
+import tempfile
+import numpy as np
+
+BACKENDS = ("torch", "onnx")
+RECALL_K = 10
+
+
+def load_chunks(pdf_path, limit):
+    if pdf_path:
+        from functions import load_pdfs_from_folder, chunks_from_doc
+        chunks = chunks_from_doc(load_pdfs_from_folder(pdf_path))
+    else:
+        rng = np.random.default_rng(0)
+        words = ("cell energy river force empire light mass law water plant trade climate "
+                 "reaction acid soil motion king treaty current voltage gene protein").split()
+        chunks = [" ".join(rng.choice(words, size=rng.integers(40, 120))) for _ in range(limit)]
+    return chunks[:limit]
+
+
+def run_worker(backend, chunks_path, out_path, batch_size):
+    """Runs inside the subprocess: embed every chunk with one backend and report timings"""
+    os.environ["EMBEDDING_BACKEND"] = backend
+    from model_registry import get_encoder
+
+    with open(chunks_path) as f:
+        chunks = json.load(f)
+    started = time.perf_counter()
+    model = get_encoder()
+    load_seconds = time.perf_counter() - started
+
+    model.encode(chunks[:batch_size], convert_to_numpy=True, batch_size=batch_size)   # warm-up
+    started = time.perf_counter()
+    vectors = np.asarray(model.encode(chunks, convert_to_numpy=True, batch_size=batch_size), dtype=np.float32)
+    encode_seconds = time.perf_counter() - started
+    np.save(out_path, vectors)
+
+    print(json.dumps({
+        "backend": backend,
+        "load_seconds": round(load_seconds, 2),
+        "chunks_per_sec": round(len(chunks) / encode_seconds, 1),
+        # ru_maxrss is KiB on Linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }))
+
+
+def recall_at_k(reference, candidate, k=RECALL_K):
+    """Share of each chunk's top-k torch neighbours that its ONNX vector also retrieves from the torch index"""
+    import faiss
+    index = faiss.IndexFlatIP(reference.shape[1])
+    index.add(reference)
+    _, expected = index.search(reference, k)
+    _, found = index.search(candidate, k)
+    return float(np.mean([len(set(a) & set(b)) / k for a, b in zip(expected, found)]))
+
+
+def main():
+    """Exit status: 0 if both backends ran and agree within ONNX_MIN_COSINE, else 1"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pdf", help="PDF file or folder to chunk; default synthetic text")
+    parser.add_argument("--chunks", type=int, default=1000)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--worker", choices=BACKENDS, help=argparse.SUPPRESS)
+    parser.add_argument("--input", help=argparse.SUPPRESS)
+    parser.add_argument("--output", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker, args.input, args.output, args.batch_size)
+        return 0
+
+    from onnx_encoder import cosine_agreement, ONNX_MIN_COSINE
+
+    workdir = tempfile.mkdtemp(prefix="embed-bench-")
+    chunks_path = os.path.join(workdir, "chunks.json")
+    with open(chunks_path, "w") as f:
+        json.dump(load_chunks(args.pdf, args.chunks), f)
+
+    results, vectors = [], {}
+    for backend in BACKENDS:
+        out_path = os.path.join(workdir, f"{backend}.npy")
+        proc = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--worker", backend,
+             "--input", chunks_path, "--output", out_path, "--batch-size", str(args.batch_size)],
+            capture_output=True, text=True,
+        )
+        if proc.returncode != 0:
+            print(f"{backend}: failed\n{proc.stderr.strip()}")
+            continue
+        results.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+        vectors[backend] = np.load(out_path)
+
+    print(f"{'backend':<8} {'load s':>8} {'chunks/s':>10} {'peak RSS MB':>12}")
+    for r in results:
+        print(f"{r['backend']:<8} {r['load_seconds']:>8} {r['chunks_per_sec']:>10} {r['peak_rss_mb']:>12}")
+
+    if len(vectors) != len(BACKENDS):
+        print("FAIL: not every backend produced vectors")
+        return 1
+    agreement = cosine_agreement(vectors["torch"], vectors["onnx"])
+    recall = recall_at_k(vectors["torch"], vectors["onnx"])
+    print(f"cosine onnx vs torch: min {agreement.min():.4f}, mean {agreement.mean():.4f} "
+          f"(required >= {ONNX_MIN_COSINE})")
+    print(f"recall@{RECALL_K} on torch-built index: {recall:.3f}")
+    if agreement.min() < ONNX_MIN_COSINE:
+        print(f"FAIL: {int((agreement < ONNX_MIN_COSINE).sum())} of {len(agreement)} chunks "
+              f"below cosine {ONNX_MIN_COSINE}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
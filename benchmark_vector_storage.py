@@ -0,0 +1,54 @@
+"""Measure compact vector storage (float16 / sq8 / PCA) against float32 on a session's chunks.
+
+    python benchmark_vector_storage.py user_session/<session_id>
+    python benchmark_vector_storage.py user_session/<session_id> --queries questions.txt
+
+Queries are the lines of --queries (encoded as questions), or else a held-out
+fifth of the chunks that is left out of every index. Recall@10 is against
+exact float32 search; choose FAISS_VECTOR_STORAGE / FAISS_PCA_DIM from it.
+"""
+import os
+import argparse
+import numpy as np
+from ann_index import compare_storage, split_holdout, RECALL_K
+from model_registry import get_encoder, cache_namespace
+from embedding_cache import encode_with_cache
+from functions import load_session_indices
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("session_path")
+    parser.add_argument("--queries", help="text file with one question per line")
+    parser.add_argument("--mode", default="flat", help="FAISS index mode to build (see ann_index)")
+    parser.add_argument("--pca-dims", default="0,128,64")
+    args = parser.parse_args()
+
+    session_dir, session_id = os.path.split(os.path.abspath(args.session_path))
+    _, chunks, _ = load_session_indices(session_id, session_dir)
+    chunks = list(chunks)
+    model = get_encoder()
+    embeddings = encode_with_cache(model, chunks, cache_namespace())
+
+    if args.queries:
+        with open(args.queries) as f:
+            questions = [line.strip() for line in f if line.strip()]
+        queries = np.asarray(model.encode(questions, convert_to_numpy=True), dtype=np.float32)
+    else:
+        holdout = split_holdout(len(embeddings))
+        queries, embeddings = embeddings[holdout], embeddings[~holdout]
+
+    rows = compare_storage(
+        embeddings, queries, mode=args.mode,
+        pca_dims=tuple(int(d) for d in args.pca_dims.split(",")),
+    )
+    print(f"{len(embeddings)} vectors, {len(queries)} queries, mode={args.mode}")
+    print(f"{'storage':<8} {'pca':>4} {'bytes/vec':>10} {'vectors MB':>11} {f'recall@{RECALL_K}':>10}")
+    for row in rows:
+        megabytes = row["bytes_per_vector"] * len(embeddings) / 1e6
+        print(f"{row['storage']:<8} {row['pca_dim']:>4} {row['bytes_per_vector']:>10} "
+              f"{megabytes:>11.2f} {row['recall_at_k']:>10.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""Measure requests/sec and memory per worker of serve.py at several worker counts.
+
+    python benchmark_workers.py <session_id>
+    python benchmark_workers.py <session_id> --workers 1,2,4 --requests 2000 --clients 16
+
+For each worker count, starts serve.py on a free port, sends retrieval
+requests (GET /sessions/<id>/search, a fresh question every time so no
+memoised result is reused) from --clients processes, and reads RSS and PSS
+of every worker from /proc. PSS splits shared pages between the processes
+mapping them, so it shows what each extra worker really costs (Linux only).
+"""
+import os
+import sys
+import time
+import socket
+import argparse
+import subprocess
+import multiprocessing
+import requests
+
+WORDS = ("cell energy river force empire light mass law water plant trade climate "
+         "reaction acid soil motion king treaty current voltage gene protein").split()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def worker_pids(master_pid):
+    with open(f"/proc/{master_pid}/task/{master_pid}/children") as f:
+        return [int(pid) for pid in f.read().split()]
+
+
+def memory_kb(pid):
+    """(rss, pss) of one process in KiB"""
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            key, _, rest = line.partition(":")
+            if key in ("Rss", "Pss"):
+                values[key] = int(rest.split()[0])
+    return values.get("Rss", 0), values.get("Pss", 0)
+
+
+def wait_until_ready(base_url, workers, server, timeout=300):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"serve.py exited with status {server.returncode}")
+        try:
+            if requests.get(f"{base_url}/health", timeout=1).ok and len(worker_pids(server.pid)) == workers:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"server on {base_url} did not come up")
+
+
+def client(args):
+    """One load-generating process: `count` sequential requests, returns failures"""
+    base_url, session_id, seed, count = args
+    http = requests.Session()
+    failures = 0
+    for i in range(count):
+        words = [WORDS[(seed * 7919 + i * 31 + j * 17) % len(WORDS)] for j in range(6)]
+        question = f"{' '.join(words)} {seed}-{i}?"
+        try:
+            response = http.get(f"{base_url}/sessions/{session_id}/search",
+                                params={"q": question, "top_k": 5}, timeout=60)
+            failures += not response.ok
+        except requests.RequestException:
+            failures += 1
+    return failures
+
+
+def run(session_id, workers, total_requests, clients):
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "serve.py"),
+         "--workers", str(workers), "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+    )
+    try:
+        wait_until_ready(base_url, workers, server)
+        # Warm every worker (encoder forward pass, index pages) before timing
+        client((base_url, session_id, 10_000, workers * 4))
+
+        per_client = max(1, total_requests // clients)
+        with multiprocessing.Pool(clients) as pool:
+            started = time.perf_counter()
+            failures = sum(pool.map(client, [(base_url, session_id, seed, per_client) for seed in range(clients)]))
+            elapsed = time.perf_counter() - started
+
+        memory = [memory_kb(pid) for pid in worker_pids(server.pid)]
+        master_rss, _ = memory_kb(server.pid)
+        return {
+            "workers": workers,
+            "req_per_sec": per_client * clients / elapsed,
+            "failures": failures,
+            "master_rss_mb": master_rss / 1024,
+            "worker_rss_mb": sum(rss for rss, _ in memory) / len(memory) / 1024,
+            "worker_pss_mb": sum(pss for _, pss in memory) / len(memory) / 1024,
+            "total_pss_mb": sum(pss for _, pss in memory) / 1024,
+        }
+    finally:
+        server.terminate()
+        server.wait(timeout=60)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("session_id", help="an indexed session under user_session/")
+    parser.add_argument("--workers", default="1,2,4")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--clients", type=int, default=8)
+    args = parser.parse_args()
+
+    rows = [run(args.session_id, int(n), args.requests, args.clients) for n in args.workers.split(",")]
+    print(f"{'workers':>7} {'req/s':>8} {'fail':>5} {'master RSS':>11} {'RSS/worker':>11} "
+          f"{'PSS/worker':>11} {'PSS total':>10}  (MB)")
+    for r in rows:
+        print(f"{r['workers']:>7} {r['req_per_sec']:>8.1f} {r['failures']:>5} {r['master_rss_mb']:>11.1f} "
+              f"{r['worker_rss_mb']:>11.1f} {r['worker_pss_mb']:>11.1f} {r['total_pss_mb']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
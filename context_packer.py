@@ -0,0 +1,189 @@
+import os
+import re
+import math
+import logging
+import threading
+from collections import namedtuple
+
+# Context window of the served model and the share of it kept free for the answer
+LLM_CONTEXT_WINDOW = int(os.getenv("LLM_CONTEXT_WINDOW", "8192"))
+LLM_ANSWER_TOKENS = int(os.getenv("LLM_ANSWER_TOKENS", "512"))
+# Per-section ceilings; each is also clamped to what is left of the window
+QNA_CONTEXT_TOKENS = int(os.getenv("QNA_CONTEXT_TOKENS", "1500"))
+QNA_HISTORY_TOKENS = int(os.getenv("QNA_HISTORY_TOKENS", "500"))
+MCQ_CONTEXT_TOKENS = int(os.getenv("MCQ_CONTEXT_TOKENS", "2500"))
+# Hugging Face tokenizer matching the Ollama model; empty -> length-based estimate
+LLM_TOKENIZER = os.getenv("LLM_TOKENIZER", "")
+# Word-shingle Jaccard similarity above which a chunk counts as a duplicate
+DEDUPE_THRESHOLD = float(os.getenv("CONTEXT_DEDUPE_THRESHOLD", "0.8"))
+
+MIN_OVERLAP_CHARS = 30
+
+# `sources`: indices of the input items that made it in
+PackedSection = namedtuple("PackedSection", ["items", "tokens", "dropped", "sources"])
+
+logger = logging.getLogger(__name__)
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+_token_counter = None
+_lock = threading.Lock()
+
+
+def estimate_tokens(text):
+    """Rough token count for BPE models when no tokenizer is available (errs high)"""
+    return math.ceil(max(len(text) / 4, len(text.split()) * 1.3))
+
+
+def _load_token_counter():
+    if LLM_TOKENIZER:
+        try:
+            from transformers import AutoTokenizer
+            tokenizer = AutoTokenizer.from_pretrained(LLM_TOKENIZER)
+            return lambda text: len(tokenizer.encode(text, add_special_tokens=False))
+        except Exception as e:
+            logger.warning(f"Tokenizer {LLM_TOKENIZER} unavailable ({e}); estimating token counts")
+    return estimate_tokens
+
+
+def get_token_counter():
+    """text -> token count for the model prompts are built for"""
+    global _token_counter
+    if _token_counter is None:
+        with _lock:
+            if _token_counter is None:
+                _token_counter = _load_token_counter()
+    return _token_counter
+
+
+def set_token_counter(count_tokens):
+    """Count with a specific model's tokenizer (e.g. a loaded llama_cpp model)"""
+    global _token_counter
+    with _lock:
+        _token_counter = count_tokens
+
+
+def section_budget(limit, *used):
+    """`limit` clamped to what the window has left after the answer reserve and `used` tokens"""
+    return max(0, min(limit, LLM_CONTEXT_WINDOW - LLM_ANSWER_TOKENS - sum(used)))
+
+
+def trim_to_tokens(text, max_tokens, count_tokens):
+    """Longest prefix of whole sentences within max_tokens.
+
+    Falls back to whole words for text without sentence punctuation
+    (e.g. YouTube transcripts).
+    """
+    if count_tokens(text) <= max_tokens:
+        return text
+    kept = []
+    for sentence in _SENTENCE_END.split(text):
+        if count_tokens(" ".join(kept + [sentence])) > max_tokens:
+            break
+        kept.append(sentence)
+    if kept:
+        return " ".join(kept)
+
+    words = text.split()
+    lo, hi = 0, len(words)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if count_tokens(" ".join(words[:mid])) <= max_tokens:
+            lo = mid
+        else:
+            hi = mid - 1
+    return " ".join(words[:lo])
+
+
+def _strip_overlap(previous, text):
+    """Remove the part of `text` that repeats the end of `previous` (splitter overlap)"""
+    head = text[:MIN_OVERLAP_CHARS]
+    if len(head) < MIN_OVERLAP_CHARS:
+        return text
+    start = previous.find(head)
+    while start != -1:
+        tail = previous[start:]
+        if text.startswith(tail):
+            return text[len(tail):].lstrip()
+        start = previous.find(head, start + 1)
+    return text
+
+
+def _shingles(text, size=3):
+    words = re.findall(r"\w+", text.lower())
+    return {tuple(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+
+
+def _similarity(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def format_chunks(items):
+    return "\n\n".join(f"[{i}] {text}" for i, text in enumerate(items, 1))
+
+
+def pack_chunks(chunks, budget, count_tokens=None, dedupe_threshold=DEDUPE_THRESHOLD):
+    """Fill `budget` tokens with chunks in rank order.
+
+    Text repeating the end of an already packed chunk is cut, near-duplicate
+    chunks are skipped, and the chunk that crosses the budget is trimmed at a
+    sentence boundary. Tokens are counted on the numbered blocks exactly as
+    format_chunks renders them.
+    """
+    count_tokens = count_tokens or get_token_counter()
+    packed, packed_shingles, sources, used = [], [], [], 0
+    for index, chunk in enumerate(chunks):
+        text = chunk.strip()
+        for previous in packed:
+            text = _strip_overlap(previous, text)
+        # Whatever survives of a chunk contained in earlier ones is a fragment, not content
+        if len(text) < MIN_OVERLAP_CHARS:
+            continue
+        shingles = _shingles(text)
+        if any(_similarity(shingles, seen) >= dedupe_threshold for seen in packed_shingles):
+            continue
+        label = f"[{len(packed) + 1}] "
+        remaining = budget - used - count_tokens(label) - (2 if packed else 0)
+        if count_tokens(text) > remaining:
+            text = trim_to_tokens(text, remaining, count_tokens) if remaining > 0 else ""
+            if text:
+                packed.append(text)
+                sources.append(index)
+            break
+        packed.append(text)
+        packed_shingles.append(shingles)
+        sources.append(index)
+        used = count_tokens(format_chunks(packed))
+    tokens = count_tokens(format_chunks(packed)) if packed else 0
+    return PackedSection(packed, tokens, len(chunks) - len(packed), sources)
+
+
+def pack_history(chat_history, budget, count_tokens=None):
+    """Most recent turns, oldest first, that fit in `budget` tokens"""
+    count_tokens = count_tokens or get_token_counter()
+    chat_history = chat_history or []
+    lines, used = [], 0
+    for msg in reversed(chat_history):
+        speaker = "USER" if msg["role"] == "user" else "ASSISTANT"
+        line = f"{speaker}: {msg['content']}\n"
+        n = count_tokens(line)
+        if used + n > budget:
+            break
+        lines.append(line)
+        used += n
+    lines.reverse()
+    first = len(chat_history) - len(lines)
+    return PackedSection(lines, used, first, list(range(first, len(chat_history))))
+
+
+def prompt_usage(prompt, count_tokens=None, **sections):
+    """Tokens per section; whatever is not in a named section is instructions/template"""
+    count_tokens = count_tokens or get_token_counter()
+    total = count_tokens(prompt)
+    usage = dict(sections)
+    usage["instructions"] = max(0, total - sum(sections.values()))
+    usage["total"] = total
+    usage["window"] = LLM_CONTEXT_WINDOW
+    return usage
@@ -0,0 +1,169 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "1") == "1"
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH") or os.path.join(BASE_DIR, "embedding_cache.sqlite3")
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "500000"))
+EMBEDDING_CACHE_MAX_AGE_DAYS = float(os.getenv("EMBEDDING_CACHE_MAX_AGE_DAYS", "30"))
+
+_SQL_BATCH = 500   # stay under SQLite's bound-parameter limit
+# last_access only has to be good enough to rank entries for eviction, so a
+# hit rewrites it at most this often; most lookups are then read-only
+ACCESS_RESOLUTION_SECONDS = 3600
+# Eviction (a COUNT(*) and range deletes) runs after this many inserted rows or
+# this long since the last run, whichever comes first, not after every put
+EVICT_EVERY_ROWS = 10000
+EVICT_INTERVAL_SECONDS = 300
+
+
+def content_key(model_name, text):
+    return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """Persistent vector store keyed by sha256(model name + chunk text).
+
+    Vectors are kept as raw float32 blobs in a single SQLite file (WAL mode),
+    so every worker process and every session on the node shares the same
+    cache. Entries unused for `max_age_days`, or beyond `max_entries` by
+    least-recent access, are evicted; eviction is periodic, so the table may
+    briefly hold up to EVICT_EVERY_ROWS more than max_entries.
+    """
+
+    def __init__(self, path=EMBEDDING_CACHE_PATH, max_entries=EMBEDDING_CACHE_MAX_ENTRIES,
+                 max_age_days=EMBEDDING_CACHE_MAX_AGE_DAYS):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_days * 86400
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS embeddings (
+                   key TEXT PRIMARY KEY,
+                   dim INTEGER NOT NULL,
+                   vector BLOB NOT NULL,
+                   last_access REAL NOT NULL
+               )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_access ON embeddings(last_access)")
+        self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._inserted_since_evict = 0
+        self._evicted_at = 0.0
+
+    def get_many(self, keys):
+        """Return {key: vector} for the keys present in the cache"""
+        found = {}
+        now = time.time()
+        stale = []
+        with self._lock:
+            for start in range(0, len(keys), _SQL_BATCH):
+                batch = keys[start:start + _SQL_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, dim, vector, last_access FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, dim, blob, last_access in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32, count=dim)
+                    if now - last_access > ACCESS_RESOLUTION_SECONDS:
+                        stale.append((now, key))
+            if stale:
+                self._conn.executemany("UPDATE embeddings SET last_access = ? WHERE key = ?", stale)
+                self._conn.commit()
+            self.hits += len(found)
+            self.misses += len(set(keys)) - len(found)
+        return found
+
+    def put_many(self, keys, vectors):
+        now = time.time()
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, dim, vector, last_access) VALUES (?, ?, ?, ?)",
+                [(key, vector.shape[0], vector.tobytes(), now) for key, vector in zip(keys, vectors)],
+            )
+            self._conn.commit()
+            self._inserted_since_evict += len(vectors)
+            due = (self._inserted_since_evict >= EVICT_EVERY_ROWS
+                   or now - self._evicted_at >= EVICT_INTERVAL_SECONDS)
+        if due:
+            self.evict()
+
+    def evict(self):
+        with self._lock:
+            self._inserted_since_evict = 0
+            self._evicted_at = time.time()
+            cutoff = time.time() - self.max_age_seconds
+            removed = self._conn.execute("DELETE FROM embeddings WHERE last_access < ?", (cutoff,)).rowcount
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+            if count > self.max_entries:
+                removed += self._conn.execute(
+                    """DELETE FROM embeddings WHERE key IN (
+                           SELECT key FROM embeddings ORDER BY last_access ASC LIMIT ?
+                       )""",
+                    (count - self.max_entries,),
+                ).rowcount
+            self._conn.commit()
+            self.evictions += removed
+
+    def stats(self):
+        with self._lock:
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "entries": count,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache():
+    """Process-wide cache instance, opened on first use"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = EmbeddingCache()
+    return _cache
+
+
+def encode_with_cache(model, texts, model_name, cache=None, **encode_kwargs):
+    """model.encode(texts) that only runs the model on texts not already cached.
+
+    Duplicate texts within the call are encoded once as well.
+    """
+    if not EMBEDDING_CACHE_ENABLED and cache is None:
+        return model.encode(texts, convert_to_numpy=True, **encode_kwargs)
+    cache = cache or get_embedding_cache()
+
+    keys = [content_key(model_name, text) for text in texts]
+    found = cache.get_many(keys)
+
+    missing = {}
+    for key, text in zip(keys, texts):
+        if key not in found and key not in missing:
+            missing[key] = text
+    if missing:
+        vectors = model.encode(list(missing.values()), convert_to_numpy=True, **encode_kwargs)
+        cache.put_many(list(missing), vectors)
+        found.update(zip(missing, np.asarray(vectors, dtype=np.float32)))
+
+    if not keys:
+        return np.empty((0, 0), dtype=np.float32)
+    return np.stack([found[key] for key in keys])
@@ -0,0 +1,229 @@
+import os
+import time
+import queue
+import itertools
+import logging
+import threading
+from concurrent.futures import Future
+import numpy as np
+from model_registry import get_encoder, EMBEDDING_MODEL_NAME
+
+ENCODE_BATCHING = os.getenv("ENCODE_BATCHING", "1") == "1"
+# Texts per coalesced forward pass, and how long the first request waits for company
+ENCODE_BATCH_MAX_SIZE = int(os.getenv("ENCODE_BATCH_MAX_SIZE", "64"))
+ENCODE_BATCH_MAX_WAIT_MS = float(os.getenv("ENCODE_BATCH_MAX_WAIT_MS", "3"))
+
+# Lower is served first: queries never sit behind a document's worth of chunks
+INTERACTIVE = 0
+BULK = 1
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+QUEUE_TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+
+logger = logging.getLogger(__name__)
+
+
+class _Request:
+    def __init__(self, texts):
+        self.texts = texts
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+
+
+class _Histogram:
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * len(bounds)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.total += value
+        for i, bound in enumerate(self.bounds):
+            if value <= bound:
+                self.counts[i] += 1
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": round(self.total, 6),
+            "buckets": {str(bound): n for bound, n in zip(self.bounds, self.counts)},
+        }
+
+
+class _EncoderView:
+    """SentenceTransformer-style encode() that submits at a fixed priority"""
+
+    def __init__(self, batcher, priority):
+        self.batcher = batcher
+        self.priority = priority
+
+    def encode(self, texts, **kwargs):
+        return self.batcher.encode(texts, priority=self.priority)
+
+
+class EncodeBatcher:
+    """Coalesces concurrent encode calls for one model into batched forward passes.
+
+    Callers get a Future per request. A single worker thread takes the most
+    urgent request, waits up to `max_wait_ms` for more to arrive, and encodes
+    up to `max_batch_size` texts in one call. Bulk requests are split into
+    `max_batch_size` pieces so interactive queries can be slotted in between.
+    """
+
+    def __init__(self, model_name=EMBEDDING_MODEL_NAME, max_batch_size=ENCODE_BATCH_MAX_SIZE,
+                 max_wait_ms=ENCODE_BATCH_MAX_WAIT_MS):
+        self.model_name = model_name
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.PriorityQueue()
+        self._seq = itertools.count()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._batch_sizes = _Histogram(BATCH_SIZE_BUCKETS)
+        self._queue_times = _Histogram(QUEUE_TIME_BUCKETS)
+        self.requests = 0
+        self.encode_seconds = 0.0
+
+    def submit(self, texts, priority=INTERACTIVE):
+        """Queue texts for encoding; the future resolves to a (len(texts), dim) float32 array"""
+        texts = list(texts)
+        self._ensure_worker()
+        pieces = [texts[i:i + self.max_batch_size] for i in range(0, len(texts), self.max_batch_size)]
+        requests = [_Request(piece) for piece in pieces]
+        with self._lock:
+            self.requests += 1
+        for request in requests:
+            self._queue.put((priority, next(self._seq), request))
+        if len(requests) == 1:
+            return requests[0].future
+        return _gather([request.future for request in requests])
+
+    def encode(self, texts, priority=INTERACTIVE, **kwargs):
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        return self.submit(texts, priority).result()
+
+    def view(self, priority):
+        return _EncoderView(self, priority)
+
+    def _ensure_worker(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="encode-batcher", daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        carried = None
+        while True:
+            first = carried or self._queue.get()[2]
+            carried = None
+            if first is None:
+                return
+            batch, size = [first], len(first.texts)
+            deadline = time.perf_counter() + self.max_wait
+            while size < self.max_batch_size:
+                timeout = deadline - time.perf_counter()
+                try:
+                    request = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                request = request[2]
+                if request is None:
+                    self._queue.put((float("inf"), next(self._seq), None))
+                    break
+                if size + len(request.texts) > self.max_batch_size:
+                    carried = request
+                    break
+                batch.append(request)
+                size += len(request.texts)
+            self._encode(batch)
+
+    def _encode(self, batch):
+        started = time.perf_counter()
+        texts = [text for request in batch for text in request.texts]
+        try:
+            vectors = np.asarray(
+                get_encoder(self.model_name).encode(texts, convert_to_numpy=True, batch_size=self.max_batch_size),
+                dtype=np.float32,
+            )
+        except Exception as e:
+            logger.error(f"Batched encode of {len(texts)} texts failed: {e}")
+            for request in batch:
+                request.future.set_exception(e)
+            return
+        finished = time.perf_counter()
+        with self._lock:
+            self._batch_sizes.observe(len(texts))
+            for request in batch:
+                self._queue_times.observe(started - request.enqueued_at)
+            self.encode_seconds += finished - started
+        offset = 0
+        for request in batch:
+            request.future.set_result(vectors[offset:offset + len(request.texts)])
+            offset += len(request.texts)
+
+    def stats(self):
+        with self._lock:
+            batches = self._batch_sizes.count
+            return {
+                "requests": self.requests,
+                "batches": batches,
+                "texts": int(self._batch_sizes.total),
+                "mean_batch_size": self._batch_sizes.total / batches if batches else 0.0,
+                "batch_size": self._batch_sizes.to_dict(),
+                "queue_seconds": self._queue_times.to_dict(),
+                "encode_seconds": round(self.encode_seconds, 3),
+                "queued": self._queue.qsize(),
+            }
+
+    def shutdown(self):
+        if self._thread is not None:
+            self._queue.put((float("inf"), next(self._seq), None))
+            self._thread.join(timeout=5)
+            self._thread = None
+
+
+def _gather(futures):
+    """One future for the row-wise concatenation of several piece futures"""
+    combined = Future()
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def done(_):
+        with lock:
+            remaining[0] -= 1
+            if remaining[0]:
+                return
+        try:
+            combined.set_result(np.concatenate([future.result() for future in futures]))
+        except Exception as e:
+            combined.set_exception(e)
+
+    for future in futures:
+        future.add_done_callback(done)
+    return combined
+
+
+_batchers = {}
+_batchers_lock = threading.Lock()
+
+
+def get_batcher(name=EMBEDDING_MODEL_NAME):
+    """Shared batcher for a model, started on first use"""
+    batcher = _batchers.get(name)
+    if batcher is None:
+        with _batchers_lock:
+            batcher = _batchers.get(name)
+            if batcher is None:
+                batcher = _batchers[name] = EncodeBatcher(name)
+    return batcher
+
+
+def shutdown_batchers():
+    with _batchers_lock:
+        for batcher in _batchers.values():
+            batcher.shutdown()
+        _batchers.clear()
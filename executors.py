@@ -0,0 +1,68 @@
+import os
+import asyncio
+import functools
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+# Threads for blocking I/O and GIL-releasing work (HTTP, file I/O, FAISS, torch encode)
+IO_POOL_WORKERS = int(os.getenv("IO_POOL_WORKERS", "16"))
+# Processes for CPU-bound pure-Python work (PDF parsing)
+CPU_POOL_WORKERS = int(os.getenv("CPU_POOL_WORKERS", str(os.cpu_count() or 1)))
+
+_io_pool = None
+_cpu_pool = None
+_lock = threading.Lock()
+
+
+def get_io_pool():
+    global _io_pool
+    if _io_pool is None:
+        with _lock:
+            if _io_pool is None:
+                _io_pool = ThreadPoolExecutor(max_workers=IO_POOL_WORKERS, thread_name_prefix="blocking-io")
+    return _io_pool
+
+
+def get_cpu_pool():
+    global _cpu_pool
+    if _cpu_pool is None:
+        with _lock:
+            if _cpu_pool is None:
+                # spawn: forking a threaded server process is not safe
+                _cpu_pool = ProcessPoolExecutor(
+                    max_workers=CPU_POOL_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+    return _cpu_pool
+
+
+def discard_cpu_pool():
+    """Drop a process pool whose worker died so the next caller starts a fresh one"""
+    global _cpu_pool
+    with _lock:
+        if _cpu_pool is not None:
+            _cpu_pool.shutdown(wait=False, cancel_futures=True)
+            _cpu_pool = None
+
+
+async def run_blocking(fn, *args, **kwargs):
+    """Await a blocking call on the bounded I/O thread pool instead of the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_io_pool(), functools.partial(fn, *args, **kwargs))
+
+
+def install_default_executor(loop=None):
+    """Make the bounded I/O pool the loop's default executor (run_in_executor(None, ...))"""
+    (loop or asyncio.get_running_loop()).set_default_executor(get_io_pool())
+
+
+def shutdown_pools():
+    global _io_pool, _cpu_pool
+    with _lock:
+        if _io_pool is not None:
+            _io_pool.shutdown(wait=False, cancel_futures=True)
+            _io_pool = None
+        if _cpu_pool is not None:
+            _cpu_pool.shutdown(wait=False, cancel_futures=True)
+            _cpu_pool = None
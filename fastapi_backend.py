@@ -1,6 +1,6 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form
+from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, HTMLResponse
+from fastapi.responses import FileResponse, HTMLResponse, StreamingResponse, JSONResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 from typing import List, Optional
@@ -8,11 +8,28 @@ import os
 import json
 import uuid
 import asyncio
+import time
 from datetime import datetime
 import logging
 import tempfile
 import shutil
-from functions import Video_Transcript, load_pdfs_from_folder, chunks_from_doc, embed_index_chunks_hybrid
+from functions import (Video_Transcript, load_pdfs_from_folder, chunks_from_doc, embed_index_chunks_hybrid,
+                       append_chunks_hybrid, remove_source_hybrid, list_session_sources,
+                       retrieve_top_chunks_hybrid, delete_embeddings, list_indexed_sessions,
+                       session_manifest)
+from model_registry import warm_up as warm_up_encoders
+from ingestion_jobs import job_manager
+from executors import run_blocking, install_default_executor, shutdown_pools
+from llm_client import ollama_client, LLM_MODELS
+from llm_scheduler import llm_scheduler, LLMOverloaded
+from prompt_cache import prompt_state_cache
+from answer_cache import answer_cache
+from session_cache import session_index_cache
+from retrieval_memo import query_embedding_memo, retrieval_memo
+from encode_batcher import get_batcher, shutdown_batchers
+from session_store import session_store
+from session_lifecycle import session_lifecycle
+from metrics import render_prometheus
 from MCQs_with_LLM import *
 from Ask_with_llm import *
 
@@ -47,10 +64,84 @@ logger = logging.getLogger(__name__)
 
 
 
-# Global variables to store processed content
-processed_content = {}
-current_session_id = None
-generated_quiz_cache = {} 
+@app.exception_handler(LLMOverloaded)
+async def llm_overloaded_handler(request: Request, exc: LLMOverloaded):
+    """Queue wait would exceed the deadline: tell the client when to come back"""
+    return JSONResponse(
+        status_code=429,
+        content={"detail": str(exc), "retry_after": exc.retry_after},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+@app.on_event("startup")
+async def warm_up_models():
+    """Load the embedding model before the first request instead of on it"""
+    # Stray run_in_executor(None, ...) calls share the same bounded pool
+    install_default_executor()
+    if os.getenv("EMBEDDING_WARMUP", "1") == "1":
+        await run_blocking(warm_up_encoders)
+        logger.info("Embedding model warmed up")
+    session_lifecycle.start()
+
+
+@app.on_event("shutdown")
+async def stop_ingestion_jobs():
+    job_manager.shutdown()
+    session_lifecycle.shutdown()
+    shutdown_batchers()
+    shutdown_pools()
+    await ollama_client.aclose()
+
+
+# Session state lives in the shared store, not in module globals, so that any
+# worker process can serve any session: "content" (what a session was built
+# from), "quizzes" (latest quiz per session) and "current" (last created
+# session). The extracted text is not kept: the session's bundle has its chunks.
+def _valid_session_id(session_id):
+    """Session ids name a directory under SESSION_DIR: one path component, nothing that escapes it"""
+    return bool(session_id) and os.path.basename(session_id) == session_id and session_id not in (".", "..")
+
+def _restore_content(session_id):
+    """Catalog record of a session indexed on disk that the store does not know
+    (it expired, or predates a restart with the memory backend), from its bundle manifest"""
+    if not _valid_session_id(session_id):
+        return None
+    try:
+        manifest = session_manifest(session_id, SESSION_DIR)
+    except FileNotFoundError:
+        return None
+    sources = [source for source, _ in manifest["sources"]]
+    record = {
+        "processed_at": datetime.fromtimestamp(manifest["created_at"]).isoformat(),
+        "chunks": manifest["n_chunks"],
+        "restored": True,
+    }
+    if len(sources) == 1 and sources[0].startswith(("http://", "https://")):
+        record.update(type="youtube", url=sources[0])
+    else:
+        record.update(type="pdf", files=sources)
+    return record
+
+session_store.register_fallback("content", _restore_content)
+
+def _forget_session(session_id):
+    """Drop the store records of a session whose index is gone (deleted, or removed by the disk quota)"""
+    for namespace in ("content", "quizzes"):
+        session_store.delete(namespace, session_id)
+    prompt_state_cache.drop(session_id)
+
+session_lifecycle.on_delete = _forget_session
+
+def _current_session_id():
+    return session_store.get("current", "session_id")
+
+def _set_current_session(session_id):
+    session_store.put("current", "session_id", session_id)
+
+def _has_content(session_id):
+    # Blocking (SQLite, and may restore the record from disk): call through run_blocking from async code
+    return _valid_session_id(session_id) and session_store.contains("content", session_id)
 
 # Pydantic models for request/response
 class YouTubeRequest(BaseModel):
@@ -59,6 +150,7 @@ class YouTubeRequest(BaseModel):
 class ChatRequest(BaseModel):
     message: str
     session_id: Optional[str] = None
+    bypass_cache: bool = False   # always generate, even if a near-identical question was answered
 
 class QuizRequest(BaseModel):
     num_questions: int = 5
@@ -76,6 +168,7 @@ class ProcessResponse(BaseModel):
     success: bool
     message: str
     session_id: str
+    job_id: Optional[str] = None
 
 class EvaluationRequest(BaseModel):
     session_id: str
@@ -84,48 +177,112 @@ class EvaluationRequest(BaseModel):
 # Serve static files (your HTML frontend)
 import os
 STATIC_DIR = os.path.join(BASE_DIR, "static")
-# Remove the existing static mount and add this:
-app.mount("/", StaticFiles(directory="static", html=True), name="static")
 
 @app.get("/", response_class=HTMLResponse)
 async def serve_frontend():
     return FileResponse(os.path.join(STATIC_DIR, "index.html"))
 
 
+def _ingest_youtube(job, url):
+    """Background job: transcript -> chunks -> hybrid indices"""
+    job.set_stage("extracting")
+    transcript = Video_Transcript(url, "English")
+
+    job.set_stage("chunking")
+    chunks = chunks_from_doc(transcript)
+    embed_index_chunks_hybrid(chunks, job.session_id, progress=job.progress, sources=[url] * len(chunks))
+
+    # Store processed content only once the session is searchable
+    session_store.put("content", job.session_id, {
+        "type": "youtube",
+        "url": url,
+        "chunks": len(chunks),
+        "processed_at": datetime.now().isoformat()
+    })
+    logger.info(f"Successfully processed YouTube content for session: {job.session_id}")
+    return {"chunks": len(chunks)}
+
+
+def _ingest_pdfs(job, file_paths, filenames):
+    """Background job: PDF text -> chunks -> hybrid indices"""
+    job.set_stage("extracting")
+    extracted_text = load_pdfs_from_folder(file_paths)
+    if not extracted_text:
+        raise ValueError("No valid PDF files were processed.")
+
+    job.set_stage("chunking")
+    chunks, sources = _chunks_by_source(extracted_text)
+    embed_index_chunks_hybrid(chunks, job.session_id, progress=job.progress, sources=sources)
+
+    session_store.put("content", job.session_id, {
+        "type": "pdf",
+        "files": filenames,
+        "chunks": len(chunks),
+        "processed_at": datetime.now().isoformat()
+    })
+    logger.info(f"Successfully processed PDF files for session: {job.session_id}")
+    return {"chunks": len(chunks), "files": len(filenames)}
+
+
+def _chunks_by_source(documents):
+    """Chunks of every document (a PDF page each) plus the file name each came from (its source id)"""
+    chunks, sources = [], []
+    for document in documents:
+        document_chunks = chunks_from_doc([document])
+        chunks.extend(document_chunks)
+        sources.extend([os.path.basename(document.metadata["source"])] * len(document_chunks))
+    return chunks, sources
+
+
+def _append_pdfs(job, file_paths, filenames):
+    """Background job: index each PDF into an existing session, leaving its other documents untouched"""
+    job.set_stage("extracting")
+    documents = load_pdfs_from_folder(file_paths)
+    if not documents:
+        raise ValueError("No valid PDF files were processed.")
+
+    pages_by_file = {}
+    for document in documents:
+        pages_by_file.setdefault(document.metadata["source"], []).append(document)
+
+    total = 0
+    for path, pages in pages_by_file.items():
+        job.set_stage("chunking")
+        chunks, _ = _chunks_by_source(pages)
+        if chunks:
+            total = append_chunks_hybrid(chunks, job.session_id, os.path.basename(path), progress=job.progress)
+
+    content = session_store.get("content", job.session_id) or {"type": "pdf", "files": []}
+    content["files"] = list(dict.fromkeys(content.get("files", []) + filenames))
+    content["chunks"] = total
+    content["processed_at"] = datetime.now().isoformat()
+    session_store.put("content", job.session_id, content)
+    logger.info(f"Appended {len(pages_by_file)} PDF files to session: {job.session_id}")
+    return {"chunks": total, "files": len(filenames)}
+
+
+def _save_upload(fileobj, file_path):
+    with open(file_path, "wb") as buffer:
+        shutil.copyfileobj(fileobj, buffer)
+
+
 @app.post("/process_youtube", response_model=ProcessResponse)
 async def process_youtube_endpoint(request: YouTubeRequest):
-    """Process YouTube URL and extract transcript"""
+    """Queue a YouTube URL for transcript extraction and indexing"""
     try:
-        global current_session_id, processed_content
-        
         # Generate session ID
         session_id = f"session_{str(uuid.uuid4())}"
-        current_session_id = session_id
+        await run_blocking(_set_current_session, session_id)
         
         logger.info(f"Processing YouTube URL: {request.url}")
-        
-        # TODO: Replace with your actual YouTube processing function
-        transcript = Video_Transcript(request.url)
-        
-        
-        # TODO: Replace with your actual chunk creation and embedding storage
-        chunks = chunks_from_doc(transcript)
-        embed_index_chunks_hybrid(chunks, session_id)
-        
-        # Store processed content
-        processed_content[session_id] = {
-            "type": "youtube",
-            "url": request.url,
-            "content": transcript,
-            "processed_at": datetime.now().isoformat()
-        }
-        
-        logger.info(f"Successfully processed YouTube content for session: {session_id}")
+        job = await run_blocking(job_manager.submit, "youtube", session_id,
+                                 lambda job: _ingest_youtube(job, request.url))
         
         return ProcessResponse(
             success=True,
-            message="YouTube content processed successfully!",
-            session_id=session_id
+            message="YouTube content queued for processing. Poll /jobs/{job_id} for progress.",
+            session_id=session_id,
+            job_id=job.id
         )
         
     except Exception as e:
@@ -134,81 +291,189 @@ async def process_youtube_endpoint(request: YouTubeRequest):
 
 @app.post("/process_pdfs", response_model=ProcessResponse)
 async def process_pdfs_endpoint(files: List[UploadFile] = File(...)):
-    """Process uploaded PDF files"""
+    """Save uploaded PDF files and queue them for extraction and indexing"""
+    temp_dir = None
     try:
-        global current_session_id, processed_content
-        
         # Generate session ID
         session_id = f"session_{str(uuid.uuid4())}"
-        current_session_id = session_id
+        await run_blocking(_set_current_session, session_id)
         
         logger.info(f"Processing {len(files)} PDF files")
         
-        # Create temporary directory for uploaded files
+        # Create temporary directory for uploaded files; the job removes it when done
         temp_dir = tempfile.mkdtemp()
         uploaded_files = []
         
-        try:
-            # Save uploaded files
-            for file in files:
-                if not file.filename.endswith('.pdf'):
-                    raise HTTPException(status_code=400, detail=f"File {file.filename} is not a PDF")
-                
-                file_path = os.path.join(temp_dir, file.filename)
-                with open(file_path, "wb") as buffer:
-                    shutil.copyfileobj(file.file, buffer)
-                uploaded_files.append(file_path)
-            
-            # TODO: Replace with your actual PDF processing function
-            extracted_text = load_pdfs_from_folder(uploaded_files)
-            
-            
-            # TODO: Replace with your actual chunk creation and embedding storage
-            chunks = chunks_from_doc(extracted_text)
-            embed_index_chunks_hybrid(chunks, session_id)
-            
-            # Store processed content
-            processed_content[session_id] = {
-                "type": "pdf",
-                "files": [f.filename for f in files],
-                "content": extracted_text,
-                "processed_at": datetime.now().isoformat()
-            }
+        # Save uploaded files (disk writes off the event loop)
+        for file in files:
+            if not file.filename.endswith('.pdf'):
+                raise HTTPException(status_code=400, detail=f"File {file.filename} is not a PDF")
             
-            logger.info(f"Successfully processed PDF files for session: {session_id}")
-            
-            return ProcessResponse(
-                success=True,
-                message=f"Successfully processed {len(files)} PDF files!",
-                session_id=session_id
-            )
-            
-        finally:
-            # Clean up temporary files
-            shutil.rmtree(temp_dir, ignore_errors=True)
+            file_path = os.path.join(temp_dir, file.filename)
+            await run_blocking(_save_upload, file.file, file_path)
+            uploaded_files.append(file_path)
+        
+        filenames = [f.filename for f in files]
+        job_dir = temp_dir
+        job = await run_blocking(
+            job_manager.submit,
+            "pdf",
+            session_id,
+            lambda job: _ingest_pdfs(job, uploaded_files, filenames),
+            on_finish=lambda job: shutil.rmtree(job_dir, ignore_errors=True),
+        )
+        temp_dir = None
+        
+        return ProcessResponse(
+            success=True,
+            message=f"Queued {len(files)} PDF files for processing. Poll /jobs/{{job_id}} for progress.",
+            session_id=session_id,
+            job_id=job.id
+        )
             
     except Exception as e:
         logger.error(f"Error processing PDF files: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error processing PDF files: {str(e)}")
+    finally:
+        # Only still set if the job was never queued
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+@app.post("/sessions/{session_id}/pdfs", response_model=ProcessResponse)
+async def append_pdfs_endpoint(session_id: str, files: List[UploadFile] = File(...)):
+    """Queue PDFs to be added to an existing session; only the new files are encoded"""
+    if not await run_blocking(_has_content, session_id):
+        raise HTTPException(status_code=404, detail="Session not found")
+    temp_dir = tempfile.mkdtemp()
+    try:
+        uploaded_files = []
+        for file in files:
+            if not file.filename.endswith('.pdf'):
+                raise HTTPException(status_code=400, detail=f"File {file.filename} is not a PDF")
+            file_path = os.path.join(temp_dir, file.filename)
+            await run_blocking(_save_upload, file.file, file_path)
+            uploaded_files.append(file_path)
+
+        filenames = [f.filename for f in files]
+        job_dir = temp_dir
+        job = await run_blocking(
+            job_manager.submit,
+            "pdf_append",
+            session_id,
+            lambda job: _append_pdfs(job, uploaded_files, filenames),
+            on_finish=lambda job: shutil.rmtree(job_dir, ignore_errors=True),
+        )
+        temp_dir = None
+        return ProcessResponse(
+            success=True,
+            message=f"Queued {len(files)} PDF files to add to the session. Poll /jobs/{{job_id}} for progress.",
+            session_id=session_id,
+            job_id=job.id
+        )
+    finally:
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir, ignore_errors=True)
 
+@app.get("/sessions/{session_id}/sources")
+async def list_sources_endpoint(session_id: str):
+    """Source documents in a session's index with their chunk counts"""
+    if not _valid_session_id(session_id):
+        raise HTTPException(status_code=404, detail="Session not found")
+    try:
+        sources = await run_blocking(list_session_sources, session_id)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Session index not found")
+    return {"session_id": session_id, "sources": [
+        {"source_id": source, "chunks": count} for source, count in sources.items()
+    ]}
+
+def _drop_source_from_content(session_id, source_id, removed):
+    content = session_store.get("content", session_id)
+    if content:
+        if source_id in content.get("files", []):
+            content["files"].remove(source_id)
+        content["chunks"] = max(0, content.get("chunks", 0) - removed)
+        session_store.put("content", session_id, content)
+
+@app.delete("/sessions/{session_id}/sources/{source_id:path}")
+async def remove_source_endpoint(session_id: str, source_id: str):
+    """Remove one source document's chunks from a session's index"""
+    if not _valid_session_id(session_id):
+        raise HTTPException(status_code=404, detail="Session not found")
+    try:
+        removed = await run_blocking(remove_source_hybrid, session_id, source_id)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Session index not found")
+    if not removed:
+        raise HTTPException(status_code=404, detail="Source not found in session")
+    await run_blocking(_drop_source_from_content, session_id, source_id, removed)
+    return {"session_id": session_id, "source_id": source_id, "chunks_removed": removed}
+
+@app.get("/sessions/{session_id}/search")
+async def search_session_endpoint(session_id: str, q: str, top_k: int = 5):
+    """Hybrid retrieval only, no LLM: the chunks a chat answer would be grounded on"""
+    if not _valid_session_id(session_id):
+        raise HTTPException(status_code=404, detail="Session not found")
+    try:
+        results = await run_blocking(retrieve_top_chunks_hybrid, q, top_k, session_id, return_scores=True)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Session index not found")
+    return {"session_id": session_id, "results": [
+        {"chunk": chunk, "score": score} for chunk, score in results
+    ]}
+
+@app.get("/jobs/{job_id}")
+async def get_job_status(job_id: str):
+    """Report stage, chunk progress and ETA of an ingestion job"""
+    status = await run_blocking(job_manager.status, job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return status
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """Request cancellation of a queued or running ingestion job"""
+    status = await run_blocking(job_manager.cancel, job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {"job_id": job_id, "status": status["status"], "cancel_requested": status["cancel_requested"]}
+
+
+def _append_mcqs_file(session_id, questions):
+    session_folder = os.path.join(BASE_DIR, "user_session", session_id)
+    os.makedirs(session_folder, exist_ok=True)
+    file_path = os.path.join(session_folder, "mcqs.json")
+
+    if os.path.exists(file_path):
+        with open(file_path, "r") as f:
+            existing_data = json.load(f)
+    else:
+        existing_data = []
+
+    updated_data = existing_data + questions
+
+    with open(file_path, "w") as f:
+        json.dump(updated_data, f, indent=2)
+    return file_path
 
 
 @app.post("/generate_quiz", response_model=List[dict])
 async def generate_quiz_endpoint(request: QuizRequest):
     """Generate MCQ quiz questions based on processed content"""
     try:
-        session_id = request.session_id or current_session_id
+        session_id = request.session_id or await run_blocking(_current_session_id)
 
-        if not session_id or session_id not in processed_content:
+        if not await run_blocking(_has_content, session_id):
             raise HTTPException(status_code=400, detail="No processed content found. Please upload content first.")
 
         logger.info(f"Generating quiz with {request.num_questions} questions for session: {session_id}")
 
         # Step 1: Generate raw MCQs from LLM
-        raw_mcqs = generate_mcqs_text_llm()
+        raw_mcqs = await run_blocking(generate_mcqs_text_llm, session_id)
 
         # Step 2: Convert MCQs into JSON using LLM
-        mcq_json_text = convert_mcqs_in_json_llm(MCQs=raw_mcqs)
+        mcq_json_text = await run_blocking(convert_mcqs_in_json_llm, MCQs=raw_mcqs)
 
         # Step 3: Extract clean JSON
         mcqs = extract_clean_json(mcq_json_text)
@@ -224,28 +489,17 @@ async def generate_quiz_endpoint(request: QuizRequest):
             final_questions.append(q)
 
         # Step 6: Save only new questions to in-memory cache for evaluation
-        generated_quiz_cache[session_id] = final_questions
+        await run_blocking(session_store.put, "quizzes", session_id, final_questions)
 
         # Step 7: Append questions to persistent file for reference
-        session_folder = os.path.join(BASE_DIR, "user_session", session_id)
-        os.makedirs(session_folder, exist_ok=True)
-        file_path = os.path.join(session_folder, "mcqs.json")
-
-        if os.path.exists(file_path):
-            with open(file_path, "r") as f:
-                existing_data = json.load(f)
-        else:
-            existing_data = []
-
-        updated_data = existing_data + final_questions
-
-        with open(file_path, "w") as f:
-            json.dump(updated_data, f, indent=2)
+        file_path = await run_blocking(_append_mcqs_file, session_id, final_questions)
 
         logger.info(f"Appended {len(final_questions)} questions and saved to {file_path}")
 
         return final_questions
 
+    except LLMOverloaded:
+        raise
     except Exception as e:
         logger.error(f"Error generating quiz: {e}")
         raise HTTPException(status_code=500, detail="Failed to generate quiz questions.")
@@ -254,10 +508,11 @@ async def generate_quiz_endpoint(request: QuizRequest):
 async def get_quiz(session_id: str):
     """Retrieve the latest generated MCQs for the session"""
     try:
-        if session_id not in generated_quiz_cache:
+        questions = await run_blocking(session_store.get, "quizzes", session_id)
+        if questions is None:
             raise HTTPException(status_code=404, detail="No quiz generated recently for this session")
 
-        return generated_quiz_cache[session_id]
+        return questions
 
     except Exception as e:
         logger.error(f"Error retrieving quiz: {e}")
@@ -267,10 +522,10 @@ async def get_quiz(session_id: str):
 async def evaluate_quiz(request: EvaluationRequest):
     """Evaluate user's answers against the latest generated quiz"""
     try:
-        if request.session_id not in generated_quiz_cache:
+        latest_questions = await run_blocking(session_store.get, "quizzes", request.session_id)
+        if latest_questions is None:
             raise HTTPException(status_code=404, detail="No quiz found to evaluate. Please generate quiz first.")
 
-        latest_questions = generated_quiz_cache[request.session_id]
         correct_answers = [q["answer"] for q in latest_questions[:len(request.user_answers)]]
         score = sum(1 for user_ans, correct in zip(request.user_answers, correct_answers) if user_ans == correct)
 
@@ -288,8 +543,12 @@ async def test_connection():
         "endpoints": [
             "/process_youtube",
             "/process_pdfs",
+            "/jobs/{job_id}",
             "/generate_quiz",
             "/chat",
+            "/chat/stream",
+            "/llm/stats",
+            "/retrieval/stats",
             "/health"
         ],
         "timestamp": datetime.now().isoformat()
@@ -314,15 +573,15 @@ async def download_mcqs(session_id: str):
 async def chat_endpoint(request: ChatRequest):
     """Handle chat messages and provide responses"""
     try:
-        session_id = request.session_id or current_session_id
+        session_id = request.session_id or await run_blocking(_current_session_id)
 
-        if not session_id or session_id not in processed_content:
+        if not await run_blocking(_has_content, session_id):
             raise HTTPException(status_code=400, detail="No processed content found. Please upload content first.")
 
         logger.info(f"Processing chat message for session: {session_id}")
 
-        # Use the actual RAG-based LLM function
-        response = ask_llm(request.message, session_id)
+        # Use the actual RAG-based LLM function (retrieval on the I/O pool, async HTTP to Ollama)
+        response, latency = await ask_llm_async(request.message, session_id, use_cache=not request.bypass_cache)
 
         logger.info(f"Generated response for session: {session_id}")
 
@@ -331,11 +590,142 @@ async def chat_endpoint(request: ChatRequest):
             session_id=session_id
         )
 
+    except LLMOverloaded:
+        raise
     except Exception as e:
         logger.error(f"Error processing chat message: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error processing chat message: {str(e)}")
 
 
+def _sse(event, data):
+    """One server-sent event frame"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.post("/chat/stream")
+async def chat_stream_endpoint(request: ChatRequest, http_request: Request):
+    """Stream a chat answer as server-sent events.
+
+    Emits one `metadata` event with the retrieved sources as soon as retrieval
+    finishes, then `token` events as the model generates, then `done` (or
+    `error`). If the client disconnects, the upstream Ollama request is closed
+    so the model stops generating.
+    """
+    session_id = request.session_id or await run_blocking(_current_session_id)
+
+    if not await run_blocking(_has_content, session_id):
+        raise HTTPException(status_code=400, detail="No processed content found. Please upload content first.")
+
+    # Turn the request away before the stream starts, while a 429 can still be sent
+    llm_scheduler.check("chat")
+    logger.info(f"Streaming chat message for session: {session_id}")
+
+    async def event_stream():
+        start = time.time()
+        try:
+            retrieved, cache_key, cached = await run_blocking(
+                retrieve_for_answer, request.message, session_id,
+                use_cache=not request.bypass_cache, return_scores=True
+            )
+        except Exception as e:
+            logger.error(f"Retrieval failed for session {session_id}: {e}")
+            yield _sse("error", {"detail": f"Retrieval failed: {e}"})
+            return
+        retrieval_seconds = time.time() - start
+        sources = [
+            {"rank": rank, "score": score, "preview": chunk[:200]}
+            for rank, (chunk, score) in enumerate(retrieved)
+        ]
+        if cached is not None:
+            yield _sse("metadata", {"session_id": session_id, "retrieval_seconds": round(retrieval_seconds, 3),
+                                    "sources": sources, "cached": True})
+            yield _sse("token", {"token": cached})
+            yield _sse("done", {"tokens": 1, "time_to_first_token": round(time.time() - start, 3),
+                                "total_seconds": round(time.time() - start, 3), "cached": True})
+            return
+
+        turn = await run_blocking(begin_session_turn, request.message, session_id,
+                                  retrieved=[chunk for chunk, _ in retrieved])
+        yield _sse("metadata", {
+            "session_id": session_id,
+            "retrieval_seconds": round(retrieval_seconds, 3),
+            "sources": sources,
+            "prompt_tokens": turn.usage,
+            "cached": False,
+        })
+
+        parts = []
+        finals = []
+
+        # Session context and answer cache are only updated if the answer streams to completion
+        tokens = ollama_client.agenerate_stream(turn.prompt, model=LLM_MODELS["chat"], options=CHAT_OPTIONS,
+                                                session_id=session_id, on_done=finals.append,
+                                                **ollama_carry_over(turn))
+        first_token_at = None
+        n_tokens = 0
+        try:
+            async for token in tokens:
+                if await http_request.is_disconnected():
+                    logger.info(f"Client disconnected; aborting generation for session: {session_id}")
+                    return
+                if first_token_at is None:
+                    first_token_at = time.time()
+                n_tokens += 1
+                parts.append(token)
+                yield _sse("token", {"token": token})
+            if finals:
+                await run_blocking(finish_turn, turn, finals[0], cache_key, "".join(parts))
+            yield _sse("done", {
+                "tokens": n_tokens,
+                "time_to_first_token": round(first_token_at - start, 3) if first_token_at else None,
+                "total_seconds": round(time.time() - start, 3),
+            })
+        except LLMOverloaded as e:
+            yield _sse("error", {"detail": str(e), "retry_after": e.retry_after})
+        except Exception as e:
+            logger.error(f"Error streaming chat message: {str(e)}")
+            yield _sse("error", {"detail": str(e)})
+        finally:
+            # Closing the generator closes the HTTP stream, which cancels generation in Ollama
+            await tokens.aclose()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/llm/stats")
+async def llm_stats():
+    """Scheduler queue depth and queue-wait histograms, client pool counters, prompt state and answer cache"""
+    return {
+        "scheduler": llm_scheduler.stats(),
+        "client": ollama_client.stats(),
+        "prompt_cache": prompt_state_cache.stats(),
+        "answer_cache": answer_cache.stats(),
+    }
+
+
+@app.get("/retrieval/stats")
+async def retrieval_stats():
+    """Session-index cache and memo hit rates, encode batch sizes and queue times, disk tiers"""
+    return {
+        "encoder": get_batcher().stats(),
+        "session_indices": session_index_cache.stats(),
+        "query_embeddings": query_embedding_memo.stats(),
+        "retrievals": retrieval_memo.stats(),
+        "session_tiers": await run_blocking(session_lifecycle.stats),
+    }
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """Prometheus text format: per-stage latency histograms plus the numbers from /llm/stats and /retrieval/stats"""
+    stats = {"llm": await llm_stats(), "retrieval": await retrieval_stats()}
+    return PlainTextResponse(render_prometheus(stats), media_type="text/plain; version=0.0.4")
+
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
@@ -344,31 +734,38 @@ async def health_check():
 @app.get("/sessions/{session_id}")
 async def get_session_info(session_id: str):
     """Get information about a specific session"""
-    if session_id not in processed_content:
+    content = await run_blocking(session_store.get, "content", session_id)
+    if content is None:
         raise HTTPException(status_code=404, detail="Session not found")
     
     return {
         "session_id": session_id,
-        "content_info": processed_content[session_id],
+        "content_info": content,
         "status": "active"
     }
 
 @app.delete("/sessions/{session_id}")
 async def delete_session(session_id: str):
-    """Delete a session and its processed content"""
-    if session_id not in processed_content:
+    """Delete a session, its processed content and its indices"""
+    if not await run_blocking(_has_content, session_id):
         raise HTTPException(status_code=404, detail="Session not found")
     
-    del processed_content[session_id]
+    # The index goes too, or the catalog would restore the session from it
+    await run_blocking(delete_embeddings, session_id, SESSION_DIR)
+    await run_blocking(_forget_session, session_id)
     
     return {"message": f"Session {session_id} deleted successfully"}
 
 @app.get("/sessions")
 async def list_sessions():
     """List all active sessions"""
+    # Sessions the store knows plus those only indexed on disk (restored on first access)
+    on_disk = await run_blocking(list_indexed_sessions, SESSION_DIR)
+    known = await run_blocking(session_store.keys, "content")
+    sessions = list(dict.fromkeys(known + sorted(on_disk)))
     return {
-        "sessions": list(processed_content.keys()),
-        "total": len(processed_content)
+        "sessions": sessions,
+        "total": len(sessions)
     }
 
 
@@ -390,6 +787,9 @@ async def upload_multiple_files(files: List[UploadFile] = File(...)):
         logger.error(f"Error uploading multiple files: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error uploading files: {str(e)}")
 
+# Mounted last: a mount at "/" matches every path, so routes declared after it were unreachable
+app.mount("/", StaticFiles(directory="static", html=True), name="static")
+
 if __name__ == "__main__":
     import uvicorn
     
@@ -7,16 +7,29 @@ import numpy as np
 from langchain.schema import Document
 import shutil
 import pickle
+import hashlib
+import json
 import faiss
-from sentence_transformers import SentenceTransformer
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from youtube_transcript_api import YouTubeTranscriptApi
-from rank_bm25 import BM25Okapi
-
-
-def get_model():
-    return SentenceTransformer("all-MiniLM-L6-v2")
-model = get_model()
+from sparse_bm25 import SparseBM25
+from ann_index import (build_faiss_index, apply_search_params, load_index_params,
+                       needs_rebuild, add_to_index, remove_from_index, reconstruct_vectors)
+from session_cache import SessionIndices, session_index_cache, estimate_nbytes
+from session_bundle import SessionBundle, write_bundle, BUNDLE_FILE
+from session_lifecycle import (session_lifecycle, session_lock, archive_path, archived_manifest,
+                               ARCHIVE_FILES, LOCK_FILE)
+from model_registry import get_encoder, cache_namespace, EMBEDDING_MODEL_NAME
+from embedding_cache import encode_with_cache
+from pdf_extraction import extract_pdfs, find_pdf_files
+from retrieval_memo import query_embedding_memo, retrieval_memo, normalize_query
+from encode_batcher import get_batcher, ENCODE_BATCHING, BULK
+from metrics import span, timed
+
+
+def get_model(name=EMBEDDING_MODEL_NAME):
+    # Shared, lazily loaded encoder; nothing is loaded at import time
+    return get_encoder(name)
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 SESSION_DIR = os.path.join(BASE_DIR, "user_session")
@@ -26,9 +39,55 @@ Langs = {"Hindi":'hi', "English":'en',"Bengali":'bn',"Chinese":'zh',
 
 Models = {"Smalest_quen_model": "qwen:1.8b", "Medium_quen_model": "qwen:7b", "Quen_Model": "qwen:14b"}
 
-
-def embed_index_chunks_hybrid(sample_chunks, session_id: str, session_dir=SESSION_DIR):
-    """"Create and save hybrid retrieval indices"""
+EMBED_BATCH_SIZE = 256  # chunks encoded between progress reports
+
+
+@timed("encode_chunks")
+def _encode_chunks(chunks, progress=None):
+    """Embeddings for chunks, reporting progress(stage, done, total) per batch if given"""
+    # Through the shared batcher at bulk priority, so concurrent queries are served between our batches
+    model = get_batcher().view(BULK) if ENCODE_BATCHING else get_model()
+    # Chunks seen before (same text, same model) come from the shared embedding cache
+    if progress is None:
+        return encode_with_cache(model, chunks, cache_namespace())
+    batches = []
+    progress("embedding", 0, len(chunks))
+    for start in range(0, len(chunks), EMBED_BATCH_SIZE):
+        batch = chunks[start:start + EMBED_BATCH_SIZE]
+        batches.append(encode_with_cache(model, batch, cache_namespace()))
+        progress("embedding", start + len(batch), len(chunks))
+    progress("indexing", len(chunks), len(chunks))
+    return np.concatenate(batches)
+
+
+def _session_write_lock(session_path):
+    """Serializes index rewrites of one session, within this process and against other workers"""
+    return session_lock(session_path)
+
+
+def _save_session_files(session_path, faiss_index, index_params, chunks, sources, bm25_index):
+    """Replace the session's bundle in one rename; readers see the old or the new session, never a mix"""
+    write_bundle(
+        os.path.join(session_path, BUNDLE_FILE), faiss_index, index_params, chunks, sources, bm25_index,
+        model=cache_namespace(),
+        chunk_params={"chunk_size": CHUNK_SIZE, "chunk_overlap": CHUNK_OVERLAP},
+    )
+    # Loose files from before bundles, and any archive, are superseded now
+    for name in LEGACY_INDEX_FILES + ARCHIVE_FILES:
+        path = os.path.join(session_path, name)
+        if os.path.exists(path):
+            os.remove(path)
+    session_index_cache.invalidate(session_path)
+    retrieval_memo.invalidate(session_path)
+
+
+def embed_index_chunks_hybrid(sample_chunks, session_id: str, session_dir=SESSION_DIR, progress=None, sources=None):
+    """"Create and save hybrid retrieval indices
+
+    progress(stage, done, total), if given, is called after every encoded batch
+    and before indexing; it may raise to abort the build. sources, if given,
+    is the source document id of each chunk (see append_chunks_hybrid).
+    """
     if session_dir is None:
         BASE_DIR = os.path.dirname(os.path.abspath(__file__))
         session_dir = os.path.join(BASE_DIR, "user_session")
@@ -37,25 +96,147 @@ def embed_index_chunks_hybrid(sample_chunks, session_id: str, session_dir=SESSIO
     os.makedirs(session_path, exist_ok=True)
 
     # 1. Semantic indexing (FAISS)
-    model = get_model()
-    embeddings = model.encode(sample_chunks, convert_to_numpy=True)
-    dim = embeddings.shape[1]
-    faiss_index = faiss.IndexFlatL2(dim)
-    faiss_index.add(embeddings)
+    embeddings = _encode_chunks(sample_chunks, progress)
+    # Flat for small sessions, HNSW / IVF-PQ for large ones (see ann_index)
+    faiss_index, index_params = build_faiss_index(embeddings)
 
     # 2. Keyword indexing (BM25)
     tokenized_chunks = [chunk.split() for chunk in sample_chunks]
-    bm25_index = BM25Okapi(tokenized_chunks)
+    bm25_index = SparseBM25.build(tokenized_chunks)
 
     # Save all components
-    faiss.write_index(faiss_index, os.path.join(session_path, "faiss_index.idx"))
-    with open(os.path.join(session_path, "chunks.pkl"), "wb") as f:
-        pickle.dump(sample_chunks, f)
-    with open(os.path.join(session_path, "bm25_index.pkl"), "wb") as f:
-        pickle.dump(bm25_index, f)
+    with _session_write_lock(session_path):
+        _save_session_files(session_path, faiss_index, index_params, list(sample_chunks),
+                            sources or [None] * len(sample_chunks), bm25_index)
 
     return faiss_index, bm25_index
 
+
+def list_session_sources(session_id: str, session_dir=SESSION_DIR):
+    """{source id: chunk count} in the order the sources were added"""
+    session_path = os.path.join(session_dir, session_id)
+    counts = {}
+    for source, count in session_manifest(session_id, session_dir)["sources"]:
+        counts[source] = counts.get(source, 0) + count
+    return counts
+
+
+def append_chunks_hybrid(new_chunks, session_id: str, source_id, session_dir=SESSION_DIR, progress=None):
+    """Add one source document's chunks to a session without re-indexing what is already there.
+
+    Only the new chunks are encoded, before the session is locked; they are
+    added to the FAISS index in place (rebuilt from the vectors it holds when
+    it outgrows its type or training, see ann_index.needs_rebuild), and BM25
+    postings and statistics are merged. A source id that is already present is
+    replaced. The first source builds the session; concurrent first uploads
+    end up appended to each other. Returns the session's chunk count.
+    """
+    session_path = os.path.join(session_dir, session_id)
+    # Before locking, so the lock file (and its cross-process flock) exists for a new session
+    os.makedirs(session_path, exist_ok=True)
+    new_embeddings = _encode_chunks(new_chunks, progress)
+    first_build = None
+    if not _has_session_index(session_path):
+        first_build = build_faiss_index(new_embeddings)
+
+    with _session_write_lock(session_path):
+        os.makedirs(session_path, exist_ok=True)   # in case a delete emptied it while we waited
+        if not _has_session_index(session_path):
+            faiss_index, index_params = first_build or build_faiss_index(new_embeddings)
+            _save_session_files(session_path, faiss_index, index_params, list(new_chunks),
+                                [source_id] * len(new_chunks),
+                                SparseBM25.build([chunk.split() for chunk in new_chunks]))
+            return len(new_chunks)
+
+        # Another upload created the session first (or it already existed): append to it
+        faiss_index, index_params, chunks, sources, bm25_index = _read_session_for_update(session_path)
+        if source_id in sources:
+            faiss_index, index_params, chunks, sources, bm25_index = _without_source(
+                faiss_index, index_params, chunks, sources, bm25_index, source_id
+            )
+
+        total = len(chunks) + len(new_chunks)
+        if faiss_index is None or needs_rebuild(index_params, total):
+            if chunks:
+                embeddings = np.concatenate([_vectors_for_rebuild(faiss_index, index_params, chunks),
+                                             new_embeddings])
+            else:
+                embeddings = new_embeddings
+            faiss_index, index_params = build_faiss_index(embeddings)
+        else:
+            add_to_index(faiss_index, index_params, new_embeddings)
+
+        tokenized_chunks = [chunk.split() for chunk in new_chunks]
+        if bm25_index is not None and bm25_index.tf is not None:
+            bm25_index = bm25_index.append(tokenized_chunks)
+        else:
+            # Saved before term frequencies were kept: one full build upgrades it
+            bm25_index = SparseBM25.build([chunk.split() for chunk in chunks] + tokenized_chunks)
+
+        chunks = chunks + list(new_chunks)
+        sources = sources + [source_id] * len(new_chunks)
+        _save_session_files(session_path, faiss_index, index_params, chunks, sources, bm25_index)
+    return len(chunks)
+
+
+def remove_source_hybrid(session_id: str, source_id, session_dir=SESSION_DIR):
+    """Remove every chunk of one source document from a session; returns how many were removed"""
+    session_path = os.path.join(session_dir, session_id)
+    with _session_write_lock(session_path):
+        faiss_index, index_params, chunks, sources, bm25_index = _read_session_for_update(session_path)
+        removed = sources.count(source_id)
+        if not removed:
+            return 0
+        emptied = removed == len(chunks)
+        if emptied:
+            _delete_session_files(session_path)
+        else:
+            faiss_index, index_params, chunks, sources, bm25_index = _without_source(
+                faiss_index, index_params, chunks, sources, bm25_index, source_id
+            )
+            _save_session_files(session_path, faiss_index, index_params, chunks, sources, bm25_index)
+    if emptied:
+        _remove_empty_session_dir(session_path)
+    return removed
+
+
+def _vectors_for_rebuild(faiss_index, index_params, chunks):
+    """Vectors of a session's chunks, in order, to rebuild its FAISS index from.
+
+    Read back from the index where it stores them (see ann_index.reconstruct_vectors).
+    IVF-PQ, PCA and sq8 indices are re-encoded instead, under the caller's write
+    lock; the embedding cache usually still has them, else that takes encoding time.
+    """
+    vectors = None
+    if faiss_index is not None and index_params is not None:
+        vectors = reconstruct_vectors(faiss_index, index_params)
+    return vectors if vectors is not None else _encode_chunks(chunks)
+
+
+def _without_source(faiss_index, index_params, chunks, sources, bm25_index, source_id):
+    """Indices minus one source's chunks.
+
+    A FAISS index that cannot delete in place is rebuilt from the vectors it
+    holds; it comes back None when no chunks are left.
+    """
+    ids = [i for i, source in enumerate(sources) if source == source_id]
+    keep = [i for i, source in enumerate(sources) if source != source_id]
+    if not keep:
+        faiss_index = None   # nothing left to index; the caller builds from its new chunks
+    elif index_params is None or not remove_from_index(faiss_index, index_params, ids):
+        vectors = _vectors_for_rebuild(faiss_index, index_params, chunks)
+        faiss_index, index_params = build_faiss_index(vectors[keep])
+    if bm25_index.tf is not None:
+        bm25_index = bm25_index.remove_docs(ids)
+    else:
+        bm25_index = None
+    chunks = [chunks[i] for i in keep]
+    sources = [sources[i] for i in keep]
+    if bm25_index is None:
+        bm25_index = SparseBM25.build([chunk.split() for chunk in chunks])
+    return faiss_index, index_params, chunks, sources, bm25_index
+
+@timed("transcript")
 def Video_Transcript(video_url, Language):
     match = re.search(r"(?:v=|\/)([0-9A-Za-z_-]{11})", video_url)
     if match:
@@ -72,26 +253,27 @@ def Video_Transcript(video_url, Language):
 
 #Function to recursively load all .pdf files
 def load_pdfs_from_folder(root_folder):
-    documents = []
-    for foldername, subfolders, filenames in os.walk(root_folder):
-        for filename in filenames:
-            if filename.endswith('.pdf'):
-                filepath = os.path.join(foldername, filename)
-                try:
-                    doc = fitz.open(filepath)
-                    content = ""
-                    for page in doc:
-                        content += page.get_text()
-                    documents.append(Document(page_content=content, metadata={"source": filepath}))
-                except Exception as e:
-                    print(f"Failed to read {filepath}: {e}")
-    return documents
+    """Load every PDF under root_folder (or in a list of PDF paths) as one Document per page"""
+    report = extract_pdfs([(path, path) for path in find_pdf_files(root_folder)])
+    for failure in report.failures:
+        print(f"Failed to read {failure.source}: {failure.error}")
+    return pdf_page_documents(report.documents)
 
 
+def pdf_page_documents(pdfs):
+    """One Document per page of each ExtractedPDF, with source and page-number (from 1) metadata"""
+    return [Document(page_content=text, metadata={"source": pdf.source, "page": page_number})
+            for pdf in pdfs for page_number, text in pdf.numbered_pages()]
+
+
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 150
+
+@timed("chunking")
 def chunks_from_doc(response_data):
     text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000,
-        chunk_overlap=150
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP
     )
     
     # Handle different response formats
@@ -126,71 +308,267 @@ def chunks_from_doc(response_data):
     return [chunk.page_content for chunk in chunks]
 
 
-def retrieve_top_chunks_hybrid(query, top_k, session_id:str, session_dir=SESSION_DIR):
+# Sessions saved before bundles: read once, then rewritten as a bundle
+LEGACY_INDEX_FILES = ("faiss_index.idx", "index_params.json", "chunks.pkl", "bm25_index.npz",
+                      "chunk_sources.json", "bm25_index.pkl")
+SESSION_INDEX_FILES = (BUNDLE_FILE,) + LEGACY_INDEX_FILES + ARCHIVE_FILES
 
-    session_path = os.path.join(session_dir, session_id)
-    """Hybrid retrieval with RRF fusion and deduplication"""
-    # Load indices and data
+def _session_signature(session_path):
+    """Cheap stat-based fingerprint of a session's index files"""
+    signature = []
+    for name in SESSION_INDEX_FILES:
+        try:
+            stat = os.stat(os.path.join(session_path, name))
+        except FileNotFoundError:
+            signature.append(None)
+            continue
+        signature.append((stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
+def _has_session_index(session_path):
+    return (os.path.exists(os.path.join(session_path, BUNDLE_FILE))
+            or os.path.exists(os.path.join(session_path, "chunks.pkl"))
+            or archive_path(session_path) is not None)
+
+def list_indexed_sessions(session_dir=SESSION_DIR):
+    """Ids of the sessions with an index saved under session_dir"""
+    if not os.path.isdir(session_dir):
+        return []
+    return [name for name in os.listdir(session_dir) if _has_session_index(os.path.join(session_dir, name))]
+
+def _read_loose_session_files(session_path):
+    """(faiss_index, index_params, chunks, sources, bm25_index) of a session saved before bundles"""
     faiss_index = faiss.read_index(os.path.join(session_path, "faiss_index.idx"))
+    index_params = load_index_params(os.path.join(session_path, "index_params.json"))
+    apply_search_params(faiss_index, index_params)
     with open(os.path.join(session_path, "chunks.pkl"), "rb") as f:
         chunks = pickle.load(f)
-    with open(os.path.join(session_path, "bm25_index.pkl"), "rb") as f:
-        bm25_index = pickle.load(f)
+    bm25_path = os.path.join(session_path, "bm25_index.npz")
+    if os.path.exists(bm25_path):
+        bm25_index = SparseBM25.load(bm25_path)
+    else:
+        # Session indexed before the sparse BM25 format; rebuild it once from the chunks
+        bm25_index = SparseBM25.build([chunk.split() for chunk in chunks])
+    sources_path = os.path.join(session_path, "chunk_sources.json")
+    if os.path.exists(sources_path):
+        with open(sources_path, "r") as f:
+            sources = json.load(f)
+    else:
+        sources = [None] * len(chunks)
+    if index_params is None:
+        index_params = {"mode": "flat", "dim": int(faiss_index.d), "ntotal": int(faiss_index.ntotal)}
+    return faiss_index, index_params, chunks, sources, bm25_index
+
+def _open_session_bundle(session_path):
+    """The session's bundle, decompressing an archived session or converting one saved as loose files.
+
+    Can take seconds for a large archived or legacy session: from async code, call it through run_blocking.
+    """
+    path = os.path.join(session_path, BUNDLE_FILE)
+    if not os.path.exists(path) and archive_path(session_path) is not None:
+        session_lifecycle.rehydrate(session_path)
+    if not os.path.exists(path):
+        if not os.path.exists(os.path.join(session_path, "chunks.pkl")):
+            raise FileNotFoundError(f"No index for session at {session_path}")
+        with _session_write_lock(session_path):
+            if not os.path.exists(path):
+                _save_session_files(session_path, *_read_loose_session_files(session_path))
+    bundle = SessionBundle(path)
+    model = bundle.manifest.get("model")
+    if model is not None and model != cache_namespace():
+        print(f"Session {session_path} was indexed with {model}, queries use {cache_namespace()}")
+    return bundle
+
+def session_manifest(session_id: str, session_dir=SESSION_DIR):
+    """A session's bundle manifest (sources, chunk count, creation time) without loading its indices.
+
+    An archived session's manifest is read from the head of its archive; it stays archived.
+    """
+    session_path = os.path.join(session_dir, session_id)
+    if not os.path.exists(os.path.join(session_path, BUNDLE_FILE)):
+        archive = archive_path(session_path)
+        if archive is not None:
+            try:
+                return archived_manifest(archive)
+            except FileNotFoundError:
+                pass   # rehydrated meanwhile
+    return _open_session_bundle(session_path).manifest
+
+def _read_session_indices(session_path):
+    bundle = _open_session_bundle(session_path)
+    return SessionIndices(bundle.faiss_index(), bundle.chunks(), bundle.bm25())
+
+def _read_session_for_update(session_path):
+    """(faiss_index, index_params, chunks, sources, bm25_index) that may be modified and saved back.
+
+    The FAISS index is a private copy: the mapped one is being searched by other requests.
+    """
+    bundle = _open_session_bundle(session_path)
+    return (bundle.faiss_index(copy=True), dict(bundle.index_params()), list(bundle.chunks()),
+            bundle.sources(), bundle.bm25())
+
+def load_session_indices(session_id: str, session_dir=SESSION_DIR, touch=True):
+    """Return (faiss_index, chunks, bm25_index) for a session, served from the process-wide cache
+
+    touch=False loads without recording an access (used by serve.py's preload),
+    so warming a session does not keep it from being archived.
+    """
+    session_path = os.path.join(session_dir, session_id)
+    if touch:
+        session_lifecycle.touch(session_path)
+    return session_index_cache.get_or_load(
+        session_path,
+        lambda: _read_session_indices(session_path),
+        signature=_session_signature(session_path),
+        sizeof=lambda indices: estimate_nbytes(*indices),
+    )
+
+_content_hashes = {}   # session_path -> (index signature, sha256 of the chunks)
+
+def session_content_hash(session_id: str, session_dir=SESSION_DIR):
+    """Hash of a session's chunk texts: sessions built from the same material share it"""
+    session_path = os.path.join(session_dir, session_id)
+    signature = _session_signature(session_path)
+    cached = _content_hashes.get(session_path)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    # The chunk offsets + UTF-8 blob pin down the texts; hash them as stored, without decoding
+    _, chunks, _ = load_session_indices(session_id, session_dir)
+    digest = hashlib.sha256()
+    digest.update(chunks.offsets.data)
+    digest.update(chunks.blob.data)
+    content_hash = digest.hexdigest()
+    _content_hashes[session_path] = (signature, content_hash)
+    return content_hash
+
+RRF_K = 60            # RRF constant
+MISSING_RANK = 1000   # rank assumed for a chunk a retriever did not return
+RETRIEVER_WEIGHTS = {"faiss": 1.0, "bm25": 1.0}
+
+def top_k_indices(scores, k):
+    """Indices of the k highest scores, best first, using a partial sort"""
+    scores = np.asarray(scores)
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < len(scores):
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+def rrf_fuse(ranked_ids, weights, k=RRF_K, top_k=None, missing_rank=MISSING_RANK):
+    """Weighted reciprocal-rank fusion of several ranked id arrays.
+
+    Returns (ids, scores) of the fused ranking, best first.
+    """
+    # FAISS pads short result lists with -1
+    ranked_ids = [np.asarray(ids, dtype=np.int64) for ids in ranked_ids]
+    ranked_ids = [ids[ids >= 0] for ids in ranked_ids]
+    if not ranked_ids or not any(len(ids) for ids in ranked_ids):
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+    candidates = np.unique(np.concatenate(ranked_ids))
+    fused = np.zeros(len(candidates), dtype=np.float64)
+    for ids, weight in zip(ranked_ids, weights):
+        ranks = np.full(len(candidates), missing_rank, dtype=np.float64)
+        ranks[np.searchsorted(candidates, ids)] = np.arange(len(ids))
+        fused += weight / (ranks + k)
+
+    order = top_k_indices(fused, top_k if top_k is not None else len(candidates))
+    return candidates[order], fused[order]
+
+def encode_query(query):
+    """Query embedding as a read-only (1, dim) float32 array, memoized per normalized query"""
+    key = (cache_namespace(), normalize_query(query))
+    query_embed = query_embedding_memo.get(key)
+    if query_embed is None:
+        # Concurrent queries are coalesced into one forward pass by the batcher
+        encoder = get_batcher() if ENCODE_BATCHING else get_model()
+        with span("encode_query"):
+            query_embed = np.asarray(encoder.encode([key[1]]), dtype=np.float32)
+        query_embed.flags.writeable = False
+        query_embedding_memo.put(key, query_embed)
+    return query_embed
+
+@timed("retrieval")
+def hybrid_search(query, top_k, session_id: str, session_dir=SESSION_DIR, weights=None, rrf_k=RRF_K,
+                  query_embed=None):
+    """Run FAISS + BM25 for a query and fuse them; returns (chunk_ids, scores, chunks)"""
+    weights = {**RETRIEVER_WEIGHTS, **(weights or {})}
+    # Load indices and data (warm sessions come straight from memory)
+    faiss_index, chunks, bm25_index = load_session_indices(session_id, session_dir)
+
+    # Same query against the same index files: reuse the fused ranking
+    session_path = os.path.join(session_dir, session_id)
+    query = normalize_query(query)
+    memo_key = (session_path, _session_signature(session_path), query, top_k,
+                tuple(sorted(weights.items())), rrf_k)
+    memoized = retrieval_memo.get(memo_key)
+    if memoized is not None:
+        return memoized[0], memoized[1], chunks
 
     # Semantic search (FAISS)
-    model = get_model()
-    query_embed = model.encode([query])
-    _, faiss_ids = faiss_index.search(query_embed, top_k * 2)
-    faiss_ids = faiss_ids[0].tolist()  # Convert to list
+    if query_embed is None:
+        query_embed = encode_query(query)
+    with span("faiss_search"):
+        _, faiss_ids = faiss_index.search(query_embed, top_k * 2)
 
     # Keyword search (BM25)
     tokenized_query = query.split()
-    bm25_scores = bm25_index.get_scores(tokenized_query)
-    bm25_ids = np.argsort(bm25_scores)[-top_k * 2:][::-1].tolist()
-
-    # RRF Fusion with deduplication
-    registry = {}
-    k = 60  # RRF constant
-
-    # Register FAISS results
-    for rank, chunk_id in enumerate(faiss_ids):
-        registry.setdefault(chunk_id, {"faiss_rank": rank})
-
-    # Register BM25 results
-    for rank, chunk_id in enumerate(bm25_ids):
-        if chunk_id in registry:
-            registry[chunk_id]["bm25_rank"] = rank
-        else:
-            registry[chunk_id] = {"bm25_rank": rank}
-
-        # Calculate RRF scores - MISSING CODE
-    for chunk_id in registry:
-        faiss_rrf = 1 / (registry[chunk_id].get("faiss_rank", 1000) + k)
-        bm25_rrf = 1 / (registry[chunk_id].get("bm25_rank", 1000) + k)
-        registry[chunk_id]["final_score"] = faiss_rrf + bm25_rrf
-
-    # Get top-k unique chunks
-    sorted_ids = sorted(registry.keys(),
-                        key=lambda x: registry[x]["final_score"],
-                        reverse=True)[:top_k]
-
-    return [chunks[i] for i in sorted_ids]
+    with span("bm25_search"):
+        bm25_ids, _ = bm25_index.top_k(tokenized_query, top_k * 2)
+
+    with span("fusion"):
+        ids, scores = rrf_fuse(
+            [faiss_ids[0], bm25_ids],
+            [weights["faiss"], weights["bm25"]],
+            k=rrf_k,
+            top_k=top_k,
+        )
+    ids.flags.writeable = False
+    scores.flags.writeable = False
+    retrieval_memo.put(memo_key, (ids, scores))
+    return ids, scores, chunks
+
+def retrieve_top_chunks_hybrid(query, top_k, session_id:str, session_dir=SESSION_DIR,
+                               weights=None, rrf_k=RRF_K, return_scores=False):
+    """Hybrid retrieval with RRF fusion and deduplication"""
+    ids, scores, chunks = hybrid_search(query, top_k, session_id, session_dir, weights, rrf_k)
+    if return_scores:
+        return [(chunks[i], float(score)) for i, score in zip(ids, scores)]
+    return [chunks[i] for i in ids]
 
 
 
 def reset_session(session_dir=SESSION_DIR):
-    pass
+    """Remove every session under session_dir: bundles, archives and legacy files, and their cached copies"""
+    for session_id in list_indexed_sessions(session_dir):
+        delete_embeddings(session_id, session_dir)
 
 def delete_embeddings(session_id, session_dir=SESSION_DIR):
     session_path = os.path.join(session_dir, session_id)
-    # Delete prior index files if they exist
-    index_path = os.path.join(session_path, "faiss_index.idx")
-    chunks_path = os.path.join(session_path, "chunks.pkl")
+    with _session_write_lock(session_path):
+        _delete_session_files(session_path)
+    _remove_empty_session_dir(session_path)
 
-    for file_path in [index_path, chunks_path]:
+def _delete_session_files(session_path):
+    # Delete prior index files if they exist
+    for file_path in [os.path.join(session_path, name) for name in SESSION_INDEX_FILES]:
         if os.path.exists(file_path):
             os.remove(file_path)
             print(f"Deleted existing file: {file_path}")
+    session_lifecycle.forget(session_path)
+    session_index_cache.invalidate(session_path)
+    retrieval_memo.invalidate(session_path)
+
+def _remove_empty_session_dir(session_path):
+    """Remove the directory unless something else (e.g. an upload in progress) is still in it.
+
+    Call with the write lock released: its lock file is in the directory.
+    """
+    if os.path.isdir(session_path) and set(os.listdir(session_path)) <= {LOCK_FILE}:
+        shutil.rmtree(session_path, ignore_errors=True)
 
 def delete_mcqs(session_dir="MCQs"):
 
@@ -204,36 +582,22 @@ def delete_mcqs(session_dir="MCQs"):
 
 #------------------------------------------------------------------------------------------------------------------------------
 def process_pdf_files_updated(uploaded_files: list) -> list:
-    documents = []
-    
+    sources = []
     for file in uploaded_files:
         # Skip non-PDF files
         if not file.filename.lower().endswith('.pdf'):
             continue
         try:
-            # Read file content into memory
-            file_content = file.read()
-            
-            # Create in-memory PDF stream
-            with BytesIO(file_content) as pdf_stream:
-                # Open PDF from memory
-                with fitz.open(stream=pdf_stream, filetype="pdf") as doc:
-                    content = ""
-                    # Extract text from each page (same as original)
-                    for page in doc:
-                        content += page.get_text()
-                    
-                    # Create document with ORIGINAL metadata format
-                    documents.append(
-                        Document(
-                            page_content=content,
-                            metadata={"source": file.filename}
-                        )
-                    )
+            # PyMuPDF reads the uploaded bytes directly, no BytesIO copy
+            sources.append((file.filename, file.read()))
         except Exception as e:
             print(f"Failed to process {file.filename}: {e}")
 
-    return documents
+    report = extract_pdfs(sources)
+    for failure in report.failures:
+        print(f"Failed to process {failure.source}: {failure.error}")
+
+    return pdf_page_documents(report.documents)
 
 def process_pdf_content(uploaded_files: list, session_id: str) -> str:
     documents = process_pdf_files_updated(uploaded_files)
@@ -243,5 +607,6 @@ def process_pdf_content(uploaded_files: list, session_id: str) -> str:
     else:
         # chunks = chunks_from_doc(documents)
         # embed = embed_index_chunks_hybrid(chunks, session_id)
-        return f"{len(documents)} PDF files processed successfully."
+        files = {document.metadata["source"] for document in documents}
+        return f"{len(files)} PDF files processed successfully."
 
@@ -0,0 +1,214 @@
+import os
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from session_store import session_store
+
+INGESTION_WORKERS = int(os.getenv("INGESTION_WORKERS", "2"))
+# Finished jobs kept around for status polling
+MAX_FINISHED_JOBS = int(os.getenv("INGESTION_MAX_FINISHED_JOBS", "500"))
+# Seconds between status writes to the shared store (and checks for cancels from other workers)
+JOB_SYNC_INTERVAL = float(os.getenv("INGESTION_JOB_SYNC_INTERVAL", "0.5"))
+# Job status and cancel records in the shared store expire this long after their last write,
+# whichever worker ran them (or if it died); the store's purge sweeps them out
+JOB_RECORD_TTL_SECONDS = int(os.getenv("INGESTION_JOB_TTL_SECONDS", str(24 * 3600)))
+
+logger = logging.getLogger(__name__)
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class IngestionJob:
+    """State of one background ingestion, updated by the worker and read by /jobs/{id}"""
+
+    def __init__(self, kind, session_id, store=None):
+        self.id = f"job_{uuid.uuid4()}"
+        self.kind = kind
+        self.session_id = session_id
+        self.status = "queued"      # queued | running | done | failed | cancelled
+        self.stage = "queued"       # queued | extracting | chunking | embedding | indexing | done
+        self.chunks_total = 0
+        self.chunks_processed = 0
+        self.error = None
+        self.result = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._stage_started_at = self.created_at
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+        self._store = store
+        self._synced_at = 0.0
+
+    def set_stage(self, stage):
+        self.check_cancelled()
+        with self._lock:
+            self.stage = stage
+            self._stage_started_at = time.time()
+        self.sync(force=True)
+
+    def progress(self, stage, done, total):
+        """Progress callback handed to the pipeline; raises JobCancelled when cancellation was requested"""
+        self.check_cancelled()
+        with self._lock:
+            if stage != self.stage:
+                self.stage = stage
+                self._stage_started_at = time.time()
+            self.chunks_processed = done
+            self.chunks_total = total
+        self.sync()
+
+    def sync(self, force=False):
+        """Publish status to the shared store and pick up a cancel requested through another worker"""
+        if self._store is None:
+            return
+        now = time.time()
+        if not force and now - self._synced_at < JOB_SYNC_INTERVAL:
+            return
+        self._synced_at = now
+        self._store.put("jobs", self.id, self.to_dict(), ttl=JOB_RECORD_TTL_SECONDS)
+        if self._store.contains("job_cancels", self.id):
+            self._cancel.set()
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def cancel_requested(self):
+        return self._cancel.is_set()
+
+    def check_cancelled(self):
+        if self._cancel.is_set():
+            raise JobCancelled(f"Job {self.id} was cancelled")
+
+    def eta_seconds(self):
+        """Remaining embedding time extrapolated from the throughput so far"""
+        with self._lock:
+            if self.stage != "embedding" or not self.chunks_processed or not self.chunks_total:
+                return None
+            elapsed = time.time() - self._stage_started_at
+            rate = self.chunks_processed / elapsed if elapsed > 0 else 0
+            if not rate:
+                return None
+            return round((self.chunks_total - self.chunks_processed) / rate, 1)
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "session_id": self.session_id,
+            "status": self.status,
+            "stage": self.stage,
+            "chunks_processed": self.chunks_processed,
+            "chunks_total": self.chunks_total,
+            "eta_seconds": self.eta_seconds(),
+            "error": self.error,
+            "result": self.result,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobManager:
+    """Runs ingestion functions on a worker pool and keeps their status for polling"""
+
+    def __init__(self, max_workers=INGESTION_WORKERS, max_finished=MAX_FINISHED_JOBS, store=None):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest")
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self.max_finished = max_finished
+        # Shared by all worker processes: any of them can report on or cancel any job
+        self.store = store
+
+    def submit(self, kind, session_id, fn, on_finish=None):
+        """Queue fn(job) and return the job immediately.
+
+        `fn` should call job.set_stage / job.progress as it goes; its return
+        value becomes job.result. `on_finish(job)` runs after the job ends,
+        whatever the outcome (e.g. to clean up temp files).
+        """
+        job = IngestionJob(kind, session_id, store=self.store)
+        job.sync(force=True)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        self._executor.submit(self._run, job, fn, on_finish)
+        return job
+
+    def _run(self, job, fn, on_finish):
+        job.started_at = time.time()
+        try:
+            job.check_cancelled()
+            job.status = "running"
+            job.result = fn(job)
+            job.stage = "done"
+            job.status = "done"
+        except JobCancelled:
+            job.status = "cancelled"
+            logger.info(f"Ingestion job {job.id} cancelled during {job.stage}")
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+            logger.error(f"Ingestion job {job.id} failed during {job.stage}: {e}")
+        finally:
+            job.finished_at = time.time()
+            job.sync(force=True)
+            if on_finish is not None:
+                try:
+                    on_finish(job)
+                except Exception as e:
+                    logger.error(f"Cleanup for job {job.id} failed: {e}")
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def status(self, job_id):
+        """Status dict of a job run by this process or, through the store, by another worker"""
+        job = self.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        return self.store.get("jobs", job_id) if self.store is not None else None
+
+    def cancel(self, job_id):
+        """Request cancellation; returns the job's status dict, or None if unknown"""
+        job = self.get(job_id)
+        if job is not None:
+            if job.status in ("queued", "running"):
+                job.cancel()
+            return {**job.to_dict(), "cancel_requested": job.cancel_requested}
+        status = self.status(job_id)
+        if status is None:
+            return None
+        # Running in another worker: it sees the flag on its next sync
+        cancel_requested = status["status"] in ("queued", "running")
+        if cancel_requested:
+            self.store.put("job_cancels", job_id, True, ttl=JOB_RECORD_TTL_SECONDS)
+        return {**status, "cancel_requested": cancel_requested}
+
+    def active_jobs(self):
+        with self._lock:
+            return [job for job in self._jobs.values() if job.status in ("queued", "running")]
+
+    def _prune(self):
+        # Only this process's jobs; records of other workers' jobs expire (JOB_RECORD_TTL_SECONDS)
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished_at is not None]
+        for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job_id]
+            if self.store is not None:
+                self.store.delete("jobs", job_id)
+                self.store.delete("job_cancels", job_id)
+
+    def shutdown(self):
+        for job in self.active_jobs():
+            job.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+job_manager = JobManager(store=session_store)
@@ -0,0 +1,281 @@
+import os
+import json
+import time
+import threading
+import requests
+import httpx
+from requests.adapters import HTTPAdapter
+from llm_scheduler import llm_scheduler
+from metrics import stage_metrics
+
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+
+# One place to name the model behind each feature
+LLM_MODELS = {
+    "chat": os.getenv("OLLAMA_CHAT_MODEL", "llama3-14b-custom"),
+    "mcq": os.getenv("OLLAMA_MCQ_MODEL", "llama3-14b-custom"),
+    "topics": os.getenv("OLLAMA_TOPICS_MODEL", "llama3-14b-custom"),
+}
+
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "300"))
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "16"))
+
+
+class LLMError(Exception):
+    pass
+
+
+class OllamaClient:
+    """Keep-alive connection pools to Ollama's /api/generate, with sync and async interfaces.
+
+    A requests.Session serves the sync calls and an httpx.AsyncClient the async
+    ones; both reuse pooled connections instead of opening one per request.
+    Every call first takes a slot from `scheduler` under its `priority`
+    ("chat", "quiz" or "background") and `session_id`.
+    """
+
+    def __init__(self, base_url=OLLAMA_BASE_URL, pool_size=LLM_POOL_SIZE,
+                 connect_timeout=LLM_CONNECT_TIMEOUT, read_timeout=LLM_READ_TIMEOUT,
+                 scheduler=llm_scheduler):
+        self.generate_url = f"{base_url.rstrip('/')}/api/generate"
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self._adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self._session = requests.Session()
+        self._session.mount("http://", self._adapter)
+        self._session.mount("https://", self._adapter)
+        self._pool_size = pool_size
+        self.scheduler = scheduler
+        self._async_client = None
+        self._lock = threading.Lock()
+        self.requests_total = 0
+        self.errors_total = 0
+        self.in_flight = 0
+        self.latency_seconds_total = 0.0
+
+    # -- helpers -------------------------------------------------------------
+
+    def _payload(self, prompt, model, stream, options, **extra):
+        payload = {
+            "model": model or LLM_MODELS["chat"],
+            "prompt": prompt,
+            "stream": stream,
+            "options": options or {},
+        }
+        payload.update(extra)
+        return payload
+
+    def _timeout(self, timeout):
+        return (self.connect_timeout, timeout or self.read_timeout)
+
+    def _async_timeout(self, timeout):
+        return httpx.Timeout(timeout or self.read_timeout, connect=self.connect_timeout)
+
+    def _get_async_client(self):
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=self._pool_size,
+                                    max_keepalive_connections=self._pool_size),
+                timeout=self._async_timeout(None),
+            )
+        return self._async_client
+
+    def _start(self):
+        with self._lock:
+            self.requests_total += 1
+            self.in_flight += 1
+        return time.perf_counter()
+
+    def _finish(self, start, failed=False):
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.in_flight -= 1
+            self.latency_seconds_total += elapsed
+            if failed:
+                self.errors_total += 1
+        if not failed:
+            stage_metrics.observe("llm_generation", elapsed)
+
+    @staticmethod
+    def _observe_first_token(body):
+        """Time to first token of a non-streamed generation, from Ollama's own timings (nanoseconds)"""
+        if "prompt_eval_duration" in body:
+            stage_metrics.observe("llm_first_token",
+                                  (body.get("load_duration", 0) + body["prompt_eval_duration"]) / 1e9)
+
+    @staticmethod
+    def _check(status_code, text):
+        if status_code != 200:
+            raise LLMError(f"Ollama returned {status_code}: {text}")
+
+    @staticmethod
+    def _parse_line(line):
+        """One NDJSON object of a streaming response (None for blank or partial lines)"""
+        if not line:
+            return None
+        try:
+            return json.loads(line)
+        except json.JSONDecodeError:
+            return None
+
+    # -- sync ----------------------------------------------------------------
+
+    def generate(self, prompt, model=None, options=None, timeout=None,
+                 priority="chat", session_id=None, **extra):
+        """Full completion text for `prompt`"""
+        return self.generate_full(prompt, model, options, timeout, priority, session_id, **extra)["response"]
+
+    def generate_full(self, prompt, model=None, options=None, timeout=None,
+                      priority="chat", session_id=None, **extra):
+        """The whole /api/generate JSON body (response text, context, timings)"""
+        with self.scheduler.slot(priority, session_id):
+            return self._post(prompt, model, options, timeout, **extra)
+
+    def _post(self, prompt, model, options, timeout, **extra):
+        start = self._start()
+        failed = True
+        try:
+            response = self._session.post(
+                self.generate_url,
+                json=self._payload(prompt, model, False, options, **extra),
+                timeout=self._timeout(timeout),
+            )
+            self._check(response.status_code, response.text)
+            body = response.json()
+            self._observe_first_token(body)
+            failed = False
+            return body
+        finally:
+            self._finish(start, failed)
+
+    def generate_stream(self, prompt, model=None, options=None, timeout=None,
+                        priority="chat", session_id=None, on_done=None, **extra):
+        """Yield tokens as Ollama produces them; closing the generator closes the connection.
+
+        `on_done(chunk)` receives the final NDJSON object (context, timings)
+        if the stream runs to completion.
+        """
+        with self.scheduler.slot(priority, session_id):
+            start = self._start()
+            failed = True
+            try:
+                with self._session.post(
+                    self.generate_url,
+                    json=self._payload(prompt, model, True, options, **extra),
+                    timeout=self._timeout(timeout),
+                    stream=True,
+                ) as response:
+                    if response.status_code != 200:
+                        self._check(response.status_code, response.text)
+                    first_token = True
+                    for line in response.iter_lines():
+                        chunk = self._parse_line(line)
+                        if chunk is None:
+                            continue
+                        if chunk.get("response"):
+                            if first_token:
+                                first_token = False
+                                stage_metrics.observe("llm_first_token", time.perf_counter() - start)
+                            yield chunk["response"]
+                        if chunk.get("done"):
+                            if on_done is not None:
+                                on_done(chunk)
+                            break
+                failed = False
+            finally:
+                self._finish(start, failed)
+
+    # -- async ---------------------------------------------------------------
+
+    async def agenerate(self, prompt, model=None, options=None, timeout=None,
+                        priority="chat", session_id=None, **extra):
+        return (await self.agenerate_full(prompt, model, options, timeout, priority, session_id, **extra))["response"]
+
+    async def agenerate_full(self, prompt, model=None, options=None, timeout=None,
+                             priority="chat", session_id=None, **extra):
+        async with self.scheduler.aslot(priority, session_id):
+            return await self._apost(prompt, model, options, timeout, **extra)
+
+    async def _apost(self, prompt, model, options, timeout, **extra):
+        start = self._start()
+        failed = True
+        try:
+            response = await self._get_async_client().post(
+                self.generate_url,
+                json=self._payload(prompt, model, False, options, **extra),
+                timeout=self._async_timeout(timeout),
+            )
+            self._check(response.status_code, response.text)
+            body = response.json()
+            self._observe_first_token(body)
+            failed = False
+            return body
+        finally:
+            self._finish(start, failed)
+
+    async def agenerate_stream(self, prompt, model=None, options=None, timeout=None,
+                               priority="chat", session_id=None, on_done=None, **extra):
+        """Async token stream; closing it (e.g. on client disconnect) aborts the upstream request"""
+        async with self.scheduler.aslot(priority, session_id):
+            start = self._start()
+            failed = True
+            try:
+                async with self._get_async_client().stream(
+                    "POST",
+                    self.generate_url,
+                    json=self._payload(prompt, model, True, options, **extra),
+                    timeout=self._async_timeout(timeout),
+                ) as response:
+                    if response.status_code != 200:
+                        await response.aread()
+                        self._check(response.status_code, response.text)
+                    first_token = True
+                    async for line in response.aiter_lines():
+                        chunk = self._parse_line(line)
+                        if chunk is None:
+                            continue
+                        if chunk.get("response"):
+                            if first_token:
+                                first_token = False
+                                stage_metrics.observe("llm_first_token", time.perf_counter() - start)
+                            yield chunk["response"]
+                        if chunk.get("done"):
+                            if on_done is not None:
+                                on_done(chunk)
+                            break
+                failed = False
+            finally:
+                self._finish(start, failed)
+
+    # -- metrics -------------------------------------------------------------
+
+    def stats(self):
+        # urllib3 counts every new TCP connection it opens per host pool
+        pool_map = self._adapter.poolmanager.pools
+        pools = [pool for pool in (pool_map.get(key) for key in pool_map.keys()) if pool is not None]
+        sync_connections = sum(getattr(pool, "num_connections", 0) for pool in pools)
+        sync_requests = sum(getattr(pool, "num_requests", 0) for pool in pools)
+        async_pool = getattr(getattr(self._async_client, "_transport", None), "_pool", None)
+        with self._lock:
+            return {
+                "requests_total": self.requests_total,
+                "errors_total": self.errors_total,
+                "in_flight": self.in_flight,
+                "latency_seconds_total": round(self.latency_seconds_total, 3),
+                "sync_connections_opened": sync_connections,
+                "sync_requests_sent": sync_requests,
+                "async_open_connections": len(getattr(async_pool, "connections", [])),
+                "models": dict(LLM_MODELS),
+            }
+
+    def close(self):
+        self._session.close()
+
+    async def aclose(self):
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+
+
+ollama_client = OllamaClient()
@@ -0,0 +1,352 @@
+import os
+import math
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager, asynccontextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: the limit below holds per process only
+    fcntl = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Generations allowed to run against the model at once, across every worker process on the host
+LLM_MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", "2"))
+# One lock file per slot; a worker holds a slot while it holds that file's flock
+LLM_SLOT_DIR = os.getenv("LLM_SLOT_DIR") or os.path.join(BASE_DIR, "user_session", ".llm_slots")
+# Longest a request may wait for a slot before it is turned away with 429
+LLM_QUEUE_DEADLINE = float(os.getenv("LLM_QUEUE_DEADLINE", "30"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "64"))
+# Starting guess for one generation's duration, refined from completed calls
+LLM_SERVICE_TIME_ESTIMATE = float(os.getenv("LLM_SERVICE_TIME_ESTIMATE", "8"))
+
+# Lower value is served first
+PRIORITIES = {"chat": 0, "quiz": 1, "background": 2}
+
+# How often queued requests re-try for a host slot while other workers hold them all
+HOST_SLOT_POLL_SECONDS = 0.05
+
+# Upper bounds (seconds) of the queue-wait histogram buckets
+WAIT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+logger = logging.getLogger(__name__)
+
+
+class LLMOverloaded(Exception):
+    """The LLM queue cannot serve this request within the deadline; maps to HTTP 429"""
+
+    def __init__(self, priority, retry_after):
+        super().__init__(f"LLM is busy with {priority} requests; retry in {retry_after}s")
+        self.priority = priority
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    """One queued request; woken through an Event (threads) or a Future (event loop)"""
+
+    def __init__(self, priority, session_id, loop=None):
+        self.priority = priority
+        self.session_id = session_id
+        self.granted = False
+        self.loop = loop
+        self.event = threading.Event() if loop is None else None
+        self.future = loop.create_future() if loop is not None else None
+
+    def grant(self):
+        self.granted = True
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class _WaitStats:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * len(WAIT_BUCKETS)
+
+    def observe(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        for i, bound in enumerate(WAIT_BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": round(self.total, 3),
+            "max": round(self.max, 3),
+            # Cumulative counts, Prometheus-histogram style
+            "buckets": {str(bound): n for bound, n in zip(WAIT_BUCKETS, self.buckets)},
+        }
+
+
+class _HostSlots:
+    """`count` slot files shared by the worker processes of a host; holding a file's flock holds its slot"""
+
+    def __init__(self, count, directory):
+        self.count = count
+        self.directory = directory
+        self._fds = None
+        self._pid = None
+        self._held = []
+
+    def _slot_fds(self):
+        if self._pid != os.getpid():
+            # A forked child shares its parent's descriptors, and so its locks: open its own
+            for fd in self._fds or ():
+                os.close(fd)
+            os.makedirs(self.directory, exist_ok=True)
+            self._fds = [os.open(os.path.join(self.directory, f"slot-{i}.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+                         for i in range(self.count)]
+            self._pid, self._held = os.getpid(), []
+        return self._fds
+
+    def try_acquire(self):
+        for i, fd in enumerate(self._slot_fds()):
+            if i in self._held:
+                continue
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue
+            self._held.append(i)
+            return True
+        return False
+
+    def release(self):
+        if self._held and self._pid == os.getpid():
+            fcntl.flock(self._fds[self._held.pop()], fcntl.LOCK_UN)
+
+
+class LLMScheduler:
+    """Admission control in front of the model: bounded concurrency, priority
+    classes and round-robin between sessions within a class.
+
+    A request that cannot start right away is queued under its priority and
+    session. Freed slots go to the highest non-empty priority class, rotating
+    over its sessions so one user's burst cannot starve the others. If the
+    estimated wait (queue ahead / slots x mean generation time) is beyond
+    `queue_deadline`, or the request is still queued when the deadline
+    passes, LLMOverloaded is raised with a Retry-After hint.
+
+    With a `slot_dir` (and fcntl), max_in_flight is one limit for all the
+    processes sharing that directory, i.e. every serve.py worker: a request
+    also needs one of the host's slot files, and queued requests re-try for
+    one every HOST_SLOT_POLL_SECONDS while other workers hold them all.
+    Queues, priorities and wait estimates remain per process.
+    """
+
+    def __init__(self, max_in_flight=LLM_MAX_IN_FLIGHT, queue_deadline=LLM_QUEUE_DEADLINE,
+                 max_queue=LLM_MAX_QUEUE, service_time=LLM_SERVICE_TIME_ESTIMATE, slot_dir=LLM_SLOT_DIR):
+        self.max_in_flight = max_in_flight
+        self._host_slots = _HostSlots(max_in_flight, slot_dir) if slot_dir and fcntl is not None else None
+        self._poll_timer = None
+        self.queue_deadline = queue_deadline
+        self.max_queue = max_queue
+        self.service_time = service_time
+        self.in_flight = 0
+        self._queues = {priority: OrderedDict() for priority in PRIORITIES}  # session -> deque of waiters
+        self._lock = threading.Lock()
+        self._wait_stats = {priority: _WaitStats() for priority in PRIORITIES}
+        self.rejected = {priority: 0 for priority in PRIORITIES}
+        self.timed_out = {priority: 0 for priority in PRIORITIES}
+
+    # -- queue bookkeeping (call with the lock held) ---------------------------
+
+    def _queued(self, max_rank=None):
+        return sum(
+            len(waiters)
+            for priority, sessions in self._queues.items()
+            if max_rank is None or PRIORITIES[priority] <= max_rank
+            for waiters in sessions.values()
+        )
+
+    def _estimated_wait(self, priority):
+        ahead = self._queued(PRIORITIES[priority])
+        if self.in_flight < self.max_in_flight and not ahead:
+            return 0.0
+        return math.ceil((ahead + 1) / self.max_in_flight) * self.service_time
+
+    def _retry_after(self, wait):
+        return max(1, math.ceil(wait - self.queue_deadline))
+
+    def _next_waiter(self):
+        for priority in sorted(PRIORITIES, key=PRIORITIES.get):
+            sessions = self._queues[priority]
+            if not sessions:
+                continue
+            session_id, waiters = next(iter(sessions.items()))
+            waiter = waiters.popleft()
+            if waiters:
+                sessions.move_to_end(session_id)
+            else:
+                del sessions[session_id]
+            return waiter
+        return None
+
+    def _take_host_slot(self):
+        return self._host_slots is None or self._host_slots.try_acquire()
+
+    def _poll_host_slots(self):
+        if self._poll_timer is None:
+            self._poll_timer = threading.Timer(HOST_SLOT_POLL_SECONDS, self._on_poll)
+            self._poll_timer.daemon = True
+            self._poll_timer.start()
+
+    def _on_poll(self):
+        with self._lock:
+            self._poll_timer = None
+            self._dispatch()
+
+    def _dispatch(self):
+        while self.in_flight < self.max_in_flight and any(self._queues.values()):
+            if not self._take_host_slot():
+                self._poll_host_slots()
+                break
+            waiter = self._next_waiter()
+            self.in_flight += 1
+            waiter.grant()
+
+    # -- acquire / release -------------------------------------------------------
+
+    def check(self, priority="chat"):
+        """Raise LLMOverloaded now if a request of this class would not start in time"""
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown LLM priority: {priority}")
+        with self._lock:
+            wait = self._estimated_wait(priority)
+            if wait > self.queue_deadline or (wait and self._queued() >= self.max_queue):
+                self.rejected[priority] += 1
+                raise LLMOverloaded(priority, self._retry_after(wait))
+
+    def _enqueue(self, priority, session_id, loop=None):
+        """Take a free slot (returns None) or queue a waiter for one"""
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown LLM priority: {priority}")
+        with self._lock:
+            wait = self._estimated_wait(priority)
+            if not wait:
+                if self._take_host_slot():
+                    self.in_flight += 1
+                    return None
+                # Free here, but other workers hold every host slot
+                self._poll_host_slots()
+            elif wait > self.queue_deadline or self._queued() >= self.max_queue:
+                self.rejected[priority] += 1
+                raise LLMOverloaded(priority, self._retry_after(wait))
+            waiter = _Waiter(priority, session_id, loop)
+            self._queues[priority].setdefault(session_id, deque()).append(waiter)
+            return waiter
+
+    def _abandon(self, waiter):
+        """Drop a waiter that stopped waiting; True if it had been granted a slot meanwhile"""
+        with self._lock:
+            if waiter.granted:
+                return True
+            sessions = self._queues[waiter.priority]
+            waiters = sessions.get(waiter.session_id)
+            if waiters is not None and waiter in waiters:
+                waiters.remove(waiter)
+                if not waiters:
+                    del sessions[waiter.session_id]
+            return False
+
+    def _timed_out(self, priority):
+        with self._lock:
+            self.timed_out[priority] += 1
+            retry_after = max(1, math.ceil(self._estimated_wait(priority)))
+        logger.warning(f"LLM request ({priority}) waited {self.queue_deadline}s without a slot")
+        return LLMOverloaded(priority, retry_after)
+
+    def _observe_wait(self, priority, seconds):
+        with self._lock:
+            self._wait_stats[priority].observe(seconds)
+
+    def acquire(self, priority="chat", session_id=None):
+        """Block until a slot is free; returns the start time to hand back to release()"""
+        enqueued_at = time.time()
+        waiter = self._enqueue(priority, session_id)
+        if waiter is not None and not waiter.event.wait(self.queue_deadline):
+            if not self._abandon(waiter):
+                raise self._timed_out(priority)
+        started = time.time()
+        self._observe_wait(priority, started - enqueued_at)
+        return started
+
+    async def aacquire(self, priority="chat", session_id=None):
+        enqueued_at = time.time()
+        waiter = self._enqueue(priority, session_id, asyncio.get_running_loop())
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter.future), self.queue_deadline)
+            except asyncio.TimeoutError:
+                if not self._abandon(waiter):
+                    raise self._timed_out(priority)
+            except asyncio.CancelledError:
+                if self._abandon(waiter):
+                    self.release(None)
+                raise
+        started = time.time()
+        self._observe_wait(priority, started - enqueued_at)
+        return started
+
+    def release(self, started):
+        with self._lock:
+            self.in_flight -= 1
+            if self._host_slots is not None:
+                self._host_slots.release()
+            if started is not None:
+                # Moving average of generation time drives the wait estimate
+                self.service_time = 0.8 * self.service_time + 0.2 * (time.time() - started)
+            self._dispatch()
+
+    @contextmanager
+    def slot(self, priority="chat", session_id=None):
+        started = self.acquire(priority, session_id)
+        try:
+            yield
+        finally:
+            self.release(started)
+
+    @asynccontextmanager
+    async def aslot(self, priority="chat", session_id=None):
+        started = await self.aacquire(priority, session_id)
+        try:
+            yield
+        finally:
+            self.release(started)
+
+    # -- metrics -------------------------------------------------------------
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": self.in_flight,
+                "max_in_flight": self.max_in_flight,
+                "host_wide_limit": self._host_slots is not None,
+                "queue_deadline_seconds": self.queue_deadline,
+                "service_time_estimate_seconds": round(self.service_time, 3),
+                "queue_depth": {
+                    priority: sum(len(waiters) for waiters in sessions.values())
+                    for priority, sessions in self._queues.items()
+                },
+                "queue_wait_seconds": {priority: s.to_dict() for priority, s in self._wait_stats.items()},
+                "rejected": dict(self.rejected),
+                "timed_out": dict(self.timed_out),
+            }
+
+
+llm_scheduler = LLMScheduler()
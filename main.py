@@ -7,7 +7,10 @@ from langchain.schema import Document
 from io import BytesIO
 import fitz  # PyMuPDF
 from pydantic import BaseModel
-from functions import Video_Transcript
+from functions import Video_Transcript, pdf_page_documents
+from pdf_extraction import extract_pdfs
+from executors import run_blocking
+from session_store import session_store
 # from functions import process_pdf_content
 import io
 
@@ -23,8 +26,22 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Session storage
-sessions = {}
+# Cookie sessions live in the shared session store ("client_sessions"), so
+# they survive restarts, expire after SESSION_STORE_TTL_SECONDS and are
+# visible to every worker
+SESSIONS = "client_sessions"
+# A request refreshes "last_accessed" (and the record's expiry) only when the
+# stored value is older than this, so most requests don't write to the store
+SESSION_TOUCH_INTERVAL_SECONDS = 60
+
+def _touch_client_session(session_id):
+    """Refresh a cookie session's last_accessed if it is stale (blocking: store I/O)"""
+    session = session_store.get(SESSIONS, session_id)
+    if session is not None:
+        now = datetime.now()
+        if (now - datetime.fromisoformat(session["last_accessed"])).total_seconds() >= SESSION_TOUCH_INTERVAL_SECONDS:
+            session["last_accessed"] = now.isoformat()
+            session_store.put(SESSIONS, session_id, session)
 
 @app.middleware("http")
 async def session_middleware(request: Request, call_next):
@@ -33,11 +50,12 @@ async def session_middleware(request: Request, call_next):
     # Create new session only for specific endpoints
     if request.url.path == "/get-session/" and not session_id:
         session_id = str(uuid.uuid4())
-        sessions[session_id] = {
-            "created_at": datetime.now(),
-            "last_accessed": datetime.now(),
+        now = datetime.now().isoformat()
+        await run_blocking(session_store.put, SESSIONS, session_id, {
+            "created_at": now,
+            "last_accessed": now,
             "upload_count": 0
-        }
+        })
         response = JSONResponse({
             "session_id": session_id,
             "status": "new_session_created"
@@ -52,15 +70,16 @@ async def session_middleware(request: Request, call_next):
         return response
     
     # For existing sessions
-    if session_id in sessions:
-        sessions[session_id]["last_accessed"] = datetime.now()
+    if session_id:
+        await run_blocking(_touch_client_session, session_id)
     
     return await call_next(request)
 
 @app.get("/get-session/")
 async def get_session(request: Request):
     session_id = request.cookies.get("session_id")
-    if not session_id or session_id not in sessions:
+    session = await run_blocking(session_store.get, SESSIONS, session_id) if session_id else None
+    if session is None:
         return JSONResponse(
             {"error": "Session not found"}, 
             status_code=404
@@ -68,9 +87,9 @@ async def get_session(request: Request):
     
     return {
         "session_id": session_id,
-        "created_at": sessions[session_id]["created_at"],
-        "last_accessed": sessions[session_id]["last_accessed"],
-        "upload_count": sessions[session_id]["upload_count"]
+        "created_at": session["created_at"],
+        "last_accessed": session["last_accessed"],
+        "upload_count": session["upload_count"]
     }
 
 @app.post("/process-pdfs/")
@@ -120,7 +139,7 @@ async def process_pdf_content(uploaded_files: list, session_id: str) -> str:
 
 async def process_pdf_files_updated(uploaded_files: list) -> list:
     
-    documents = []
+    sources = []
     
     for file in uploaded_files:
         # Skip non-PDF files
@@ -128,29 +147,18 @@ async def process_pdf_files_updated(uploaded_files: list) -> list:
             continue
             
         try:
-            # Read file content asynchronously
-            file_content = await file.read()
-            
-            # Create in-memory PDF stream
-            with BytesIO(file_content) as pdf_stream:
-                # Open PDF from memory
-                with fitz.open(stream=pdf_stream, filetype="pdf") as doc:
-                    content = ""
-                    # Extract text from each page
-                    for page in doc:
-                        content += page.get_text()
-                    
-                    # Create document with metadata
-                    documents.append(
-                        Document(
-                            page_content=content,
-                            metadata={"source": file.filename}
-                        )
-                    )
+            # Read file content asynchronously; PyMuPDF opens the bytes directly
+            sources.append((file.filename, await file.read()))
         except Exception as e:
             print(f"Failed to process {file.filename}: {e}")
     
-    return documents
+    # Parsing fans out to the process pool; the event loop only awaits it
+    report = await run_blocking(extract_pdfs, sources)
+    for failure in report.failures:
+        print(f"Failed to process {failure.source}: {failure.error}")
+    
+    # One document per page, with source and page-number metadata
+    return pdf_page_documents(report.documents)
 
 from pydantic import BaseModel
 
@@ -169,7 +177,7 @@ async def process_youtube(request: Request, data: YouTubeRequest):
                 status_code=401
             )
         
-        text = Video_Transcript(video_url=data.url,Language='English')
+        text = await run_blocking(Video_Transcript, video_url=data.url, Language='English')
         return text
         
     except Exception as e:
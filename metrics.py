@@ -0,0 +1,165 @@
+import os
+import re
+import time
+import bisect
+import functools
+import threading
+from contextlib import nullcontext
+
+# 0 turns every span into a no-op (decorated functions are left unwrapped)
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+METRICS_PREFIX = "learning_assistant"
+# Histogram bucket upper bounds in seconds: sub-ms index lookups up to multi-minute generations
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+_NOOP_SPAN = nullcontext()
+
+
+class _Histogram:
+    __slots__ = ("counts", "total", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)   # last slot: above every bound
+        self.total = 0.0
+        self.count = 0
+
+
+class _Span:
+    __slots__ = ("metrics", "stage", "started")
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.observe(self.stage, time.perf_counter() - self.started, failed=exc_type is not None)
+        return False
+
+
+class StageMetrics:
+    """Latency histograms and error counts per pipeline stage, rendered as Prometheus text.
+
+    Stages are timed with `with stage_metrics.span("faiss_search"):` or the
+    @timed("stage") decorator. Figures are per process: under serve.py each
+    worker exports its own, labelled with its pid.
+    """
+
+    def __init__(self, enabled=METRICS_ENABLED):
+        self.enabled = enabled
+        self._histograms = {}
+        self._errors = {}
+        self._lock = threading.Lock()
+
+    def span(self, stage):
+        return _Span(self, stage) if self.enabled else _NOOP_SPAN
+
+    def observe(self, stage, seconds, failed=False):
+        if not self.enabled:
+            return
+        slot = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = _Histogram()
+            histogram.counts[slot] += 1
+            histogram.total += seconds
+            histogram.count += 1
+            if failed:
+                self._errors[stage] = self._errors.get(stage, 0) + 1
+
+    def snapshot(self):
+        """{stage: (bucket counts, sum, count)} and {stage: errors}, copied under the lock"""
+        with self._lock:
+            histograms = {stage: (list(h.counts), h.total, h.count) for stage, h in self._histograms.items()}
+            return histograms, dict(self._errors)
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._errors.clear()
+
+
+stage_metrics = StageMetrics()
+
+
+def span(stage):
+    """Context manager timing one stage into stage_metrics"""
+    return stage_metrics.span(stage)
+
+
+def timed(stage):
+    """Decorator timing every call of the function as `stage`; returns it unchanged when metrics are off"""
+    def decorate(func):
+        if not stage_metrics.enabled:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with _Span(stage_metrics, stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def _metric_name(*parts):
+    return re.sub(r"[^a-zA-Z0-9_]", "_", "_".join(str(part) for part in parts if part != ""))
+
+
+def _flatten(prefix, value):
+    """Numeric leaves of a nested stats() dict as (name, number); strings, lists and None are skipped"""
+    if isinstance(value, bool):
+        yield prefix, int(value)
+    elif isinstance(value, (int, float)):
+        yield prefix, value
+    elif isinstance(value, dict):
+        for key, item in value.items():
+            yield from _flatten(_metric_name(prefix, key), item)
+
+
+def render_prometheus(stats=None, metrics=stage_metrics):
+    """Prometheus text exposition of the stage histograms plus the numeric fields of `stats`.
+
+    `stats` maps a source name to one of the existing stats() dicts (LLM
+    scheduler, caches, memos, ...); each numeric field becomes an untyped
+    sample named <prefix>_<source>_<field>. Fields whose names collide after
+    sanitizing (or with the stage metrics) keep only the first one.
+    """
+    worker = f'worker="{os.getpid()}"'
+    lines = []
+    histograms, errors = metrics.snapshot()
+
+    name = f"{METRICS_PREFIX}_stage_seconds"
+    lines.append(f"# HELP {name} Time spent in each pipeline stage")
+    lines.append(f"# TYPE {name} histogram")
+    for stage in sorted(histograms):
+        counts, total, count = histograms[stage]
+        labels = f'stage="{stage}",{worker}'
+        cumulative = 0
+        for bound, bucket_count in zip(LATENCY_BUCKETS, counts):
+            cumulative += bucket_count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {count}')
+        lines.append(f"{name}_sum{{{labels}}} {total:.6f}")
+        lines.append(f"{name}_count{{{labels}}} {count}")
+
+    name = f"{METRICS_PREFIX}_stage_errors_total"
+    lines.append(f"# HELP {name} Stage calls that raised")
+    lines.append(f"# TYPE {name} counter")
+    for stage in sorted(errors):
+        lines.append(f'{name}{{stage="{stage}",{worker}}} {errors[stage]}')
+
+    seen = {f"{METRICS_PREFIX}_stage_seconds{suffix}" for suffix in ("", "_bucket", "_sum", "_count")}
+    seen.add(name)
+    for source, source_stats in (stats or {}).items():
+        for sample, number in _flatten(_metric_name(METRICS_PREFIX, source), source_stats):
+            if sample in seen:
+                continue   # a second TYPE line for one name makes the whole exposition invalid
+            seen.add(sample)
+            lines.append(f"# TYPE {sample} untyped")
+            lines.append(f"{sample}{{{worker}}} {number}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,68 @@
+import os
+import threading
+
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", "all-MiniLM-L6-v2")
+# torch: sentence-transformers on PyTorch; onnx: int8 ONNX Runtime export (see onnx_encoder.py)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+EMBEDDING_ONNX_DIR = os.getenv("EMBEDDING_ONNX_DIR", "")
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+_encoders = {}
+_registry_lock = threading.Lock()
+_load_locks = {}
+
+
+def onnx_model_dir(name=EMBEDDING_MODEL_NAME):
+    return EMBEDDING_ONNX_DIR or os.path.join(BASE_DIR, "models", f"{name}-onnx")
+
+
+def cache_namespace(name=EMBEDDING_MODEL_NAME):
+    """Key prefix for cached vectors: int8 vectors are close to the torch ones, not identical"""
+    if EMBEDDING_BACKEND == "onnx":
+        from onnx_encoder import ONNX_MODEL_FILE
+        return f"{name}@onnx/{ONNX_MODEL_FILE}"
+    return name
+
+
+def _load_encoder(name):
+    if EMBEDDING_BACKEND == "onnx":
+        # No torch import at all on this path
+        from onnx_encoder import OnnxEncoder
+        return OnnxEncoder(onnx_model_dir(name))
+    # Imported here so processes that never embed don't pay the torch import
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(name)
+
+
+def get_encoder(name=EMBEDDING_MODEL_NAME):
+    """Return the shared encoder for `name`, loading it once on first use"""
+    encoder = _encoders.get(name)
+    if encoder is not None:
+        return encoder
+
+    with _registry_lock:
+        load_lock = _load_locks.setdefault(name, threading.Lock())
+
+    # Per-model lock: concurrent first callers wait for a single load
+    with load_lock:
+        encoder = _encoders.get(name)
+        if encoder is None:
+            encoder = _load_encoder(name)
+            _encoders[name] = encoder
+    return encoder
+
+
+def warm_up(names=(EMBEDDING_MODEL_NAME,)):
+    """Load the given encoders and run one tiny forward pass so the first real query isn't slow"""
+    for name in names:
+        get_encoder(name).encode(["warm up"], convert_to_numpy=True)
+
+
+def loaded_encoders():
+    return list(_encoders)
+
+
+def unload_encoder(name=EMBEDDING_MODEL_NAME):
+    with _registry_lock:
+        _encoders.pop(name, None)
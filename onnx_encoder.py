@@ -0,0 +1,162 @@
+import os
+import json
+import argparse
+import numpy as np
+
+ONNX_MODEL_FILE = os.getenv("EMBEDDING_ONNX_FILE", "model_int8.onnx")
+# 0 lets onnxruntime pick (one thread per physical core)
+ONNX_INTRA_OP_THREADS = int(os.getenv("EMBEDDING_ONNX_THREADS", "0"))
+# Lowest cosine similarity to the PyTorch embedding accepted for the same text
+ONNX_MIN_COSINE = 0.98
+
+SENTENCE_CONFIG = "sentence_config.json"
+
+
+class OnnxEncoder:
+    """SentenceTransformer-compatible encode() over an ONNX export of a BERT-style sentence model.
+
+    Reproduces the sentence-transformers pipeline of all-MiniLM-L6-v2:
+    WordPiece tokenization (tokenizer.json), the transformer, attention-masked
+    mean pooling and L2 normalisation, so vectors can go into existing FAISS
+    indices. `model_dir` is what export_onnx() writes.
+    """
+
+    def __init__(self, model_dir, model_file=ONNX_MODEL_FILE, intra_op_threads=ONNX_INTRA_OP_THREADS):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        config = {"max_seq_length": 256, "normalize": True}
+        config_path = os.path.join(model_dir, SENTENCE_CONFIG)
+        if os.path.exists(config_path):
+            with open(config_path) as f:
+                config.update(json.load(f))
+        self.max_seq_length = config["max_seq_length"]
+        self.normalize = config["normalize"]
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=self.max_seq_length)
+        pad_id = self.tokenizer.token_to_id("[PAD]")
+        self.tokenizer.enable_padding(pad_id=pad_id or 0, pad_token="[PAD]")
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads:
+            options.intra_op_num_threads = intra_op_threads
+        self.session = ort.InferenceSession(
+            os.path.join(model_dir, model_file), options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {node.name for node in self.session.get_inputs()}
+        self.dimension = self.session.get_outputs()[0].shape[-1]
+
+    def get_sentence_embedding_dimension(self):
+        return self.dimension
+
+    def _encode_batch(self, texts):
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.array([e.type_ids for e in encodings], dtype=np.int64)
+        hidden = self.session.run(None, feeds)[0]
+
+        mask = attention_mask[:, :, None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        return pooled
+
+    def encode(self, sentences, batch_size=32, convert_to_numpy=True, normalize_embeddings=False, **kwargs):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        if not texts:
+            return np.empty((0, self.dimension), dtype=np.float32)
+
+        # Longest first, as sentence-transformers does, so each batch pads little
+        order = np.argsort([-len(text) for text in texts], kind="stable")
+        pooled = np.empty((len(texts), self.dimension), dtype=np.float32)
+        for start in range(0, len(texts), batch_size):
+            idx = order[start:start + batch_size]
+            pooled[idx] = self._encode_batch([texts[i] for i in idx])
+
+        if self.normalize or normalize_embeddings:
+            pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        return pooled[0] if single else pooled
+
+
+def cosine_agreement(reference, candidate):
+    """Per-text cosine similarity between two encoders' vectors for the same texts"""
+    reference = reference / np.linalg.norm(reference, axis=1, keepdims=True)
+    candidate = candidate / np.linalg.norm(candidate, axis=1, keepdims=True)
+    return np.sum(reference * candidate, axis=1)
+
+
+def quantize_int8(model_dir, source="model.onnx", target=ONNX_MODEL_FILE):
+    """Dynamic int8 quantization of the exported fp32 graph (weights int8, activations quantized at run time)"""
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+    quantize_dynamic(
+        os.path.join(model_dir, source),
+        os.path.join(model_dir, target),
+        weight_type=QuantType.QInt8,
+    )
+    return os.path.join(model_dir, target)
+
+
+def export_onnx(model_name, model_dir, opset=14):
+    """Export a sentence-transformers model's transformer to model.onnx plus tokenizer and pooling config"""
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    os.makedirs(model_dir, exist_ok=True)
+    model = SentenceTransformer(model_name, device="cpu")
+    transformer = model[0].auto_model.eval()
+    tokenizer = model.tokenizer
+    tokenizer.save_pretrained(model_dir)
+    with open(os.path.join(model_dir, SENTENCE_CONFIG), "w") as f:
+        json.dump({
+            "max_seq_length": model.max_seq_length,
+            "normalize": any(type(module).__name__ == "Normalize" for module in model),
+        }, f)
+
+    sample = tokenizer(["export sample"], return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+    with torch.no_grad():
+        torch.onnx.export(
+            transformer,
+            tuple(sample[name] for name in input_names),
+            os.path.join(model_dir, "model.onnx"),
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=opset,
+        )
+    return model
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export a sentence-transformers model to int8 ONNX")
+    parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--out", required=True, help="directory to write model.onnx, model_int8.onnx and tokenizer")
+    args = parser.parse_args()
+
+    reference = export_onnx(args.model, args.out)
+    quantize_int8(args.out)
+
+    # Refuse to hand over a model whose vectors would not match existing indices
+    texts = [
+        "Photosynthesis converts light energy into chemical energy.",
+        "The Mughal empire was founded by Babur in 1526.",
+        "Newton's second law relates force, mass and acceleration.",
+        "Rivers deposit sediment where their velocity drops.",
+    ]
+    agreement = cosine_agreement(
+        reference.encode(texts, convert_to_numpy=True),
+        OnnxEncoder(args.out).encode(texts),
+    )
+    print(f"int8 vs torch cosine: min {agreement.min():.4f}, mean {agreement.mean():.4f}")
+    if agreement.min() < ONNX_MIN_COSINE:
+        raise SystemExit(f"Quantized model drifts below {ONNX_MIN_COSINE} cosine; keep using the torch backend")
+
+
+if __name__ == "__main__":
+    main()
@@ -162,7 +162,8 @@ from pathlib import Path
 import os
 import time
 import json
-from Ask_with_llm import prompt_for_QnA
+from Ask_with_llm import prompt_for_QnA, CHAT_OPTIONS
+from llm_client import ollama_client, LLM_MODELS, LLMError
 import requests
 import io
 
@@ -499,23 +500,13 @@ def export_chat_as_json():
     return json.dumps(export_data, indent=2)
 
 # Function to process streaming response
-def process_streaming_response(response):
-    """Process streaming response from Ollama API"""
-    if response.status_code == 200:
-        for line in response.iter_lines():
-            if not line:
-                continue
-            try:
-                chunk = json.loads(line.decode('utf-8'))
-                if chunk.get("done", False):
-                    break
-                token = chunk.get("response", "")
-                if token:
-                    yield token
-            except json.JSONDecodeError:
-                continue
-    else:
-        yield f"Error: {response.status_code} - {response.text}"
+def process_streaming_response(prompt):
+    """Stream tokens from Ollama over the shared keep-alive client"""
+    try:
+        for token in ollama_client.generate_stream(prompt, model=LLM_MODELS["chat"], options=CHAT_OPTIONS):
+            yield token
+    except (LLMError, requests.RequestException) as e:
+        yield f"Error: {e}"
 
 # Main content container
 with st.container():
@@ -580,21 +571,9 @@ with st.form("chat_form", clear_on_submit=True):
                 
                 start = time.time()
                 
-                response = requests.post(
-                    "http://localhost:11434/api/generate",
-                    json={
-                        "model": "llama3-14b-custom",
-                        "prompt": query,
-                        "stream": True,
-                        "temperature": 0.3,
-                        "top_p": 0.5
-                    },
-                    stream=True
-                )
-                
                 # Clear typing indicator and show response
                 typing_placeholder.empty()
-                full_response = st.write_stream(process_streaming_response(response))
+                full_response = st.write_stream(process_streaming_response(query))
             
                 latency = time.time() - start
                 
@@ -0,0 +1,147 @@
+import os
+import tempfile
+from collections import namedtuple
+from concurrent.futures.process import BrokenProcessPool
+import fitz  # PyMuPDF
+from executors import get_cpu_pool, discard_cpu_pool, CPU_POOL_WORKERS
+from metrics import timed
+
+PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "32"))
+
+# Jobs below this many pages are extracted inline; a pool round-trip would cost more
+INLINE_PAGE_LIMIT = 16
+
+ExtractionFailure = namedtuple("ExtractionFailure", ["source", "stage", "error"])
+ExtractionReport = namedtuple("ExtractionReport", ["documents", "failures"])
+
+
+class ExtractedPDF(namedtuple("ExtractedPDF", ["source", "pages"])):
+    """One PDF's text page by page: pages[i] is the text of page i + 1"""
+
+    @property
+    def text(self):
+        return "".join(self.pages)
+
+    @property
+    def page_count(self):
+        return len(self.pages)
+
+    def numbered_pages(self):
+        """(page_number, text) pairs, numbered from 1"""
+        return list(enumerate(self.pages, start=1))
+
+
+def _open(data):
+    """Open a PDF from a path or from bytes/memoryview without copying it into a BytesIO"""
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return fitz.open(stream=data, filetype="pdf")
+    return fitz.open(data)
+
+
+def iter_pdf_pages(data, start=0, stop=None):
+    """Yield (page_number, text) for pages [start, stop) of a PDF, one page at a time"""
+    with _open(data) as doc:
+        stop = doc.page_count if stop is None else min(stop, doc.page_count)
+        for page_number in range(start, stop):
+            yield page_number, doc.load_page(page_number).get_text()
+
+
+def _extract_range(data, start, stop):
+    # Runs in a worker process
+    return [text for _, text in iter_pdf_pages(data, start, stop)]
+
+
+def _page_count(data):
+    with _open(data) as doc:
+        return doc.page_count
+
+
+def _spill(data):
+    """Write PDF bytes to a temp file, so each page-range task opens it instead of receiving a copy"""
+    fd, path = tempfile.mkstemp(prefix="pdf-extract-", suffix=".pdf")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    return path
+
+
+@timed("pdf_extraction")
+def extract_pdfs(sources, max_workers=CPU_POOL_WORKERS, pages_per_task=PAGES_PER_TASK):
+    """Extract text from several PDFs, fanning files and page ranges out to a process pool.
+
+    `sources` is a list of (name, data) pairs where data is a file path or the
+    raw PDF bytes. Every source is split into page ranges. When the pool is
+    used, byte sources with more than one range are first written to a temp
+    file (removed afterwards), so the buffer is not pickled once per range.
+    Returns an ExtractionReport of ExtractedPDF documents (input order) and
+    ExtractionFailure records for the files that could not be read.
+    """
+    failures = []
+    plans = []   # (name, data, [(start, stop), ...])
+    for name, data in sources:
+        try:
+            page_count = _page_count(data)
+        except Exception as e:
+            failures.append(ExtractionFailure(name, "open", str(e)))
+            continue
+        ranges = [(start, min(start + pages_per_task, page_count))
+                  for start in range(0, page_count, pages_per_task)] or [(0, 0)]
+        plans.append((name, data, ranges))
+
+    total_pages = sum(stop - start for _, _, ranges in plans for start, stop in ranges)
+    n_tasks = sum(len(ranges) for _, _, ranges in plans)
+    use_pool = max_workers > 1 and n_tasks > 1 and total_pages > INLINE_PAGE_LIMIT
+
+    documents = []
+    if use_pool:
+        spilled = []
+        try:
+            for i, (name, data, ranges) in enumerate(plans):
+                if isinstance(data, (bytes, bytearray, memoryview)) and len(ranges) > 1:
+                    path = _spill(data)
+                    spilled.append(path)
+                    plans[i] = (name, path, ranges)
+            pool = get_cpu_pool()
+            futures = [
+                (name, [pool.submit(_extract_range, bytes(data) if isinstance(data, memoryview) else data, start, stop)
+                        for start, stop in ranges])
+                for name, data, ranges in plans
+            ]
+            for name, parts in futures:
+                try:
+                    pages = [text for part in parts for text in part.result()]
+                except BrokenProcessPool as e:
+                    discard_cpu_pool()
+                    failures.append(ExtractionFailure(name, "extract", str(e)))
+                    continue
+                except Exception as e:
+                    failures.append(ExtractionFailure(name, "extract", str(e)))
+                    continue
+                documents.append(ExtractedPDF(name, pages))
+        finally:
+            for path in spilled:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+    else:
+        for name, data, ranges in plans:
+            try:
+                pages = [text for start, stop in ranges for text in _extract_range(data, start, stop)]
+            except Exception as e:
+                failures.append(ExtractionFailure(name, "extract", str(e)))
+                continue
+            documents.append(ExtractedPDF(name, pages))
+
+    return ExtractionReport(documents, failures)
+
+
+def find_pdf_files(root):
+    """PDF paths under a folder (recursively), or the PDFs in an explicit list of paths"""
+    if isinstance(root, (list, tuple)):
+        return [path for path in root if path.lower().endswith(".pdf")]
+    paths = []
+    for foldername, subfolders, filenames in os.walk(root):
+        for filename in filenames:
+            if filename.endswith('.pdf'):
+                paths.append(os.path.join(foldername, filename))
+    return paths
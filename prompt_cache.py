@@ -0,0 +1,208 @@
+import os
+import sys
+import time
+import base64
+import hashlib
+import threading
+import numpy as np
+from collections import OrderedDict, namedtuple
+from session_store import session_store
+
+# Memory budget for per-session model state (Ollama token context, llama_cpp KV snapshots)
+PROMPT_CACHE_MAX_MB = int(os.getenv("PROMPT_CACHE_MAX_MB", "256"))
+PROMPT_CACHE_MAX_SESSIONS = int(os.getenv("PROMPT_CACHE_MAX_SESSIONS", "256"))
+
+# Backends whose state is plain data (token ids, chunk keys) and so is kept in
+# the shared session store, where every worker process sees the latest turn.
+# llama_cpp KV snapshots belong to one loaded model and stay in this process.
+SHARED_BACKENDS = ("ollama",)
+PROMPT_STATE_NAMESPACE = "prompt_state"
+
+# Role markers wrapped around the instructions and each turn. Ollama applies the
+# model's chat template itself, so its prompts go in plain.
+TurnMarkers = namedtuple("TurnMarkers", ["system", "user", "assistant", "end"])
+PLAIN_MARKERS = TurnMarkers("", "", "", "")
+PHI3_MARKERS = TurnMarkers("<|system|>\n", "<|user|>\n", "<|assistant|>\n", "<|end|>\n")
+
+
+def chunk_key(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class SessionPromptState:
+    """What one chat session has already fed the model.
+
+    `context` is the token context Ollama returned after the last answer;
+    sending it back lets Ollama continue from it instead of re-reading the
+    conversation. `llama_state` / `transcript` are the equivalent for a local
+    llama_cpp model: a KV snapshot plus the exact text it covers.
+    """
+
+    def __init__(self, session_id, backend="ollama"):
+        self.session_id = session_id
+        self.backend = backend
+        self.turns = 0
+        self.n_tokens = 0
+        self.context = None
+        self.llama_state = None
+        self.transcript = ""
+        self.seen_chunks = set()
+        self.updated_at = time.time()
+
+    @property
+    def key(self):
+        return (self.session_id, self.backend)
+
+    def record_turn(self, chunk_keys, context=None, llama_state=None, transcript=None, n_tokens=0):
+        """Advance past a completed turn; the model state now covers everything sent so far"""
+        if context is not None:
+            self.context = np.asarray(context, dtype=np.int32)
+            n_tokens = len(context)
+        if llama_state is not None:
+            self.llama_state = llama_state
+            self.transcript = transcript
+        self.n_tokens = n_tokens
+        self.turns += 1
+        self.seen_chunks.update(chunk_keys)
+
+    def to_record(self):
+        """JSON-able form for the session store (context as base64 int32; llama_cpp state is not included)"""
+        return {
+            "turns": self.turns,
+            "n_tokens": self.n_tokens,
+            "context": None if self.context is None else base64.b64encode(self.context.tobytes()).decode("ascii"),
+            "seen_chunks": sorted(self.seen_chunks),
+            "updated_at": self.updated_at,
+        }
+
+    @classmethod
+    def from_record(cls, session_id, backend, record):
+        state = cls(session_id, backend)
+        state.turns = record["turns"]
+        state.n_tokens = record["n_tokens"]
+        if record["context"] is not None:
+            state.context = np.frombuffer(base64.b64decode(record["context"]), dtype=np.int32)
+        state.seen_chunks = set(record["seen_chunks"])
+        state.updated_at = record["updated_at"]
+        return state
+
+    @property
+    def nbytes(self):
+        total = sys.getsizeof(self.transcript) + 48 * len(self.seen_chunks)
+        if self.context is not None:
+            total += self.context.nbytes
+        if self.llama_state is not None:
+            total += getattr(self.llama_state, "llama_state_size", 0)
+            total += getattr(getattr(self.llama_state, "input_ids", None), "nbytes", 0)
+        return total
+
+
+class PromptStateCache:
+    """SessionPromptState per (session, backend).
+
+    States of SHARED_BACKENDS are read from and written to `store` (the
+    shared session store), so a session's conversation continues whichever
+    worker serves the next turn. Other states (llama_cpp KV snapshots) live in
+    a per-process LRU bounded by bytes and by number of sessions.
+    """
+
+    def __init__(self, max_bytes=PROMPT_CACHE_MAX_MB * 1024 * 1024, max_sessions=PROMPT_CACHE_MAX_SESSIONS,
+                 store=None):
+        self.max_bytes = max_bytes
+        self.max_sessions = max_sessions
+        self.store = store
+        self._entries = OrderedDict()   # (session_id, backend) -> (state, nbytes)
+        self._resident_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.resets = 0
+
+    def _shared(self, backend):
+        return self.store is not None and backend in SHARED_BACKENDS
+
+    @staticmethod
+    def _store_key(session_id, backend):
+        return f"{backend}/{session_id}"
+
+    def get(self, session_id, backend="ollama"):
+        if self._shared(backend):
+            record = self.store.get(PROMPT_STATE_NAMESPACE, self._store_key(session_id, backend))
+            with self._lock:
+                if record is None:
+                    self.misses += 1
+                    return None
+                self.hits += 1
+            return SessionPromptState.from_record(session_id, backend, record)
+        key = (session_id, backend)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, state):
+        if self._shared(state.backend):
+            state.updated_at = time.time()
+            self.store.put(PROMPT_STATE_NAMESPACE, self._store_key(state.session_id, state.backend), state.to_record())
+            return
+        nbytes = state.nbytes
+        with self._lock:
+            if state.key in self._entries:
+                self._drop(state.key)
+            if nbytes > self.max_bytes:
+                return
+            state.updated_at = time.time()
+            self._entries[state.key] = (state, nbytes)
+            self._resident_bytes += nbytes
+            self._evict()
+
+    def drop(self, session_id):
+        """Forget a session's state for every backend"""
+        if self.store is not None:
+            for backend in SHARED_BACKENDS:
+                self.store.delete(PROMPT_STATE_NAMESPACE, self._store_key(session_id, backend))
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == session_id]:
+                self._drop(key)
+
+    def record_reset(self):
+        with self._lock:
+            self.resets += 1
+
+    def clear(self):
+        """Drop the states held in this process (shared states stay in the store)"""
+        with self._lock:
+            self._entries.clear()
+            self._resident_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "sessions": len(self._entries),
+                "resident_bytes": self._resident_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "window_resets": self.resets,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def _drop(self, key):
+        _, nbytes = self._entries.pop(key)
+        self._resident_bytes -= nbytes
+
+    def _evict(self):
+        while self._entries and (self._resident_bytes > self.max_bytes
+                                 or len(self._entries) > self.max_sessions):
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+
+
+prompt_state_cache = PromptStateCache(store=session_store)
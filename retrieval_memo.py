@@ -0,0 +1,90 @@
+import os
+import threading
+from collections import OrderedDict
+
+QUERY_EMBEDDING_MEMO_SIZE = int(os.getenv("QUERY_EMBEDDING_MEMO_SIZE", "4096"))
+RETRIEVAL_MEMO_SIZE = int(os.getenv("RETRIEVAL_MEMO_SIZE", "8192"))
+
+
+def normalize_query(query):
+    """Collapse whitespace; case is kept because BM25 tokens are case-sensitive"""
+    return " ".join(query.split())
+
+
+class LRUMemo:
+    """Thread-safe LRU dict with a fixed number of entries.
+
+    Keys are tuples whose first element is a scope (a model name or a session
+    path) so everything memoized for one scope can be dropped at once.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._scopes = {}   # scope -> set of keys
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            self._entries[key] = value
+            self._scopes.setdefault(key[0], set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, scope):
+        with self._lock:
+            keys = self._scopes.pop(scope, ())
+            for key in keys:
+                self._entries.pop(key, None)
+            self.invalidations += len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._scopes.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def _drop(self, key):
+        self._entries.pop(key)
+        keys = self._scopes.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._scopes[key[0]]
+
+
+# (model name, normalized query) -> read-only (1, dim) float32 embedding
+query_embedding_memo = LRUMemo(QUERY_EMBEDDING_MEMO_SIZE)
+# (session path, index signature, normalized query, top_k, weights, rrf_k) -> (chunk ids, scores)
+retrieval_memo = LRUMemo(RETRIEVAL_MEMO_SIZE)
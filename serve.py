@@ -0,0 +1,166 @@
+"""Production launcher: preload the encoder and hot session indices once, then fork workers.
+
+    python serve.py                      # SERVER_WORKERS workers on SERVER_HOST:SERVER_PORT
+    python serve.py --workers 4 --port 8000
+
+The master binds the listening socket, imports the app, loads the embedding
+model and opens the most recently used session bundles, then forks. Workers
+inherit those pages copy-on-write and all accept() on the same socket, so the
+model weights exist once in RAM however many workers there are. Session state
+that must be visible to every worker lives in session_store, not in globals.
+
+`uvicorn --workers` is not used because it starts workers with spawn: each
+one re-imports everything and loads its own model copy.
+"""
+import os
+import gc
+import sys
+import time
+import signal
+import socket
+import logging
+import argparse
+
+SERVER_WORKERS = int(os.getenv("SERVER_WORKERS") or os.cpu_count() or 1)
+SERVER_HOST = os.getenv("SERVER_HOST", "0.0.0.0")
+SERVER_PORT = int(os.getenv("SERVER_PORT", "8000"))
+# Most recently modified sessions whose indices are opened before forking
+SERVER_PRELOAD_SESSIONS = int(os.getenv("SERVER_PRELOAD_SESSIONS", "32"))
+
+logger = logging.getLogger("serve")
+
+
+def threads_per_worker(workers):
+    return max(1, (os.cpu_count() or 1) // workers)
+
+
+def bind_socket(host, port):
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def recent_sessions(session_dir, limit):
+    """Session ids with a bundle (or legacy index files) on disk, newest first; archived ones are left archived"""
+    from functions import BUNDLE_FILE, LEGACY_INDEX_FILES
+    found = []
+    if os.path.isdir(session_dir):
+        for name in os.listdir(session_dir):
+            for index_file in (BUNDLE_FILE,) + LEGACY_INDEX_FILES:
+                path = os.path.join(session_dir, name, index_file)
+                if os.path.exists(path):
+                    found.append((os.path.getmtime(path), name))
+                    break
+    return [name for _, name in sorted(found, reverse=True)[:limit]]
+
+
+def preload(session_dir, session_limit):
+    """Everything workers should share: runs in the master, before any thread exists"""
+    from model_registry import EMBEDDING_BACKEND, get_encoder
+    from functions import load_session_indices
+
+    started = time.perf_counter()
+    # Only the torch model is loaded here, and nothing is encoded: the first
+    # forward pass starts OpenMP threads, which a fork would leave behind.
+    # ONNX Runtime sessions create their thread pool on construction, so each
+    # worker loads its own (the int8 model is small).
+    if EMBEDDING_BACKEND == "torch":
+        get_encoder()
+    loaded = 0
+    for session_id in recent_sessions(session_dir, session_limit):
+        try:
+            load_session_indices(session_id, session_dir, touch=False)
+            loaded += 1
+        except Exception as e:
+            logger.warning("Skipping session %s: %s", session_id, e)
+    logger.info("Preloaded encoder (%s) and %d sessions in %.1fs", EMBEDDING_BACKEND, loaded,
+                time.perf_counter() - started)
+
+
+def run_worker(app, sock, threads, log_level):
+    """Runs in a forked child: size the native thread pools for this worker, then serve"""
+    import uvicorn
+    if "torch" in sys.modules:
+        sys.modules["torch"].set_num_threads(threads)
+    if "faiss" in sys.modules:
+        sys.modules["faiss"].omp_set_num_threads(threads)
+    config = uvicorn.Config(app, log_level=log_level, lifespan="on")
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def spawn(app, sock, threads, log_level):
+    pid = os.fork()
+    if pid == 0:
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        code = 0
+        try:
+            run_worker(app, sock, threads, log_level)
+        except BaseException:
+            logger.exception("Worker %d crashed", os.getpid())
+            code = 1
+        finally:
+            os._exit(code)
+    return pid
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=SERVER_WORKERS)
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--preload-sessions", type=int, default=SERVER_PRELOAD_SESSIONS)
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s %(name)s %(levelname)s %(message)s")
+
+    # Set before torch / faiss / onnxruntime are imported so their pools start at this size
+    threads = threads_per_worker(args.workers)
+    os.environ.setdefault("OMP_NUM_THREADS", str(threads))
+    os.environ.setdefault("EMBEDDING_ONNX_THREADS", str(threads))
+
+    sock = bind_socket(args.host, args.port)
+    from fastapi_backend import app, SESSION_DIR
+    os.makedirs(SESSION_DIR, exist_ok=True)
+    preload(SESSION_DIR, args.preload_sessions)
+    # Move everything allocated so far out of the collector's reach, so gc
+    # passes in the workers don't write to (and un-share) those pages
+    gc.freeze()
+
+    workers = {spawn(app, sock, threads, args.log_level) for _ in range(args.workers)}
+    logger.info("Serving on %s:%d with %d workers (%d threads each)", args.host, args.port, len(workers), threads)
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        workers.discard(pid)
+        if not stopping:
+            logger.warning("Worker %d exited (status %d); starting a replacement", pid, status)
+            time.sleep(1)
+            workers.add(spawn(app, sock, threads, args.log_level))
+    sock.close()
+
+
+if __name__ == "__main__":
+    main()
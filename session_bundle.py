@@ -0,0 +1,237 @@
+import os
+import json
+import mmap
+import time
+import struct
+import hashlib
+import logging
+import functools
+import threading
+from collections.abc import Sequence
+import numpy as np
+import faiss
+from sparse_bm25 import SparseBM25, Vocabulary
+from ann_index import apply_search_params
+
+BUNDLE_FILE = "index.bundle"
+BUNDLE_MAGIC = b"EDUIDXB\n"
+# 2: BM25 vocabulary as term offsets + UTF-8 text instead of a fixed-width unicode array
+BUNDLE_FORMAT_VERSION = 2
+SECTION_ALIGNMENT = 64
+# Check every section's sha256 when a bundle is opened. Reads every page, so
+# loading is no longer constant-time; meant for debugging suspected corruption.
+SESSION_BUNDLE_VERIFY = os.getenv("SESSION_BUNDLE_VERIFY", "0") == "1"
+
+BM25_SECTIONS = ("indptr", "doc_ids", "impacts", "max_impact", "doc_len", "idf")
+
+_HEADER = struct.Struct("<8sQ")   # magic, manifest length
+
+logger = logging.getLogger(__name__)
+
+
+class BundleFormatError(ValueError):
+    pass
+
+
+@functools.lru_cache(maxsize=None)
+def _warn_no_zero_copy():
+    logger.warning("faiss %s has no ZeroCopyIOReader (added in 1.11): session indices are copied into "
+                   "each worker's memory instead of being mapped from the bundle", faiss.__version__)
+
+
+def _align(offset):
+    return -(-offset // SECTION_ALIGNMENT) * SECTION_ALIGNMENT
+
+
+class ChunkStore(Sequence):
+    """Read-only list of chunk texts: an offsets array into one UTF-8 blob, decoded per access"""
+
+    def __init__(self, offsets, blob):
+        self.offsets = offsets
+        self.blob = blob
+
+    @classmethod
+    def pack(cls, chunks):
+        encoded = [chunk.encode("utf-8") for chunk in chunks]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(text) for text in encoded], out=offsets[1:])
+        return cls(offsets, np.frombuffer(b"".join(encoded), dtype=np.uint8))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        i = int(i)
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("chunk index out of range")
+        return self.blob[self.offsets[i]:self.offsets[i + 1]].tobytes().decode("utf-8")
+
+    @property
+    def nbytes(self):
+        return self.offsets.nbytes + self.blob.nbytes
+
+
+def _source_runs(sources):
+    """Per-chunk source ids as [source, count] runs; appends keep each source contiguous"""
+    runs = []
+    for source in sources:
+        if runs and runs[-1][0] == source:
+            runs[-1][1] += 1
+        else:
+            runs.append([source, 1])
+    return runs
+
+
+def write_bundle(path, faiss_index, index_params, chunks, sources, bm25_index, model=None, chunk_params=None):
+    """Write a session's indices as one bundle file, atomically replacing any existing one.
+
+    Layout: magic, manifest length, JSON manifest, then 64-byte aligned raw
+    sections (chunk offsets + UTF-8 blob, the serialized FAISS index, BM25
+    arrays) that readers map without copying.
+    """
+    store = chunks if isinstance(chunks, ChunkStore) else ChunkStore.pack(chunks)
+    sections = {
+        "chunk_offsets": store.offsets,
+        "chunk_text": store.blob,
+        "faiss_index": faiss.serialize_index(faiss_index),
+        "bm25_term_offsets": bm25_index.terms.offsets,
+        "bm25_term_text": bm25_index.terms.blob,
+    }
+    for name in BM25_SECTIONS:
+        sections[f"bm25_{name}"] = getattr(bm25_index, name)
+    if bm25_index.tf is not None:
+        sections["bm25_tf"] = bm25_index.tf
+
+    entries, offset = {}, 0
+    for name, array in sections.items():
+        array = sections[name] = np.ascontiguousarray(array)
+        entries[name] = {
+            "offset": offset,
+            "nbytes": array.nbytes,
+            "dtype": array.dtype.str,
+            "shape": list(array.shape),
+            "sha256": hashlib.sha256(array.data).hexdigest(),
+        }
+        offset = _align(offset + array.nbytes)
+
+    manifest = json.dumps({
+        "format_version": BUNDLE_FORMAT_VERSION,
+        "created_at": time.time(),
+        "model": model,
+        "dim": int(faiss_index.d),
+        "n_chunks": len(store),
+        "chunk_params": chunk_params or {},
+        "index_params": index_params,
+        "bm25": {"k1": bm25_index.k1, "b": bm25_index.b, "epsilon": bm25_index.epsilon},
+        "sources": _source_runs(sources),
+        "sections": entries,
+    }).encode("utf-8")
+    data_start = _align(_HEADER.size + len(manifest))
+
+    tmp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(_HEADER.pack(BUNDLE_MAGIC, len(manifest)))
+            f.write(manifest)
+            for name, array in sections.items():
+                f.write(b"\0" * (data_start + entries[name]["offset"] - f.tell()))
+                f.write(array.data)
+            f.flush()
+            os.fsync(f.fileno())
+        # Readers holding the old file keep their mapping; new opens see the whole new bundle
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def read_manifest(f, name):
+    """The manifest at the head of a bundle, read from a file object (e.g. a decompressing archive stream)"""
+    header = f.read(_HEADER.size)
+    if len(header) < _HEADER.size:
+        raise BundleFormatError(f"{name}: truncated bundle")
+    magic, length = _HEADER.unpack(header)
+    if magic != BUNDLE_MAGIC:
+        raise BundleFormatError(f"{name}: not a session bundle")
+    return json.loads(f.read(length))
+
+
+class SessionBundle:
+    """A session bundle opened read-only through mmap.
+
+    Opening reads only the manifest; chunk text, BM25 arrays and FAISS codes
+    are numpy views of the mapping, so the page cache is shared by every
+    process that opens the same file.
+    """
+
+    def __init__(self, path, verify=SESSION_BUNDLE_VERIFY):
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._map) < _HEADER.size:
+            raise BundleFormatError(f"{path}: truncated bundle")
+        magic, length = _HEADER.unpack_from(self._map, 0)
+        if magic != BUNDLE_MAGIC:
+            raise BundleFormatError(f"{path}: not a session bundle")
+        self.manifest = json.loads(self._map[_HEADER.size:_HEADER.size + length])
+        if self.manifest["format_version"] > BUNDLE_FORMAT_VERSION:
+            raise BundleFormatError(
+                f"{path}: bundle format {self.manifest['format_version']} is newer than "
+                f"supported version {BUNDLE_FORMAT_VERSION}"
+            )
+        self._data_start = _align(_HEADER.size + length)
+        if verify:
+            self.verify()
+
+    def array(self, name):
+        entry = self.manifest["sections"][name]
+        dtype = np.dtype(entry["dtype"])
+        count = entry["nbytes"] // dtype.itemsize if dtype.itemsize else 0
+        if not count:
+            return np.empty(entry["shape"], dtype=dtype)
+        view = np.frombuffer(self._map, dtype=dtype, count=count, offset=self._data_start + entry["offset"])
+        return view.reshape(entry["shape"])
+
+    def verify(self):
+        for name, entry in self.manifest["sections"].items():
+            if hashlib.sha256(self.array(name).data).hexdigest() != entry["sha256"]:
+                raise BundleFormatError(f"{self.path}: checksum mismatch in section {name}")
+
+    def chunks(self):
+        return ChunkStore(self.array("chunk_offsets"), self.array("chunk_text"))
+
+    def sources(self):
+        return [source for source, count in self.manifest["sources"] for _ in range(count)]
+
+    def index_params(self):
+        return self.manifest["index_params"]
+
+    def faiss_index(self, copy=False):
+        """The FAISS index; unless copy=True, its vector codes stay in the mapped file"""
+        buffer = self.array("faiss_index")
+        if not copy and not hasattr(faiss, "ZeroCopyIOReader"):
+            _warn_no_zero_copy()
+        if copy or not hasattr(faiss, "ZeroCopyIOReader"):
+            # faiss before 1.11 can only deserialize into its own memory
+            index = faiss.deserialize_index(np.array(buffer))
+        else:
+            index = faiss.read_index(faiss.ZeroCopyIOReader(faiss.swig_ptr(buffer), buffer.size), 0)
+            index.referenced_objects = [buffer]   # keeps the mapping alive as long as the index
+        return apply_search_params(index, self.index_params())
+
+    def bm25(self):
+        params = self.manifest["bm25"]
+        sections = self.manifest["sections"]
+        tf = self.array("bm25_tf") if "bm25_tf" in sections else None
+        if "bm25_terms" in sections:
+            # Format 1 bundle: fixed-width unicode vocabulary, converted on open
+            terms = Vocabulary.pack(self.array("bm25_terms").tolist())
+        else:
+            terms = Vocabulary(self.array("bm25_term_offsets"), self.array("bm25_term_text"))
+        return SparseBM25(terms, *(self.array(f"bm25_{name}") for name in BM25_SECTIONS),
+                          params["k1"], params["b"], tf=tf, epsilon=params["epsilon"])
@@ -0,0 +1,135 @@
+import os
+import sys
+import threading
+from collections import OrderedDict, namedtuple
+from ann_index import code_bytes
+
+# Memory budget for resident session indices (MB), shared by every session in the process
+SESSION_CACHE_MAX_MB = int(os.getenv("SESSION_CACHE_MAX_MB", "512"))
+
+SessionIndices = namedtuple("SessionIndices", ["faiss_index", "chunks", "bm25_index"])
+
+
+def estimate_nbytes(faiss_index, chunks, bm25_index):
+    """Rough resident size of one session's indices, used for LRU accounting"""
+    total = getattr(faiss_index, "ntotal", 0) * code_bytes(faiss_index)
+
+    chunk_bytes = getattr(chunks, "nbytes", None)
+    if chunk_bytes is not None:
+        total += chunk_bytes
+    else:
+        total += sys.getsizeof(chunks) + sum(sys.getsizeof(chunk) for chunk in chunks)
+
+    nbytes = getattr(bm25_index, "nbytes", None)
+    if nbytes is not None:
+        total += nbytes
+    else:
+        # rank_bm25 keeps one term -> frequency dict per document
+        for doc_freq in getattr(bm25_index, "doc_freqs", []):
+            total += sys.getsizeof(doc_freq) + 64 * len(doc_freq)
+        total += sys.getsizeof(getattr(bm25_index, "idf", {}))
+    return total
+
+
+class SessionIndexCache:
+    """LRU cache of loaded session indices, bounded by estimated resident bytes.
+
+    Entries are keyed by session path and carry a file signature (mtimes/sizes),
+    so an index rewritten by another process is reloaded on the next lookup.
+    """
+
+    def __init__(self, max_bytes=SESSION_CACHE_MAX_MB * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()   # key -> (value, nbytes, signature)
+        self._loading = {}              # key -> [loads in flight, invalidations since the first began]
+        self._resident_bytes = 0
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get_or_load(self, key, loader, signature=None, sizeof=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] == signature:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                self._drop(key)
+            self.misses += 1
+            loading = self._loading.setdefault(key, [0, 0])
+            loading[0] += 1
+            generation = loading[1]
+
+        # Load outside the lock so a slow session doesn't stall the others
+        try:
+            value = loader()
+            nbytes = sizeof(value) if sizeof is not None else 0
+        except BaseException:
+            with self._lock:
+                self._finish_load(key)
+            raise
+
+        with self._lock:
+            # An invalidation raced with our load; serve the value but don't cache it
+            if self._finish_load(key) != generation:
+                return value
+            if key in self._entries:
+                self._drop(key)
+            if nbytes > self.max_bytes:
+                return value
+            self._entries[key] = (value, nbytes, signature)
+            self._resident_bytes += nbytes
+            self._evict()
+        return value
+
+    def invalidate(self, key):
+        with self._lock:
+            loading = self._loading.get(key)
+            if loading is not None:
+                loading[1] += 1
+            if key in self._entries:
+                self._drop(key)
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries):
+                self.invalidate(key)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "resident_bytes": self._resident_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def _finish_load(self, key):
+        """End one load of key; returns its invalidation count. Only keys being loaded are tracked"""
+        loading = self._loading[key]
+        loading[0] -= 1
+        if not loading[0]:
+            del self._loading[key]
+        return loading[1]
+
+    def _drop(self, key):
+        _, nbytes, _ = self._entries.pop(key)
+        self._resident_bytes -= nbytes
+
+    def _evict(self):
+        while self._resident_bytes > self.max_bytes and self._entries:
+            oldest = next(iter(self._entries))
+            self._drop(oldest)
+            self.evictions += 1
+
+
+session_index_cache = SessionIndexCache()
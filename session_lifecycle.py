@@ -0,0 +1,391 @@
+import os
+import gzip
+import lzma
+import time
+import shutil
+import logging
+import functools
+import threading
+from session_bundle import BUNDLE_FILE, read_manifest
+from session_cache import session_index_cache
+from retrieval_memo import retrieval_memo
+
+try:
+    import fcntl
+except ImportError:  # Windows: locks below only hold within one process
+    fcntl = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SESSION_DIR = os.path.join(BASE_DIR, "user_session")
+# Sessions not queried for this long are compressed into the archive tier (0 = never)
+SESSION_IDLE_ARCHIVE_SECONDS = int(os.getenv("SESSION_IDLE_ARCHIVE_SECONDS", str(24 * 3600)))
+# Total disk for session indices and archives; least recently used sessions are deleted past it (0 = no limit)
+SESSION_DISK_QUOTA_MB = int(os.getenv("SESSION_DISK_QUOTA_MB", "0"))
+# Seconds between background sweeps (0 = no background thread)
+SESSION_LIFECYCLE_INTERVAL_SECONDS = int(os.getenv("SESSION_LIFECYCLE_INTERVAL_SECONDS", "300"))
+# zstd needs the zstandard package; without it archives are written with gzip
+SESSION_ARCHIVE_CODEC = os.getenv("SESSION_ARCHIVE_CODEC", "zstd")
+
+# Seconds between access-time writes for one session from one process
+TOUCH_INTERVAL_SECONDS = 60
+ACCESS_FILE = ".last_access"
+# flock()ed while a session's files are rewritten, archived or rehydrated
+LOCK_FILE = ".lock"
+# flock()ed under session_dir by the one process on the host that runs sweeps
+SWEEP_LOCK_FILE = ".lifecycle.lock"
+ARCHIVE_SUFFIXES = {"zstd": ".zst", "gzip": ".gz", "lzma": ".xz"}
+ARCHIVE_FILES = tuple(BUNDLE_FILE + suffix for suffix in ARCHIVE_SUFFIXES.values())
+# Loose index files of sessions saved before bundles; never archived, but they count against the quota
+LEGACY_MARKER = "chunks.pkl"
+
+logger = logging.getLogger(__name__)
+
+
+def _open_codec(codec, path, mode):
+    if codec == "zstd":
+        import zstandard
+        return zstandard.open(path, mode)
+    if codec == "gzip":
+        return gzip.open(path, mode, compresslevel=6)
+    if codec == "lzma":
+        return lzma.open(path, mode)
+    raise ValueError(f"Unknown SESSION_ARCHIVE_CODEC {codec!r} (expected zstd, gzip or lzma)")
+
+
+@functools.lru_cache(maxsize=None)
+def _writable_codec(codec):
+    if codec == "zstd":
+        try:
+            import zstandard  # noqa: F401
+        except ImportError:
+            logger.warning("zstandard is not installed; archiving sessions with gzip")
+            return "gzip"
+    return codec
+
+
+def archive_path(session_path):
+    """The session's archive file, if it has one"""
+    for name in ARCHIVE_FILES:
+        path = os.path.join(session_path, name)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def archived_manifest(path):
+    """Manifest of an archived bundle; only the head of the archive is decompressed"""
+    with _open_codec(_codec_of(path), path, "rb") as f:
+        return read_manifest(f, path)
+
+
+def _codec_of(path):
+    for codec, suffix in ARCHIVE_SUFFIXES.items():
+        if path.endswith(suffix):
+            return codec
+    raise ValueError(f"{path} is not a session archive")
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _identity(path):
+    """(inode, mtime, size) of a file, or None if it is gone"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+class SessionLock:
+    """Serializes changes to one session's files, across threads and worker processes.
+
+    Re-entrant within a thread. The cross-process part is an flock() on the
+    session's LOCK_FILE, taken by the outermost holder in this process; it is
+    skipped while the session directory does not exist yet.
+    """
+
+    def __init__(self, session_path):
+        self.session_path = session_path
+        self._rlock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    def __enter__(self):
+        self._rlock.acquire()
+        self._depth += 1
+        if self._depth == 1 and fcntl is not None:
+            try:
+                self._fd = os.open(os.path.join(self.session_path, LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+            except FileNotFoundError:
+                self._fd = None
+            else:
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._depth -= 1
+        if self._depth == 0 and self._fd is not None:
+            os.close(self._fd)   # releases the flock
+            self._fd = None
+        self._rlock.release()
+        return False
+
+
+_session_locks = {}
+_session_locks_guard = threading.Lock()
+
+
+def session_lock(session_path):
+    """The SessionLock of one session directory"""
+    with _session_locks_guard:
+        lock = _session_locks.get(session_path)
+        if lock is None:
+            lock = _session_locks[session_path] = SessionLock(session_path)
+        return lock
+
+
+class SessionLifecycleManager:
+    """Moves sessions between tiers on disk: hot (a mapped bundle) and archived (compressed).
+
+    Queries record their session's last access (a marker file, so every
+    worker sees it). A background sweep compresses bundles idle for longer
+    than idle_seconds and, past the disk quota, deletes the least recently
+    used sessions outright. An archived session is decompressed back into a
+    bundle by the next query that opens it (see rehydrate).
+
+    Every worker starts the sweep thread, but only the one holding the
+    SWEEP_LOCK_FILE flock sweeps; if it exits, another worker takes over.
+    """
+
+    def __init__(self, session_dir=SESSION_DIR, idle_seconds=SESSION_IDLE_ARCHIVE_SECONDS,
+                 quota_bytes=SESSION_DISK_QUOTA_MB * 1024 * 1024, interval=SESSION_LIFECYCLE_INTERVAL_SECONDS,
+                 codec=SESSION_ARCHIVE_CODEC):
+        self.session_dir = session_dir
+        self.idle_seconds = idle_seconds
+        self.quota_bytes = quota_bytes
+        self.interval = interval
+        self.codec = codec
+        self.on_delete = None          # called with the session id after the quota removes a session
+        self._touched = {}             # session_path -> last access written by this process
+        self._lock = threading.Lock()
+        self._sweep_lock_fd = None     # held open for as long as this process is the sweeper
+        self._sweep_lock_pid = None
+        self._stop = threading.Event()
+        self._thread = None
+        self.archived = 0
+        self.rehydrated = 0
+        self.deleted = 0
+        self.last_sweep_at = None
+
+    def touch(self, session_path):
+        """Record a query against the session; cheap enough for every query"""
+        now = time.time()
+        if now - self._touched.get(session_path, 0.0) < TOUCH_INTERVAL_SECONDS:
+            return
+        self._touched[session_path] = now
+        try:
+            with open(os.path.join(session_path, ACCESS_FILE), "a"):
+                pass
+            os.utime(os.path.join(session_path, ACCESS_FILE))
+        except FileNotFoundError:
+            pass
+
+    def forget(self, session_path):
+        """Drop a session's access record, once its indices have been deleted"""
+        self._touched.pop(session_path, None)
+        _remove(os.path.join(session_path, ACCESS_FILE))
+
+    def last_access(self, session_path):
+        """Last recorded query, or else the newest file in the session"""
+        try:
+            return os.path.getmtime(os.path.join(session_path, ACCESS_FILE))
+        except FileNotFoundError:
+            pass
+        with os.scandir(session_path) as entries:
+            return max((entry.stat().st_mtime for entry in entries if entry.is_file()), default=0.0)
+
+    def sessions(self):
+        """[{session_id, path, tier, bytes, last_access}] of every session on disk"""
+        found = []
+        if not os.path.isdir(self.session_dir):
+            return found
+        for entry in os.scandir(self.session_dir):
+            if not entry.is_dir() or entry.name.startswith("."):
+                continue
+            names = set(os.listdir(entry.path))
+            if BUNDLE_FILE in names or LEGACY_MARKER in names:
+                tier = "hot"
+            elif names.intersection(ARCHIVE_FILES):
+                tier = "archived"
+            else:
+                continue
+            nbytes = 0
+            for name in names:
+                try:
+                    nbytes += os.path.getsize(os.path.join(entry.path, name))
+                except FileNotFoundError:
+                    pass
+            found.append({
+                "session_id": entry.name,
+                "path": entry.path,
+                "tier": tier,
+                "bytes": nbytes,
+                "last_access": self.last_access(entry.path),
+            })
+        return found
+
+    def archive(self, session_path):
+        """Compress the session's bundle and remove it; False if it changed while being compressed"""
+        bundle = os.path.join(session_path, BUNDLE_FILE)
+        codec = _writable_codec(self.codec)
+        target = bundle + ARCHIVE_SUFFIXES[codec]
+        tmp_path = f"{target}.tmp-{os.getpid()}-{threading.get_ident()}"
+        before = _identity(bundle)
+        try:
+            with open(bundle, "rb") as src, _open_codec(codec, tmp_path, "wb") as dst:
+                shutil.copyfileobj(src, dst, 1 << 20)
+        except FileNotFoundError:
+            _remove(tmp_path)
+            return False
+        # Compressed without the lock, so appends are not held up; the check and
+        # the unlink happen under it, so no bundle written since can be removed
+        with session_lock(session_path):
+            if before is None or _identity(bundle) != before:
+                # Rewritten (a source was appended) while compressing: it is not idle after all
+                _remove(tmp_path)
+                return False
+            os.replace(tmp_path, target)
+            for name in ARCHIVE_FILES:
+                if name != os.path.basename(target):
+                    _remove(os.path.join(session_path, name))
+            # Processes that still map the old bundle keep reading it; new opens rehydrate.
+            # Its disk space is only freed once unmapped, so drop this process's copy now.
+            _remove(bundle)
+        session_index_cache.invalidate(session_path)
+        self.archived += 1
+        return True
+
+    def rehydrate(self, session_path):
+        """Decompress an archived session back into its bundle; True if the bundle exists afterwards"""
+        bundle = os.path.join(session_path, BUNDLE_FILE)
+        started = time.perf_counter()
+        tmp_path = f"{bundle}.tmp-{os.getpid()}-{threading.get_ident()}"
+        with session_lock(session_path):
+            archive = archive_path(session_path)
+            if archive is None or os.path.exists(bundle):
+                # Nothing archived, or another worker rehydrated (and maybe re-indexed) it first
+                return os.path.exists(bundle)
+            try:
+                with _open_codec(_codec_of(archive), archive, "rb") as src, open(tmp_path, "wb") as dst:
+                    shutil.copyfileobj(src, dst, 1 << 20)
+                    dst.flush()
+                    os.fsync(dst.fileno())
+                os.replace(tmp_path, bundle)
+            except FileNotFoundError:
+                return os.path.exists(bundle)
+            finally:
+                _remove(tmp_path)
+            _remove(archive)
+        self.rehydrated += 1
+        self._touched.pop(session_path, None)
+        self.touch(session_path)
+        logger.info("Rehydrated %s in %.0f ms", session_path, (time.perf_counter() - started) * 1000)
+        return True
+
+    def delete(self, session_path):
+        with session_lock(session_path):
+            shutil.rmtree(session_path, ignore_errors=True)
+        session_index_cache.invalidate(session_path)
+        retrieval_memo.invalidate(session_path)
+        self._touched.pop(session_path, None)
+        self.deleted += 1
+        if self.on_delete is not None:
+            self.on_delete(os.path.basename(session_path))
+
+    def _is_sweeper(self):
+        """Whether this process holds the host's sweep lock, taking it if it is free"""
+        if fcntl is None:
+            return True
+        if self._sweep_lock_fd is not None and self._sweep_lock_pid == os.getpid():
+            return True
+        os.makedirs(self.session_dir, exist_ok=True)
+        fd = os.open(os.path.join(self.session_dir, SWEEP_LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        # Kept open (and locked) until this process exits
+        self._sweep_lock_fd, self._sweep_lock_pid = fd, os.getpid()
+        return True
+
+    def sweep(self):
+        """Archive idle sessions, then delete least recently used ones until under the quota.
+
+        Returns False without doing anything when another process on the host is the sweeper.
+        """
+        with self._lock:
+            if not self._is_sweeper():
+                return False
+            now = time.time()
+            sessions = self.sessions()
+            if self.idle_seconds:
+                for session in sessions:
+                    if (session["tier"] == "hot" and now - session["last_access"] > self.idle_seconds
+                            and os.path.exists(os.path.join(session["path"], BUNDLE_FILE))):
+                        if self.archive(session["path"]):
+                            logger.info("Archived idle session %s", session["session_id"])
+                sessions = self.sessions()
+            if self.quota_bytes:
+                total = sum(session["bytes"] for session in sessions)
+                for session in sorted(sessions, key=lambda session: session["last_access"]):
+                    if total <= self.quota_bytes:
+                        break
+                    logger.warning("Session disk quota exceeded; deleting %s (%d bytes)",
+                                   session["session_id"], session["bytes"])
+                    self.delete(session["path"])
+                    total -= session["bytes"]
+            self.last_sweep_at = now
+            return True
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.sweep()
+            except Exception:
+                logger.exception("Session lifecycle sweep failed")
+
+    def start(self):
+        if self.interval and self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="session-lifecycle", daemon=True)
+            self._thread.start()
+
+    def shutdown(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def stats(self):
+        tiers = {tier: {"sessions": 0, "bytes": 0} for tier in ("hot", "archived")}
+        for session in self.sessions():
+            tiers[session["tier"]]["sessions"] += 1
+            tiers[session["tier"]]["bytes"] += session["bytes"]
+        return {
+            "tiers": tiers,
+            "quota_bytes": self.quota_bytes,
+            "idle_archive_seconds": self.idle_seconds,
+            "archived": self.archived,
+            "rehydrated": self.rehydrated,
+            "deleted": self.deleted,
+            "last_sweep_at": self.last_sweep_at,
+        }
+
+
+session_lifecycle = SessionLifecycleManager()
@@ -0,0 +1,266 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# sqlite: one file per host, shared by every worker process (needed with serve.py --workers > 1)
+# memory: per-process LRU, lost on restart; for single-process runs and tests
+SESSION_STORE_BACKEND = os.getenv("SESSION_STORE_BACKEND", "sqlite")
+SESSION_STORE_PATH = os.getenv("SESSION_STORE_PATH") or os.path.join(BASE_DIR, "user_session", "session_store.db")
+# Entries expire this long after their last write (0 = never)
+SESSION_STORE_TTL_SECONDS = int(os.getenv("SESSION_STORE_TTL_SECONDS", str(7 * 24 * 3600)))
+# Memory backend only: least recently used entries beyond this are dropped
+SESSION_STORE_MAX_ENTRIES = int(os.getenv("SESSION_STORE_MAX_ENTRIES", "10000"))
+# Values whose JSON is larger than this go to a payload file; the store keeps a reference
+SESSION_STORE_INLINE_MAX_KB = int(os.getenv("SESSION_STORE_INLINE_MAX_KB", "64"))
+SESSION_STORE_PAYLOAD_DIR = os.getenv("SESSION_STORE_PAYLOAD_DIR") or os.path.join(BASE_DIR, "user_session", ".payloads")
+
+PURGE_INTERVAL_SECONDS = 60
+_REF = "$payload"
+
+
+class SessionStore:
+    """JSON values by (namespace, key) with expiry; large values are kept by reference.
+
+    Backends implement _read/_write/_remove/_has/_keys over encoded JSON text.
+    Values above SESSION_STORE_INLINE_MAX_KB are written to a file under
+    payload_dir and the backend holds only {"$payload": name}, so the store's
+    own footprint stays small whatever the sessions contain.
+
+    A namespace may register a fallback: on a miss it is called with the key
+    and whatever it returns (unless None) is stored and returned. This rebuilds
+    records that expired, were evicted, or predate a restart from what is on disk.
+    """
+
+    def __init__(self, ttl=SESSION_STORE_TTL_SECONDS, inline_max_bytes=SESSION_STORE_INLINE_MAX_KB * 1024,
+                 payload_dir=SESSION_STORE_PAYLOAD_DIR):
+        self.ttl = ttl
+        self.inline_max_bytes = inline_max_bytes
+        self.payload_dir = payload_dir
+        self._fallbacks = {}
+
+    def register_fallback(self, namespace, loader):
+        self._fallbacks[namespace] = loader
+
+    def _expires_at(self, ttl):
+        ttl = self.ttl if ttl is None else ttl
+        return time.time() + ttl if ttl else None
+
+    def _payload_path(self, namespace, key):
+        digest = hashlib.sha256(f"{namespace}\0{key}".encode("utf-8")).hexdigest()
+        return os.path.join(self.payload_dir, namespace, f"{digest}.json")
+
+    def _encode(self, namespace, key, value):
+        text = json.dumps(value, default=str)
+        if len(text) <= self.inline_max_bytes:
+            self._remove_payload(namespace, key)
+            return text
+        path = self._payload_path(namespace, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+        return json.dumps({_REF: os.path.relpath(path, self.payload_dir)})
+
+    def _decode(self, text):
+        value = json.loads(text)
+        if isinstance(value, dict) and len(value) == 1 and _REF in value:
+            try:
+                with open(os.path.join(self.payload_dir, value[_REF]), encoding="utf-8") as f:
+                    return json.load(f)
+            except FileNotFoundError:
+                return None
+        return value
+
+    def _remove_payload(self, namespace, key):
+        try:
+            os.remove(self._payload_path(namespace, key))
+        except FileNotFoundError:
+            pass
+
+    def get(self, namespace, key, default=None):
+        text = self._read(namespace, key)
+        value = None if text is None else self._decode(text)
+        if value is None and namespace in self._fallbacks:
+            value = self._fallbacks[namespace](key)
+            if value is not None:
+                self.put(namespace, key, value)
+        return default if value is None else value
+
+    def put(self, namespace, key, value, ttl=None):
+        self._write(namespace, key, self._encode(namespace, key, value), self._expires_at(ttl))
+
+    def delete(self, namespace, key):
+        self._remove_payload(namespace, key)
+        return self._remove(namespace, key)
+
+    def contains(self, namespace, key):
+        if self._has(namespace, key):
+            return True
+        return namespace in self._fallbacks and self.get(namespace, key) is not None
+
+    def keys(self, namespace):
+        """Live keys of a namespace, oldest write first (records only a fallback knows are not listed)"""
+        return self._keys(namespace)
+
+    def close(self):
+        pass
+
+
+class MemorySessionStore(SessionStore):
+    """Per-process store: an LRU of encoded values, bounded by max_entries"""
+
+    def __init__(self, max_entries=SESSION_STORE_MAX_ENTRIES, **kwargs):
+        super().__init__(**kwargs)
+        self.max_entries = max_entries
+        self._entries = OrderedDict()   # (namespace, key) -> (text, expires_at, updated_at)
+        self._lock = threading.Lock()
+
+    def _live(self, item):
+        entry = self._entries.get(item)
+        if entry is not None and entry[1] is not None and entry[1] <= time.time():
+            del self._entries[item]
+            self._remove_payload(*item)
+            return None
+        return entry
+
+    def _read(self, namespace, key):
+        with self._lock:
+            entry = self._live((namespace, key))
+            if entry is None:
+                return None
+            self._entries.move_to_end((namespace, key))
+            return entry[0]
+
+    def _write(self, namespace, key, text, expires_at):
+        with self._lock:
+            self._entries[(namespace, key)] = (text, expires_at, time.time())
+            self._entries.move_to_end((namespace, key))
+            while len(self._entries) > self.max_entries:
+                evicted, _ = self._entries.popitem(last=False)
+                self._remove_payload(*evicted)
+
+    def _remove(self, namespace, key):
+        with self._lock:
+            return self._entries.pop((namespace, key), None) is not None
+
+    def _has(self, namespace, key):
+        with self._lock:
+            return self._live((namespace, key)) is not None
+
+    def _keys(self, namespace):
+        with self._lock:
+            items = [item for item in list(self._entries) if item[0] == namespace and self._live(item)]
+            return [key for _, key in sorted(items, key=lambda item: self._entries[item][2])]
+
+
+class SQLiteSessionStore(SessionStore):
+    """Store in one SQLite file, shared by every worker process on the host.
+
+    WAL mode lets readers proceed while one writer commits. Connections are
+    per thread and re-opened after a fork, since a SQLite handle must not
+    cross processes. Expired rows are skipped on read and deleted at most
+    once a minute, on a write.
+    """
+
+    def __init__(self, path=SESSION_STORE_PATH, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self._local = threading.local()
+        self._purged_at = 0.0
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL,"
+                " updated_at REAL NOT NULL, expires_at REAL, PRIMARY KEY (namespace, key))"
+            )
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(entries)")}
+            if "expires_at" not in columns:
+                # Store files written before entries could expire
+                conn.execute("ALTER TABLE entries ADD COLUMN expires_at REAL")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def _read(self, namespace, key):
+        row = self._conn().execute(
+            "SELECT value FROM entries WHERE namespace = ? AND key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (namespace, key, time.time()),
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def _write(self, namespace, key, text, expires_at):
+        now = time.time()
+        self._conn().execute(
+            "INSERT OR REPLACE INTO entries (namespace, key, value, updated_at, expires_at) VALUES (?, ?, ?, ?, ?)",
+            (namespace, key, text, now, expires_at),
+        )
+        if now - self._purged_at > PURGE_INTERVAL_SECONDS:
+            self._purged_at = now
+            self.purge_expired()
+
+    def _remove(self, namespace, key):
+        cursor = self._conn().execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, key))
+        return cursor.rowcount > 0
+
+    def _has(self, namespace, key):
+        return self._conn().execute(
+            "SELECT 1 FROM entries WHERE namespace = ? AND key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (namespace, key, time.time()),
+        ).fetchone() is not None
+
+    def _keys(self, namespace):
+        rows = self._conn().execute(
+            "SELECT key FROM entries WHERE namespace = ? AND (expires_at IS NULL OR expires_at > ?)"
+            " ORDER BY updated_at",
+            (namespace, time.time()),
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def purge_expired(self):
+        """Delete expired rows and their payload files; returns how many were removed"""
+        conn = self._conn()
+        now = time.time()
+        # One write transaction, so no row can be re-written between the select and the delete
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            expired = conn.execute(
+                "SELECT namespace, key, value FROM entries WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,)
+            ).fetchall()
+            for namespace, key, value in expired:
+                if _REF in value:
+                    self._remove_payload(namespace, key)
+            conn.execute("DELETE FROM entries WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return len(expired)
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            conn.close()
+        self._local.conn = None
+
+
+def open_session_store(backend=SESSION_STORE_BACKEND):
+    if backend == "memory":
+        return MemorySessionStore()
+    if backend == "sqlite":
+        return SQLiteSessionStore()
+    raise ValueError(f"Unknown SESSION_STORE_BACKEND {backend!r} (expected sqlite or memory)")
+
+
+session_store = open_session_store()
@@ -0,0 +1,294 @@
+from collections.abc import Sequence
+import numpy as np
+
+# Same defaults as rank_bm25.BM25Okapi, so scores match the old pickled index
+BM25_K1 = 1.5
+BM25_B = 0.75
+BM25_EPSILON = 0.25
+
+
+class Vocabulary(Sequence):
+    """Sorted terms as an offsets array into one UTF-8 blob, looked up by binary search.
+
+    A numpy unicode array would pad every term to the longest one at 4 bytes
+    per character; this costs the terms' UTF-8 length plus 8 bytes each.
+    Sorting str by code point is the same as sorting their UTF-8 bytes, so
+    the blob can be searched bytewise.
+    """
+
+    def __init__(self, offsets, blob):
+        self.offsets = offsets    # int64, len(terms) + 1
+        self.blob = blob          # uint8
+
+    @classmethod
+    def pack(cls, sorted_terms):
+        encoded = [term.encode("utf-8") for term in sorted_terms]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(term) for term in encoded], out=offsets[1:])
+        return cls(offsets, np.frombuffer(b"".join(encoded), dtype=np.uint8))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def _bytes(self, i):
+        return self.blob[self.offsets[i]:self.offsets[i + 1]].tobytes()
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        i = int(i)
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("term index out of range")
+        return self._bytes(i).decode("utf-8")
+
+    def find(self, term):
+        """Id of `term`, or -1 if it is not in the vocabulary"""
+        key = term.encode("utf-8")
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._bytes(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo if lo < len(self) and self._bytes(lo) == key else -1
+
+    def tolist(self):
+        text = self.blob.tobytes()
+        offsets = self.offsets.tolist()
+        return [text[start:end].decode("utf-8") for start, end in zip(offsets, offsets[1:])]
+
+    @property
+    def nbytes(self):
+        return self.offsets.nbytes + self.blob.nbytes
+
+
+class SparseBM25:
+    """BM25 over a CSR term -> document matrix of precomputed impact scores.
+
+    Row t of the matrix is the postings list of vocabulary term t: the ids of
+    the documents containing it and, per posting, the full BM25 contribution
+    idf(t) * tf * (k1 + 1) / (tf + k1 * norm(doc)). Query scoring therefore
+    only sums the postings of the query's terms, and top_k() prunes with
+    per-term upper bounds (MaxScore) once no unseen document can still make
+    the top k.
+    """
+
+    def __init__(self, terms, indptr, doc_ids, impacts, max_impact, doc_len, idf,
+                 k1=BM25_K1, b=BM25_B, tf=None, epsilon=BM25_EPSILON):
+        self.terms = terms              # sorted vocabulary (Vocabulary)
+        self.indptr = indptr            # int64, len(terms) + 1
+        self.doc_ids = doc_ids          # int32, one per posting
+        self.impacts = impacts          # float32, one per posting
+        self.max_impact = max_impact    # float32, highest impact per term
+        self.doc_len = doc_len          # int32, tokens per document
+        self.idf = idf                  # float32, per term
+        self.tf = tf                    # int32, term frequency per posting (None in files saved before append)
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+
+    @property
+    def n_docs(self):
+        return len(self.doc_len)
+
+    @property
+    def nbytes(self):
+        arrays = (self.terms, self.indptr, self.doc_ids, self.impacts,
+                  self.max_impact, self.doc_len, self.idf)
+        total = sum(array.nbytes for array in arrays)
+        return total + (self.tf.nbytes if self.tf is not None else 0)
+
+    @classmethod
+    def build(cls, tokenized_docs, k1=BM25_K1, b=BM25_B, epsilon=BM25_EPSILON):
+        terms, posting_terms, doc_ids, tf, doc_len = _count_postings(tokenized_docs)
+        return cls._from_postings(terms, posting_terms, doc_ids, tf, doc_len, k1, b, epsilon)
+
+    def append(self, tokenized_docs):
+        """New index with `tokenized_docs` added as documents n_docs, n_docs + 1, ...
+
+        Only the new documents are counted. Their postings are merged into the
+        existing ones, and idf and length-normalised impacts are recomputed
+        from the stored term frequencies, so the result equals a full build.
+        """
+        if self.tf is None:
+            raise ValueError("Index was saved without term frequencies; rebuild it with SparseBM25.build")
+        new_terms, new_posting_terms, new_doc_ids, new_tf, new_doc_len = _count_postings(
+            tokenized_docs, doc_offset=self.n_docs
+        )
+        old_list, new_list = self.terms.tolist(), new_terms.tolist()
+        merged = sorted(set(old_list).union(new_list))
+        position = {term: i for i, term in enumerate(merged)}
+        terms = Vocabulary.pack(merged)
+        posting_terms = np.concatenate([
+            np.array([position[term] for term in old_list], dtype=np.int64)[self._posting_terms()],
+            np.array([position[term] for term in new_list], dtype=np.int64)[new_posting_terms],
+        ])
+        doc_ids = np.concatenate([self.doc_ids, new_doc_ids])
+        tf = np.concatenate([self.tf, new_tf])
+        order = np.lexsort((doc_ids, posting_terms))
+        return self._from_postings(
+            terms, posting_terms[order], doc_ids[order], tf[order],
+            np.concatenate([self.doc_len, new_doc_len]), self.k1, self.b, self.epsilon,
+        )
+
+    def remove_docs(self, doc_ids):
+        """New index without `doc_ids`; later documents shift down to keep ids contiguous"""
+        if self.tf is None:
+            raise ValueError("Index was saved without term frequencies; rebuild it with SparseBM25.build")
+        removed = np.zeros(self.n_docs, dtype=bool)
+        removed[np.asarray(doc_ids, dtype=np.int64)] = True
+        new_ids = np.cumsum(~removed) - 1
+
+        keep = ~removed[self.doc_ids]
+        posting_terms = self._posting_terms()[keep]
+        used = np.unique(posting_terms)
+        terms = self.terms.tolist()
+        return self._from_postings(
+            Vocabulary.pack([terms[i] for i in used]), np.searchsorted(used, posting_terms), new_ids[self.doc_ids[keep]],
+            self.tf[keep], self.doc_len[~removed], self.k1, self.b, self.epsilon,
+        )
+
+    def _posting_terms(self):
+        return np.repeat(np.arange(len(self.terms), dtype=np.int64), np.diff(self.indptr))
+
+    @classmethod
+    def _from_postings(cls, terms, posting_terms, doc_ids, tf, doc_len, k1, b, epsilon):
+        """Index from postings sorted by term then doc: df, idf and impact scores"""
+        df = np.bincount(posting_terms, minlength=len(terms))
+        indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(df, out=indptr[1:])
+
+        idf = np.log(len(doc_len) - df + 0.5) - np.log(df + 0.5)
+        if len(idf):
+            idf[idf < 0] = epsilon * idf.mean()
+
+        avgdl = doc_len.mean() if len(doc_len) else 0.0
+        norm = k1 * (1 - b + b * doc_len / avgdl) if avgdl else np.full(len(doc_len), k1)
+        impacts = (idf[posting_terms] * tf * (k1 + 1) / (tf + norm[doc_ids])).astype(np.float32)
+
+        max_impact = np.zeros(len(terms), dtype=np.float32)
+        if len(impacts):
+            np.maximum.at(max_impact, posting_terms, impacts)
+
+        return cls(terms, indptr, doc_ids.astype(np.int32), impacts, max_impact, doc_len,
+                   idf.astype(np.float32), k1, b, tf.astype(np.int32), epsilon)
+
+    def save(self, path):
+        arrays = {} if self.tf is None else {"tf": self.tf}
+        with open(path, "wb") as f:
+            np.savez(
+                f, term_offsets=self.terms.offsets, term_text=self.terms.blob,
+                indptr=self.indptr, doc_ids=self.doc_ids,
+                impacts=self.impacts, max_impact=self.max_impact,
+                doc_len=self.doc_len, idf=self.idf,
+                params=np.array([self.k1, self.b, self.epsilon]), **arrays,
+            )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            params = data["params"].tolist()
+            tf = data["tf"] if "tf" in data.files else None
+            if "terms" in data.files:
+                # Saved as a fixed-width unicode array
+                terms = Vocabulary.pack(data["terms"].tolist())
+            else:
+                terms = Vocabulary(data["term_offsets"], data["term_text"])
+            return cls(terms, data["indptr"], data["doc_ids"], data["impacts"],
+                       data["max_impact"], data["doc_len"], data["idf"], *params[:2],
+                       tf=tf, epsilon=params[2] if len(params) > 2 else BM25_EPSILON)
+
+    def _query_terms(self, tokens):
+        """(term_id, count) for each distinct query token present in the vocabulary"""
+        counts = {}
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        matched = []
+        for token, count in counts.items():
+            pos = self.terms.find(token)
+            if pos >= 0:
+                matched.append((pos, count))
+        return matched
+
+    def _postings(self, term_id):
+        start, end = self.indptr[term_id], self.indptr[term_id + 1]
+        return self.doc_ids[start:end], self.impacts[start:end]
+
+    def get_scores(self, tokens):
+        """Dense score vector over all documents (BM25Okapi.get_scores compatible)"""
+        scores = np.zeros(self.n_docs, dtype=np.float64)
+        for term_id, count in self._query_terms(tokens):
+            docs, impacts = self._postings(term_id)
+            scores[docs] += count * impacts
+        return scores
+
+    def top_k(self, tokens, k):
+        """Exact top-k (doc_ids, scores), best first, with MaxScore pruning.
+
+        Terms are visited in decreasing upper-bound order. Once the k-th best
+        partial score reaches the summed upper bound of the terms still to
+        visit, unseen documents can no longer enter the top k, so the rest
+        of the postings are only applied to surviving candidates.
+        """
+        query = self._query_terms(tokens)
+        if not query or k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+        bounds = np.array([self.max_impact[t] * c for t, c in query], dtype=np.float64)
+        order = np.argsort(-bounds)
+        remaining = float(bounds.sum())
+
+        acc = np.zeros(self.n_docs, dtype=np.float64)
+        seen = np.empty(0, dtype=np.int64)
+        candidates = None
+        for i in order:
+            term_id, count = query[i]
+            docs, impacts = self._postings(term_id)
+            remaining -= bounds[i]
+
+            if candidates is None:
+                acc[docs] += count * impacts
+                seen = np.union1d(seen, docs)
+                if len(seen) > k:
+                    threshold = np.partition(acc[seen], -k)[-k]
+                    if remaining <= threshold:
+                        candidates = seen[acc[seen] + remaining >= threshold]
+            else:
+                mask = np.isin(docs, candidates, assume_unique=True)
+                acc[docs[mask]] += count * impacts[mask]
+
+        ids = seen if candidates is None else candidates
+        scores = acc[ids]
+        top = min(k, len(ids))
+        best = np.argpartition(-scores, top - 1)[:top] if top < len(ids) else np.arange(len(ids))
+        best = best[np.argsort(-scores[best], kind="stable")]
+        return ids[best], scores[best]
+
+
+def _count_postings(tokenized_docs, doc_offset=0):
+    """(terms, posting_terms, doc_ids, tf, doc_len) for a batch of documents, postings sorted by term then doc"""
+    vocab = {}
+    token_ids = []
+    doc_len = np.zeros(len(tokenized_docs), dtype=np.int32)
+    for doc_id, tokens in enumerate(tokenized_docs):
+        doc_len[doc_id] = len(tokens)
+        token_ids.extend(vocab.setdefault(token, len(vocab)) for token in tokens)
+
+    # Renumber terms in sorted order so lookups can binary-search the vocabulary
+    sorted_terms = sorted(vocab)
+    terms = Vocabulary.pack(sorted_terms)
+    remap = np.empty(len(vocab), dtype=np.int64)
+    remap[[vocab[term] for term in sorted_terms]] = np.arange(len(vocab))
+
+    token_ids = remap[np.asarray(token_ids, dtype=np.int64)]
+    token_docs = np.repeat(np.arange(len(tokenized_docs), dtype=np.int64), doc_len)
+
+    # One (term, doc) pair per posting, sorted by term then doc
+    n_docs = max(len(tokenized_docs), 1)
+    pairs, tf = np.unique(token_ids * n_docs + token_docs, return_counts=True)
+    posting_terms = pairs // n_docs
+    doc_ids = (pairs % n_docs + doc_offset).astype(np.int32)
+    return terms, posting_terms, doc_ids, tf, doc_len
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The app's modules live at the repository root, not in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Keep test sessions out of user_session/
+os.environ.setdefault("SESSION_STORE_BACKEND", "memory")
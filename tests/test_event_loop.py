@@ -0,0 +1,69 @@
+"""/health must keep answering while a /chat request waits on the LLM (user-009)"""
+import os
+import time
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+httpx = pytest.importorskip("httpx")
+
+CHAT_SECONDS = 1.0
+
+
+@pytest.fixture(scope="module")
+def backend(tmp_path_factory):
+    # The app mounts ./static at import time
+    cwd = os.getcwd()
+    workdir = tmp_path_factory.mktemp("app")
+    (workdir / "static").mkdir()
+    os.chdir(workdir)
+    try:
+        import fastapi_backend
+    finally:
+        os.chdir(cwd)
+    return fastapi_backend
+
+
+@pytest.fixture
+def slow_chat(backend, monkeypatch):
+    """/chat with retrieval stubbed out and an LLM call that takes CHAT_SECONDS without blocking the loop"""
+    import Ask_with_llm
+
+    async def agenerate_full(prompt, **kwargs):
+        await asyncio.sleep(CHAT_SECONDS)
+        return {"response": "answer"}
+
+    monkeypatch.setattr(backend, "_has_content", lambda session_id: True)
+    monkeypatch.setattr(Ask_with_llm, "retrieve_for_answer", lambda *args, **kwargs: ([], None, None))
+    monkeypatch.setattr(Ask_with_llm, "begin_session_turn",
+                        lambda *args, **kwargs: SimpleNamespace(prompt="prompt", state=SimpleNamespace(context=None)))
+    monkeypatch.setattr(Ask_with_llm.ollama_client, "agenerate_full", agenerate_full)
+    return backend.app
+
+
+def test_health_stays_responsive_during_chat(slow_chat):
+    async def scenario():
+        transport = httpx.ASGITransport(app=slow_chat)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            started = time.perf_counter()
+
+            async def chat():
+                response = await client.post("/chat", json={"message": "hi", "session_id": "s"})
+                return response, time.perf_counter() - started
+
+            async def health():
+                await asyncio.sleep(0.1)   # let /chat reach the LLM call first
+                response = await client.get("/health")
+                return response, time.perf_counter() - started
+
+            return await asyncio.gather(chat(), health())
+
+    # Both measured from the same start: /health must finish while /chat is still waiting
+    (chat_response, chat_done), (health_response, health_done) = asyncio.run(scenario())
+
+    assert chat_response.status_code == 200, chat_response.text
+    assert chat_response.json()["response"] == "answer"
+    assert health_response.status_code == 200
+    assert chat_done >= CHAT_SECONDS
+    assert health_done < CHAT_SECONDS / 2